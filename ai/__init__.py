@@ -1,18 +1,101 @@
+import pickle
 from typing import Any
-from . import yolo, clip
+from config import env
+from . import yolo, clip, remote
+from .loader import ModelSpec
 
 weights_dir = "./ai/weights"
 
+CLIP_NAME = "ViT-L-14-336"
+CLIP_WEIGHTS = f"{weights_dir}/ViT-L-14-336px.pt"
+YOLO_WEIGHTS = f"{weights_dir}/yolo11m-cls.pt"
+PRODUCT_FORECAST_WEIGHTS = f"{weights_dir}/linear_regression_product_model.pkl"
+REVENUE_FORECAST_WEIGHTS = f"{weights_dir}/xgb_revenue.pkl"
 
-def load_all_model() -> dict[Any, Any]:
+
+def __load_clip():
+    match env.CLIP_RUNTIME:
+        case "torch":
+            return clip.OpenCLIP(
+                CLIP_NAME, CLIP_WEIGHTS, quantize_text=env.CLIP_TEXT_INT8
+            )
+        case "onnx":
+            # onnxruntime is only needed when a model runs on it
+            from . import ort
+
+            return ort.OnnxCLIP(env.ONNX_DIR)
+        case _:
+            raise Exception(f"Unknow clip runtime:{env.CLIP_RUNTIME}")
+
+
+def __load_yolo():
+    match env.YOLO_RUNTIME:
+        case "torch":
+            return yolo.YOLOEmbed(YOLO_WEIGHTS)
+        case "onnx":
+            from . import ort
+
+            return ort.OnnxYOLOEmbed(env.ONNX_DIR)
+        case _:
+            raise Exception(f"Unknow yolo runtime:{env.YOLO_RUNTIME}")
+
+
+def __weight_files(runtime: str, torch_weights: str) -> tuple[str, ...]:
+    return (env.ONNX_DIR,) if runtime == "onnx" else (torch_weights,)
+
+
+def __load_pickle(path: str):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def model_loaders() -> dict[str, ModelSpec]:
+    if env.INFERENCE_SERVER_SOCKET:
+        # models live in the shared inference process, see ai/server.py
+        client = remote.InferenceClient(env.INFERENCE_SERVER_SOCKET)
+        return {
+            "yolo": ModelSpec(lambda: remote.RemoteYOLOEmbed(client)),
+            "clip": ModelSpec(lambda: remote.RemoteOpenCLIP(client)),
+        }
+    return local_model_loaders()
+
+
+def local_model_loaders() -> dict[str, ModelSpec]:
+    # the models in this process, what ai/server.py itself serves
     return {
-        "yolo": yolo.YOLOEmbed(f"{weights_dir}/yolo11m-cls.pt"),
-        "clip": clip.OpenCLIP("ViT-L-14-336", "./ai/weights/ViT-L-14-336px.pt"),
+        "yolo": ModelSpec(
+            __load_yolo, __weight_files(env.YOLO_RUNTIME, YOLO_WEIGHTS)
+        ),
+        "clip": ModelSpec(
+            __load_clip, __weight_files(env.CLIP_RUNTIME, CLIP_WEIGHTS)
+        ),
     }
 
 
-def load_all_stub_model() -> dict[Any, Any]:
+def stub_model_loaders() -> dict[str, ModelSpec]:
+    return {
+        "yolo": ModelSpec(yolo.YOLOEmbedStub),
+        "clip": ModelSpec(clip.OpenCLIPStub),
+    }
+
+
+def forecast_loaders() -> dict[str, ModelSpec]:
+    # pickled sklearn / xgboost models behind the manager revenue endpoints
     return {
-        "yolo": yolo.YOLOEmbedStub(),
-        "clip": clip.OpenCLIPStub(),
+        "product_forecast": ModelSpec(
+            lambda: __load_pickle(PRODUCT_FORECAST_WEIGHTS),
+            (PRODUCT_FORECAST_WEIGHTS,),
+        ),
+        "revenue_forecast": ModelSpec(
+            lambda: __load_pickle(REVENUE_FORECAST_WEIGHTS),
+            (REVENUE_FORECAST_WEIGHTS,),
+        ),
     }
+
+
+def load_all_model() -> dict[Any, Any]:
+    return {name: spec.load() for name, spec in model_loaders().items()}
+
+
+def load_all_stub_model() -> dict[Any, Any]:
+    return {name: spec.load() for name, spec in stub_model_loaders().items()}
@@ -0,0 +1,209 @@
+import asyncio
+import time
+import weakref
+from typing import Any, Callable
+
+from ai.executor import InferenceExecutor, inference_executor
+from config import env
+from etc.local_error import ServiceUnavailableError
+
+
+class BatchMetrics:
+    def __init__(self, max_batch_size: int) -> None:
+        self.max_batch_size = max_batch_size
+        self.batches = 0
+        self.items = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, size: int, waits: list[float]):
+        self.batches += 1
+        self.items += size
+        self.total_wait += sum(waits)
+        self.max_wait = max(self.max_wait, *waits)
+
+    def to_dict(self) -> dict[str, Any]:
+        fill_ratio = (
+            self.items / (self.batches * self.max_batch_size) if self.batches else 0.0
+        )
+        avg_wait = self.total_wait / self.items if self.items else 0.0
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "max_batch_size": self.max_batch_size,
+            "batch_fill_ratio": fill_ratio,
+            "avg_queue_wait_ms": avg_wait * 1000,
+            "max_queue_wait_ms": self.max_wait * 1000,
+        }
+
+
+class MicroBatcher:
+    # Flush once `max_batch_size` items are pending or `max_wait_ms` has passed
+    # since the first one. `fn` must return one row per item, in order.
+
+    def __init__(
+        self,
+        fn: Callable[[list[Any]], Any],
+        max_batch_size: int,
+        max_wait_ms: float,
+        executor: InferenceExecutor | None = None,
+        max_pending: int | None = None,
+    ) -> None:
+        self.fn = fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor
+        self.max_pending = max_pending
+        self.metrics = BatchMetrics(self.max_batch_size)
+        self.pending: list[tuple[Any, asyncio.Future, float]] = []
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.worker: asyncio.Task | None = None
+
+    def __ensure_worker(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if self.worker is None or self.worker.done() or self.loop is not loop:
+            self.loop = loop
+            self.pending = []
+            self.has_item = asyncio.Event()
+            self.is_full = asyncio.Event()
+            self.worker = loop.create_task(self.__collect())
+        return loop
+
+    async def submit(self, item: Any) -> Any:
+        loop = self.__ensure_worker()
+        if self.max_pending is not None and len(self.pending) >= self.max_pending:
+            raise ServiceUnavailableError(
+                "Inference queue is full, please retry later",
+                env.INFERENCE_RETRY_AFTER,
+            )
+        fut = loop.create_future()
+        self.pending.append((item, fut, time.perf_counter()))
+        self.has_item.set()
+        if len(self.pending) >= self.max_batch_size:
+            self.is_full.set()
+        return await fut
+
+    def stop(self):
+        # queued and running items fail with a 503, a later submit starts a
+        # new worker
+        if self.worker is not None:
+            self.worker.cancel()
+        self.worker = None
+        self.__fail(self.pending, self.__stopped())
+        self.pending = []
+
+    def __stopped(self) -> ServiceUnavailableError:
+        return ServiceUnavailableError(
+            "Inference batcher stopped, please retry later",
+            env.INFERENCE_RETRY_AFTER,
+        )
+
+    def __fail(self, batch: list[tuple[Any, asyncio.Future, float]], e: Exception):
+        for _, fut, _ in batch:
+            if not fut.done():
+                fut.set_exception(e)
+
+    async def __collect(self):
+        while True:
+            await self.has_item.wait()
+
+            if len(self.pending) < self.max_batch_size:
+                try:
+                    await asyncio.wait_for(self.is_full.wait(), self.max_wait)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = self.pending[: self.max_batch_size]
+            del self.pending[: self.max_batch_size]
+
+            if not self.pending:
+                self.has_item.clear()
+            if len(self.pending) < self.max_batch_size:
+                self.is_full.clear()
+
+            await self.__flush(batch)
+
+    async def __flush(self, batch: list[tuple[Any, asyncio.Future, float]]):
+        now = time.perf_counter()
+        self.metrics.record(len(batch), [now - t for _, _, t in batch])
+
+        try:
+            rows = await self._run([item for item, _, _ in batch])
+            if len(rows) != len(batch):
+                raise RuntimeError(
+                    f"Batched call returned {len(rows)} rows for {len(batch)} inputs"
+                )
+        except asyncio.CancelledError:
+            self.__fail(batch, self.__stopped())
+            raise
+        except Exception as e:
+            self.__fail(batch, e)
+            return
+
+        for (_, fut, _), row in zip(batch, rows):
+            if not fut.done():
+                fut.set_result(row)
+
+    async def _run(self, items: list[Any]):
+        if self.executor is None:
+            return self.fn(items)
+        return await self.executor.run(self.fn, items)
+
+
+_text_batchers: weakref.WeakKeyDictionary[Any, MicroBatcher] = (
+    weakref.WeakKeyDictionary()
+)
+_image_batchers: weakref.WeakKeyDictionary[Any, MicroBatcher] = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def text_batcher(clip_model) -> MicroBatcher:
+    if clip_model not in _text_batchers:
+        # weakref so the batcher does not keep a replaced model alive
+        model_ref = weakref.ref(clip_model)
+        _text_batchers[clip_model] = MicroBatcher(
+            lambda items: model_ref().encode_text(items),
+            env.CLIP_BATCH_SIZE,
+            env.CLIP_BATCH_WAIT_MS,
+            inference_executor,
+            env.CLIP_BATCH_SIZE * env.INFERENCE_QUEUE_SIZE,
+        )
+    return _text_batchers[clip_model]
+
+
+def image_batcher(clip_model) -> MicroBatcher:
+    if clip_model not in _image_batchers:
+        model_ref = weakref.ref(clip_model)
+        _image_batchers[clip_model] = MicroBatcher(
+            lambda items: model_ref().encode_image(items),
+            env.CLIP_BATCH_SIZE,
+            env.CLIP_BATCH_WAIT_MS,
+            inference_executor,
+            env.CLIP_BATCH_SIZE * env.INFERENCE_QUEUE_SIZE,
+        )
+    return _image_batchers[clip_model]
+
+
+async def encode_text(clip_model, text: str):
+    return await text_batcher(clip_model).submit(text)
+
+
+async def encode_image(clip_model, image):
+    return await image_batcher(clip_model).submit(image)
+
+
+def stop(clip_model=None):
+    # one model's batchers when it is unloaded, every batcher on shutdown
+    for batchers in (_text_batchers, _image_batchers):
+        for model, batcher in list(batchers.items()):
+            if clip_model is None or model is clip_model:
+                batcher.stop()
+                del batchers[model]
+
+
+def metrics() -> dict[str, Any]:
+    return {
+        "clip_text": [b.metrics.to_dict() for b in _text_batchers.values()],
+        "clip_image": [b.metrics.to_dict() for b in _image_batchers.values()],
+    }
@@ -1,7 +1,12 @@
-import open_clip
-import torch
+from typing import TYPE_CHECKING
+
 import numpy as np
 
+# torch and open_clip take seconds to import, they are pulled in when a
+# model is built so the API process can start without them
+if TYPE_CHECKING:
+    import torch
+
 
 class OpenCLIP:
     def __init__(
@@ -9,13 +14,19 @@ class OpenCLIP:
         model_name: str,
         pretrained: str,
         device: str = "cuda",
+        quantize_text: bool = False,
     ) -> None:
+        self.model_id = f"{model_name}:{pretrained}"
         self.device = self.__get_device(device)
         self.model, self.tokenizer, self.preprocess = self.__eval_model(
             model_name, pretrained
         )
+        if quantize_text:
+            self.__quantize_text()
+
+    def __get_device(self, device: str) -> "torch.device":
+        import torch
 
-    def __get_device(self, device: str):
         match device:
             case "cpu":
                 return torch.device("cpu")
@@ -33,6 +44,8 @@ class OpenCLIP:
         model_name: str,
         pretrained: str,
     ):
+        import open_clip
+
         model, _, preprocess = open_clip.create_model_and_transforms(
             model_name, pretrained=pretrained, device=self.device
         )
@@ -41,7 +54,23 @@ class OpenCLIP:
         tokenizer = open_clip.get_tokenizer(model_name)
         return model, tokenizer, preprocess
 
+    def __quantize_text(self):
+        import torch
+
+        if self.device.type != "cpu":
+            print("INT8 text encoder is cpu only, keep fp32")
+            return
+
+        # dynamic int8 on the Linear layers of the text transformer only, the
+        # image tower stays fp32 so stored image vectors remain comparable
+        self.model.transformer = torch.ao.quantization.quantize_dynamic(
+            self.model.transformer, {torch.nn.Linear}, dtype=torch.qint8
+        )
+        self.model_id += ":int8-text"
+
     def encode_text(self, search_text: str | list[str]):
+        import torch
+
         text_tokens = self.tokenizer(search_text)
 
         with torch.no_grad():
@@ -52,8 +81,10 @@ class OpenCLIP:
         return text_features.numpy()
 
     def encode_image(self, images):
-        image = [self.preprocess(img).unsqueeze(0) for img in images]  # type: ignore
-        image = torch.cat(image)
+        import torch
+
+        # one stacked batch instead of a cat over per-image unsqueezed copies
+        image = torch.stack([self.preprocess(img) for img in images])  # type: ignore
         with torch.no_grad():
             image_features = self.model.encode_image(image).float()
 
@@ -66,10 +97,12 @@ class OpenCLIPStub:
     def __init__(
         self,
     ) -> None:
-        pass
+        self.model_id = "stub"
 
     def encode_text(self, search_text: str | list[str]):
-        return [np.ones(768)]
+        if isinstance(search_text, str):
+            return np.ones((1, 768))
+        return np.ones((len(search_text), 768))
 
     def encode_image(self, images):
-        return [np.ones(768)]
+        return np.ones((len(images), 768))
@@ -0,0 +1,207 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, NamedTuple
+
+import numpy as np
+from PIL import Image
+
+from ai import batching, executor, image_io
+from config import env
+
+
+class EmbeddingCache:
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: float,
+        max_bytes: int | None = None,
+        sizeof: Callable[[Any], int] | None = None,
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda _: 0)
+        self.entries: OrderedDict[Hashable, tuple[float, int, Any]] = OrderedDict()
+        self.in_flight: dict[Hashable, asyncio.Future] = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Any | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, size, value = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            self.total_bytes -= size
+            self.expirations += 1
+            return None
+
+        self.entries.move_to_end(key)
+        return value
+
+    def __over_budget(self) -> bool:
+        if len(self.entries) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self.total_bytes > self.max_bytes
+
+    def put(self, key: Hashable, value: Any):
+        size = self.sizeof(value)
+        if self.max_entries <= 0:
+            return
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+
+        if key in self.entries:
+            self.total_bytes -= self.entries.pop(key)[1]
+
+        self.entries[key] = (time.monotonic() + self.ttl, size, value)
+        self.total_bytes += size
+
+        while self.__over_budget():
+            _, (_, evicted_size, _) = self.entries.popitem(last=False)
+            self.total_bytes -= evicted_size
+            self.evictions += 1
+
+    async def get_or_compute(
+        self,
+        key: Hashable,
+        compute: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        # concurrent misses on the same key wait for the first computation
+        if key in self.in_flight:
+            self.hits += 1
+            return await asyncio.shield(self.in_flight[key])
+
+        self.misses += 1
+        # a task of its own, cancelling the caller that started it does not
+        # fail the others waiting on it
+        task = asyncio.ensure_future(self.__compute(key, compute))
+        self.in_flight[key] = task
+        # mark retrieved so an unobserved failure is not logged
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        return await asyncio.shield(task)
+
+    async def __compute(
+        self, key: Hashable, compute: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        try:
+            value = await compute()
+        finally:
+            del self.in_flight[key]
+
+        self.put(key, value)
+        return value
+
+    def stats(self) -> dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_entries": self.max_entries,
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def normalize_prompt(prompt: str) -> str:
+    # the CLIP tokenizer lowercases and collapses whitespace anyway
+    return " ".join(prompt.lower().split())
+
+
+text_cache = EmbeddingCache(env.TEXT_EMBED_CACHE_SIZE, env.TEXT_EMBED_CACHE_TTL)
+
+
+async def encode_prompt(clip_model, prompt: str):
+    key = (getattr(clip_model, "model_id", id(clip_model)), normalize_prompt(prompt))
+    return await text_cache.get_or_compute(
+        key,
+        lambda: batching.encode_text(clip_model, prompt),
+    )
+
+
+class ImageEmbedding(NamedTuple):
+    yolo_classes: list[dict[str, Any]]
+    yolo_vec: np.ndarray
+    clip_vec: np.ndarray
+
+
+def image_embedding_size(value: ImageEmbedding) -> int:
+    # rough allowance for the class summary dicts and the tuple itself
+    return value.yolo_vec.nbytes + value.clip_vec.nbytes + 1024
+
+
+image_cache = EmbeddingCache(
+    env.IMAGE_EMBED_CACHE_SIZE,
+    env.IMAGE_EMBED_CACHE_TTL,
+    env.IMAGE_EMBED_CACHE_MB * 1024 * 1024,
+    image_embedding_size,
+)
+
+
+def image_key(image_bytes: bytes) -> str:
+    if not env.IMAGE_EMBED_CACHE_PIXEL_HASH:
+        return hashlib.sha256(image_bytes).hexdigest()
+
+    # opt-in, hash a small colour thumbnail so a re-encode of the same photo
+    # (different quality, metadata or format) still hits
+    image = image_io.open_image(image_bytes)
+    image.draft("RGB", (128, 128))
+    pixels = image.convert("RGB").resize((32, 32), Image.Resampling.BILINEAR)
+    quantized = bytes(p >> 3 for p in pixels.tobytes())
+    return "px:" + hashlib.sha256(quantized).hexdigest()
+
+
+async def hash_image(image_bytes: bytes) -> str:
+    # hashing megabytes or decoding a thumbnail, off the event loop
+    return await asyncio.to_thread(image_key, image_bytes)
+
+
+async def __compute_image(image_bytes: bytes, yolo_model, clip_model):
+    # decoded once, YOLO and CLIP preprocess the same pixels
+    image = [await asyncio.to_thread(image_io.load_image, image_bytes)]
+    yolo_classes, yolo_vec = (
+        await executor.run(yolo_model.classify_embed, image)
+    )[0]
+    clip_vec = await batching.encode_image(clip_model, image[0])
+    return ImageEmbedding(yolo_classes, np.asarray(yolo_vec), np.asarray(clip_vec))
+
+
+async def encode_search_image(
+    image_bytes: bytes,
+    yolo_model,
+    clip_model,
+    content_key: str | None = None,
+) -> ImageEmbedding:
+    key = (
+        getattr(yolo_model, "model_id", id(yolo_model)),
+        getattr(clip_model, "model_id", id(clip_model)),
+        content_key or await hash_image(image_bytes),
+    )
+    return await image_cache.get_or_compute(
+        key,
+        lambda: __compute_image(image_bytes, yolo_model, clip_model),
+    )
+
+
+def stats() -> dict[str, Any]:
+    return {
+        "text": text_cache.stats(),
+        "image": image_cache.stats(),
+    }
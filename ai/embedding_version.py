@@ -0,0 +1,49 @@
+# Lifecycle of embedding versions. A model change goes:
+#
+#   python -m ai.embedding_version start v2      # new tables, API queues writes
+#   EMBEDDING_VERSION=v2 python -m ai.reembed    # fill them with the new models
+#   python -m ai.embedding_version cutover v2    # v2 active, v1 retired
+#   # roll the API out with EMBEDDING_VERSION=v2 and the new weights
+#   python -m ai.embedding_version gc --min-age 3600
+#
+# Every worker searches the tables of its own EMBEDDING_VERSION, so old and new
+# workers both serve correct results during the rollout.
+import argparse
+import asyncio
+import json
+
+from db.postgresql import embedding_version, engine, vector_index
+
+
+async def main(command: str, version: str | None, force: bool, min_age: float):
+    async with engine.begin() as conn:
+        match command:
+            case "start":
+                await embedding_version.register(conn, version)  # type: ignore
+                await vector_index.ensure_vector_indexes(conn)
+            case "cutover":
+                await embedding_version.cutover(conn, version, force)  # type: ignore
+            case "gc":
+                collected = await embedding_version.gc(conn, min_age)
+                print(f"collected: {collected}")
+            case "status":
+                pass
+            case _:
+                raise Exception(f"Unknow command:{command}")
+
+        print(json.dumps(await embedding_version.status(conn), indent=2, default=str))
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["start", "status", "cutover", "gc"])
+    parser.add_argument("version", nargs="?")
+    parser.add_argument("--force", action="store_true")
+    parser.add_argument("--min-age", type=float, default=60 * 60)
+    args = parser.parse_args()
+
+    if args.command in ("start", "cutover") and not args.version:
+        parser.error(f"{args.command} needs a version")
+
+    asyncio.run(main(args.command, args.version, args.force, args.min_age))
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+
+from config import env
+from etc.local_error import ServiceUnavailableError
+
+
+class InferenceExecutor:
+    # torch and onnx release the GIL while running, so a thread pool gives real
+    # parallelism without pickling the models into worker processes
+
+    def __init__(self, max_workers: int, max_queue: int, retry_after: int) -> None:
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self.retry_after = retry_after
+        self.pool = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="inference",
+        )
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.in_flight = 0
+        self.rejected = 0
+
+    def __task(self, fn: Callable[..., Any]):
+        with self.lock:
+            self.in_flight += 1
+        try:
+            return fn()
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def __done(self, _: Future):
+        with self.lock:
+            self.pending -= 1
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        with self.lock:
+            if self.pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise ServiceUnavailableError(
+                    "Inference queue is full, please retry later",
+                    self.retry_after,
+                )
+            self.pending += 1
+
+        fut = self.pool.submit(self.__task, partial(fn, *args, **kwargs))
+        fut.add_done_callback(self.__done)
+        return await asyncio.wrap_future(fut)
+
+    def stats(self) -> dict[str, int]:
+        with self.lock:
+            return {
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "queue_depth": self.pending - self.in_flight,
+                "rejected": self.rejected,
+            }
+
+
+inference_executor = InferenceExecutor(
+    env.INFERENCE_WORKERS,
+    env.INFERENCE_QUEUE_SIZE,
+    env.INFERENCE_RETRY_AFTER,
+)
+
+
+async def run(fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    return await inference_executor.run(fn, *args, **kwargs)
+
+
+def stats() -> dict[str, int]:
+    return inference_executor.stats()
@@ -0,0 +1,175 @@
+# Export the CLIP towers and the YOLO classifier to ONNX for the onnx runtime
+# (CLIP_RUNTIME / YOLO_RUNTIME = onnx). Rerun after changing the weights.
+#
+#   python -m ai.export --out ./ai/weights/onnx
+import argparse
+import json
+import os
+
+import numpy as np
+import torch
+from PIL import Image
+
+import ai
+from ai import clip, ort, yolo
+from config import env
+
+OPSET = 17
+
+
+class CLIPTextTower(torch.nn.Module):
+    def __init__(self, model) -> None:
+        super().__init__()
+        self.model = model
+
+    def forward(self, tokens):
+        return self.model.encode_text(tokens, normalize=True)
+
+
+class CLIPImageTower(torch.nn.Module):
+    def __init__(self, model) -> None:
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixels):
+        return self.model.encode_image(pixels, normalize=True)
+
+
+class YOLOTower(torch.nn.Module):
+    # class probabilities and the pooled features YOLOEmbed captures with its
+    # forward hook, in one graph
+    def __init__(self, model) -> None:
+        super().__init__()
+        self.layers = model.model
+
+    def forward(self, pixels):
+        x = pixels
+        for layer in self.layers[:-1]:
+            x = layer(x)
+        embed = torch.nn.functional.adaptive_avg_pool2d(x, (1, 1)).flatten(1)
+
+        head = self.layers[-1]
+        logits = head.linear(head.drop(head.pool(head.conv(x)).flatten(1)))
+        return logits.softmax(1), embed
+
+
+def export_graph(module, sample, path: str, inputs: list[str], outputs: list[str]):
+    module.eval()
+    torch.onnx.export(
+        module,
+        (sample,),
+        path,
+        input_names=inputs,
+        output_names=outputs,
+        dynamic_axes={n: {0: "batch"} for n in inputs + outputs},
+        opset_version=OPSET,
+    )
+
+
+def export_clip(clip_model: clip.OpenCLIP, out: str):
+    model = clip_model.model.float().cpu()
+    preprocess_cfg = dict(model.visual.preprocess_cfg)
+
+    tokens = clip_model.tokenizer(["a photo of food", "fresh vegetables"])
+    export_graph(
+        CLIPTextTower(model),
+        tokens,
+        os.path.join(out, ort.CLIP_TEXT),
+        ["tokens"],
+        ["embed"],
+    )
+
+    size = preprocess_cfg["size"]
+    size = size if isinstance(size, int) else size[0]
+    pixels = torch.randn(2, 3, size, size)
+    export_graph(
+        CLIPImageTower(model),
+        pixels,
+        os.path.join(out, ort.CLIP_IMAGE),
+        ["pixels"],
+        ["embed"],
+    )
+
+    with open(os.path.join(out, ort.CLIP_CONFIG), "w") as f:
+        json.dump(
+            {
+                "model_name": ai.CLIP_NAME,
+                "model_id": clip_model.model_id,
+                "preprocess": preprocess_cfg,
+            },
+            f,
+        )
+
+
+def export_yolo(yolo_model: yolo.YOLOEmbed, out: str):
+    model = yolo_model.model.model.float().cpu()  # type: ignore
+    imgsz = yolo_model.model.overrides.get("imgsz", 224)
+
+    export_graph(
+        YOLOTower(model),
+        torch.randn(2, 3, imgsz, imgsz),
+        os.path.join(out, ort.YOLO_GRAPH),
+        ["pixels"],
+        ["probs", "embed"],
+    )
+
+    with open(os.path.join(out, ort.YOLO_CONFIG), "w") as f:
+        json.dump(
+            {
+                "model_id": yolo_model.model_id,
+                "imgsz": imgsz,
+                "names": {int(k): v for k, v in model.names.items()},
+            },
+            f,
+        )
+
+
+def check_export(torch_models: dict, out: str):
+    # same inputs through both runtimes, the graphs are plain fp32
+    onnx_clip = ort.OnnxCLIP(out)
+    onnx_yolo = ort.OnnxYOLOEmbed(out)
+
+    texts = ["beef steak", "green vegetable soup", "mealkit for two"]
+    rng = np.random.default_rng(0)
+    images = [
+        Image.fromarray(rng.integers(0, 255, (400, 300, 3), dtype=np.uint8))
+        for _ in range(2)
+    ]
+
+    pairs = {
+        "clip text": (
+            torch_models["clip"].encode_text(texts),
+            onnx_clip.encode_text(texts),
+        ),
+        "clip image": (
+            torch_models["clip"].encode_image(images),
+            onnx_clip.encode_image(images),
+        ),
+        "yolo embed": (
+            torch_models["yolo"].embed(images),
+            onnx_yolo.embed(images),
+        ),
+    }
+    for name, (expected, actual) in pairs.items():
+        diff = np.abs(np.asarray(expected) - np.asarray(actual)).max()
+        print(f"{name:<12} max abs diff {diff:.2e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", default=env.ONNX_DIR)
+    parser.add_argument("--skip-check", action="store_true")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+
+    torch_models = {
+        "clip": clip.OpenCLIP(ai.CLIP_NAME, ai.CLIP_WEIGHTS, device="cpu"),
+        "yolo": yolo.YOLOEmbed(ai.YOLO_WEIGHTS),
+    }
+    export_clip(torch_models["clip"], args.out)
+    export_yolo(torch_models["yolo"], args.out)
+    print(f"Exported ONNX graphs to {args.out}")
+
+    if not args.skip_check:
+        check_export(torch_models, args.out)
@@ -0,0 +1,48 @@
+import math
+from io import BytesIO
+
+from PIL import Image, UnidentifiedImageError
+
+from config import env
+from etc.local_error import HandledError
+
+# shortest side the models resize to, CLIP ViT-L-14-336 needs 336 and the
+# YOLO classifier 224
+MODEL_INPUT_SIZE = 336
+
+
+def open_image(data: bytes) -> Image.Image:
+    # only the header is read here, so oversized uploads are refused before
+    # any pixel is decoded
+    try:
+        image = Image.open(BytesIO(data))
+    except (UnidentifiedImageError, Image.DecompressionBombError) as e:
+        raise HandledError(f"Unsupported image: {e}")
+
+    w, h = image.size
+    if w * h > env.IMAGE_MAX_PIXELS:
+        raise HandledError(f"Image is too large: {w}x{h}")
+    return image
+
+
+def load_image(data: bytes, min_side: int = MODEL_INPUT_SIZE) -> Image.Image:
+    image = open_image(data)
+    w, h = image.size
+    scale = min_side / min(w, h)
+
+    try:
+        if scale < 1:
+            # JPEG decodes straight to 1/2, 1/4 or 1/8 scale, never below the
+            # requested size, other formats ignore this
+            image.draft("RGB", (math.ceil(w * scale), math.ceil(h * scale)))
+        image = image.convert("RGB")
+    except OSError as e:
+        raise HandledError(f"Cannot decode image: {e}")
+
+    # formats without draft mode, shrink by a whole factor and stay above
+    # min_side so the models' own resize still sees enough pixels
+    factor = min(image.size) // min_side
+    if factor >= 2:
+        image = image.reduce(factor)
+
+    return image
@@ -0,0 +1,254 @@
+import asyncio
+import contextvars
+import gc
+import hashlib
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Mapping, NamedTuple
+
+from PIL import Image
+
+from ai import batching
+from config import env
+from etc.local_error import ServiceUnavailableError
+
+logger = logging.getLogger("uvicorn.info")
+
+
+class ModelSpec(NamedTuple):
+    load: Callable[[], Any]
+    # weight files (or directories) the version is derived from
+    files: tuple[str, ...] = ()
+
+
+def fingerprint(files: tuple[str, ...]) -> str:
+    if not files:
+        return "static"
+
+    paths = []
+    for path in files:
+        if os.path.isdir(path):
+            paths.extend(sorted(os.path.join(path, f) for f in os.listdir(path)))
+        else:
+            paths.append(path)
+
+    digest = hashlib.sha1()
+    for path in paths:
+        st = os.stat(path)
+        digest.update(f"{path}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return digest.hexdigest()[:10]
+
+
+def warm_up(name: str, model: Any):
+    # first inference allocates buffers and picks kernels, pay it before
+    # traffic does
+    match name:
+        case "clip":
+            model.encode_text(["warm up"])
+            model.encode_image([Image.new("RGB", (336, 336))])
+        case "yolo":
+            model.classify_embed([Image.new("RGB", (224, 224))])
+        case _:
+            pass
+
+
+class ModelVersion:
+    def __init__(self, name: str, version: str, model: Any) -> None:
+        self.name = name
+        self.version = version
+        self.model = model
+        self.loaded_at = time.time()
+        self.in_flight = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        # no longer in its slot, the last request to release it frees it
+        self.retired = False
+
+    def acquire(self):
+        self.in_flight += 1
+        self.idle.clear()
+
+    def release(self):
+        self.in_flight -= 1
+        if self.in_flight == 0:
+            self.idle.set()
+            if self.retired:
+                self.unload()
+
+    def unload(self):
+        if self.model is not None:
+            batching.stop(self.model)
+        self.model = None
+        gc.collect()
+        logger.info(f"Model {self.name}@{self.version} unloaded")
+
+
+# versions used by the current request, held until its response is sent
+_leases: contextvars.ContextVar[dict[str, ModelVersion] | None] = (
+    contextvars.ContextVar("model_leases", default=None)
+)
+
+
+@contextmanager
+def model_leases():
+    leases: dict[str, ModelVersion] = {}
+    token = _leases.set(leases)
+    try:
+        yield leases
+    finally:
+        _leases.reset(token)
+        for version in leases.values():
+            version.release()
+
+
+class ModelSlot:
+    def __init__(self, name: str, spec: ModelSpec) -> None:
+        self.name = name
+        self.spec = spec
+        self.active: ModelVersion | None = None
+        self.retired: list[ModelVersion] = []
+        self.lock = asyncio.Lock()
+        self.state = "pending"
+        self.load_seconds: float | None = None
+        self.warm_up_seconds: float | None = None
+        self.error: str | None = None
+
+    def build(self, version: str) -> Any:
+        self.state = "loading"
+        start = time.perf_counter()
+        model = self.spec.load()
+        self.load_seconds = time.perf_counter() - start
+
+        self.state = "warming_up"
+        start = time.perf_counter()
+        warm_up(self.name, model)
+        self.warm_up_seconds = time.perf_counter() - start
+
+        if hasattr(model, "model_id"):
+            # embedding caches are keyed by model_id, new weights need new keys
+            model.model_id = f"{model.model_id}@{version}"
+        return model
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "state": self.state,
+            "version": self.active.version if self.active else None,
+            "loaded_at": self.active.loaded_at if self.active else None,
+            "load_seconds": self.load_seconds,
+            "warm_up_seconds": self.warm_up_seconds,
+            "error": self.error,
+            "draining": [
+                {"version": v.version, "in_flight": v.in_flight} for v in self.retired
+            ],
+        }
+
+
+class ModelStore(Mapping):
+    # stands in for the old `ai_models` dict. A model that is still loading
+    # raises a 503, a request keeps the version it first got until it ends.
+
+    def __init__(self, specs: dict[str, ModelSpec]) -> None:
+        self.slots = {name: ModelSlot(name, spec) for name, spec in specs.items()}
+        self.task: asyncio.Task | None = None
+        self.watcher: asyncio.Task | None = None
+
+    def __getitem__(self, name: str) -> Any:
+        leases = _leases.get()
+        if leases is not None and name in leases:
+            return leases[name].model
+
+        slot = self.slots[name]
+        if slot.active is None:
+            raise ServiceUnavailableError(
+                f"Model {name} is {slot.state}, please retry later",
+                env.MODEL_RETRY_AFTER,
+            )
+
+        if leases is not None:
+            slot.active.acquire()
+            leases[name] = slot.active
+        return slot.active.model
+
+    def __contains__(self, name) -> bool:
+        return name in self.slots
+
+    def __iter__(self):
+        return iter(self.slots)
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    async def __drain(self, slot: ModelSlot, old: ModelVersion):
+        try:
+            await asyncio.wait_for(old.idle.wait(), env.MODEL_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Model {old.name}@{old.version} still has {old.in_flight} "
+                "requests after drain timeout, unloading when they finish"
+            )
+        slot.retired.remove(old)
+        old.retired = True
+        if old.in_flight == 0:
+            old.unload()
+
+    async def reload(self, name: str, force: bool = False) -> bool:
+        slot = self.slots[name]
+        async with slot.lock:
+            try:
+                version = fingerprint(slot.spec.files)
+                if not force and slot.active and slot.active.version == version:
+                    return False
+
+                model = await asyncio.to_thread(slot.build, version)
+            except Exception as e:
+                # a failed reload keeps serving the version already loaded
+                slot.state = "ready" if slot.active else "failed"
+                slot.error = repr(e)
+                logger.error(f"Model {name} failed to load: {e!r}")
+                return False
+
+            # the switch is a single assignment on the event loop, requests
+            # that already hold the old version finish on it
+            old, slot.active = slot.active, ModelVersion(name, version, model)
+            slot.state = "ready"
+            slot.error = None
+            logger.info(
+                f"Model {name}@{version} ready, load {slot.load_seconds:.1f}s "
+                f"warm up {slot.warm_up_seconds:.1f}s"
+            )
+
+        if old is not None:
+            slot.retired.append(old)
+            asyncio.get_running_loop().create_task(self.__drain(slot, old))
+        return True
+
+    async def load_all(self):
+        await asyncio.gather(*[self.reload(name, force=True) for name in self.slots])
+
+    async def __watch(self):
+        while True:
+            await asyncio.sleep(env.MODEL_WATCH_INTERVAL)
+            for name, slot in self.slots.items():
+                if not slot.spec.files:
+                    continue
+                try:
+                    await self.reload(name)
+                except Exception as e:
+                    logger.error(f"Model {name} reload check failed: {e!r}")
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self.task = loop.create_task(self.load_all())
+        if env.MODEL_WATCH_INTERVAL > 0:
+            self.watcher = loop.create_task(self.__watch())
+
+    def ready(self) -> bool:
+        return all(s.active is not None for s in self.slots.values())
+
+    def status(self) -> dict[str, Any]:
+        return {
+            "ready": self.ready(),
+            "models": {name: s.to_dict() for name, s in self.slots.items()},
+        }
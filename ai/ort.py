@@ -0,0 +1,139 @@
+import json
+import os
+from typing import Any, NamedTuple
+
+import numpy as np
+import onnxruntime
+import open_clip
+from open_clip.transform import PreprocessCfg, image_transform_v2
+from PIL import ImageFile
+from ultralytics.data.augment import classify_transforms
+
+from config import env
+
+CLIP_TEXT = "clip_text.onnx"
+CLIP_IMAGE = "clip_image.onnx"
+CLIP_CONFIG = "clip.json"
+YOLO_GRAPH = "yolo_cls.onnx"
+YOLO_CONFIG = "yolo.json"
+
+
+def session_options() -> onnxruntime.SessionOptions:
+    opts = onnxruntime.SessionOptions()
+    opts.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    opts.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+
+    # the inference executor already runs INFERENCE_WORKERS graphs at once,
+    # split the cores between them instead of oversubscribing
+    threads = env.ORT_INTRA_OP_THREADS or max(
+        1, (os.cpu_count() or 1) // env.INFERENCE_WORKERS
+    )
+    opts.intra_op_num_threads = threads
+    opts.inter_op_num_threads = 1
+    # idle threads spin by default, which steals cores from the other sessions
+    opts.add_session_config_entry("session.intra_op.allow_spinning", "0")
+    return opts
+
+
+def load_session(path: str) -> onnxruntime.InferenceSession:
+    return onnxruntime.InferenceSession(
+        path,
+        sess_options=session_options(),
+        providers=["CPUExecutionProvider"],
+    )
+
+
+def load_config(export_dir: str, name: str) -> dict[str, Any]:
+    with open(os.path.join(export_dir, name)) as f:
+        return json.load(f)
+
+
+class OnnxCLIP:
+    def __init__(self, export_dir: str) -> None:
+        cfg = load_config(export_dir, CLIP_CONFIG)
+        self.model_id = f"{cfg['model_id']}:onnx"
+        self.tokenizer = open_clip.get_tokenizer(cfg["model_name"])
+        self.preprocess = image_transform_v2(
+            PreprocessCfg(**cfg["preprocess"]), is_train=False
+        )
+        self.text_session = load_session(os.path.join(export_dir, CLIP_TEXT))
+        self.image_session = load_session(os.path.join(export_dir, CLIP_IMAGE))
+
+    def encode_text(self, search_text: str | list[str]):
+        tokens = self.tokenizer(search_text).numpy()
+        return self.text_session.run(None, {"tokens": tokens})[0]
+
+    def encode_image(self, images):
+        pixels = np.stack([self.preprocess(img).numpy() for img in images])
+        return self.image_session.run(None, {"pixels": pixels})[0]
+
+
+class OnnxProbs(NamedTuple):
+    # the parts of ultralytics Probs that callers read
+    data: np.ndarray
+
+    @property
+    def top1(self) -> int:
+        return int(np.argmax(self.data))
+
+    @property
+    def top5(self) -> list[int]:
+        return [int(i) for i in np.argsort(-self.data)[:5]]
+
+    @property
+    def top1conf(self) -> float:
+        return float(self.data[self.top1])
+
+    @property
+    def top5conf(self) -> np.ndarray:
+        return self.data[self.top5]
+
+
+class OnnxResults(NamedTuple):
+    # stands in for the ultralytics Results of a classification predict
+    names: dict[int, str]
+    probs: OnnxProbs
+
+    def summary(self) -> list[dict[str, Any]]:
+        return [
+            {
+                "name": self.names[i],
+                "class": i,
+                "confidence": round(float(self.probs.data[i]), 5),
+            }
+            for i in self.probs.top5
+        ]
+
+
+class OnnxYOLOEmbed:
+    def __init__(self, export_dir: str) -> None:
+        cfg = load_config(export_dir, YOLO_CONFIG)
+        self.model_id = f"{cfg['model_id']}:onnx"
+        self.names = {int(k): v for k, v in cfg["names"].items()}
+        self.preprocess = classify_transforms(size=cfg["imgsz"])
+        self.session = load_session(os.path.join(export_dir, YOLO_GRAPH))
+
+    def __forward(self, image: list[ImageFile.ImageFile]):
+        pixels = np.stack([
+            self.preprocess(img.convert("RGB")).numpy() for img in image
+        ])
+        probs, embeds = self.session.run(None, {"pixels": pixels})
+        return probs, embeds
+
+    def __results(self, probs: np.ndarray) -> list[OnnxResults]:
+        return [OnnxResults(self.names, OnnxProbs(p)) for p in probs]
+
+    def classify_embed(
+        self,
+        image: list[ImageFile.ImageFile],
+        top_k: int = 5,
+    ) -> list[tuple[list[dict[str, Any]], np.ndarray]]:
+        probs, embeds = self.__forward(image)
+        results = self.__results(probs)
+        return [(r.summary()[:top_k], e) for r, e in zip(results, embeds)]
+
+    def embed(self, image: list[ImageFile.ImageFile]):
+        return self.__forward(image)[1]
+
+    def predict(self, image: list[ImageFile.ImageFile]):
+        return self.__results(self.__forward(image)[0])
@@ -0,0 +1,301 @@
+# Recompute product and blog embeddings with the configured models, after a
+# CLIP / YOLO change. Rows are streamed in id order and the last committed id
+# is checkpointed, so an interrupted run picks up where it stopped.
+#
+# Vectors go to the EMBEDDING_VERSION tables, the version is registered as
+# migrating if it is new. Rows written by the API meanwhile, and rows whose
+# image failed, are queued in the backlog and re-embedded after the full pass.
+#
+#   EMBEDDING_VERSION=v2 python -m ai.reembed --tables product blog
+#   python -m ai.reembed --restart
+#   python -m ai.reembed --backlog-only
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import urllib.request
+from typing import Any
+
+import numpy as np
+import sqlalchemy as sqla
+from sqlalchemy.dialects import postgresql as psql
+
+import ai
+from ai import image_io
+from config import env
+from db.postgresql import DBSession, embedding_version, engine
+from db.postgresql.models.blog import Blog, BlogEmbedding, ProductDoc
+from db.postgresql.models.product import Product, ProductEmbedding
+
+logger = logging.getLogger("uvicorn.info")
+
+
+class Checkpoint:
+    def __init__(self, path: str, restart: bool) -> None:
+        self.path = path
+        self.state: dict[str, dict[str, Any]] = {}
+        if not restart and os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+
+    def last_id(self, table: str) -> str | None:
+        return self.state.get(table, {}).get("last_id")
+
+    def done(self, table: str) -> int:
+        return self.state.get(table, {}).get("done", 0)
+
+    def save(self, table: str, last_id: str, done: int):
+        self.state[table] = {"last_id": last_id, "done": done}
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp, self.path)
+
+
+class Progress:
+    def __init__(self, table: str, total: int, done: int) -> None:
+        self.table = table
+        self.total = total
+        self.done = done
+        self.processed = 0
+        self.failed = 0
+        self.start = time.perf_counter()
+
+    def update(self, processed: int, failed: int):
+        self.processed += processed
+        self.failed += failed
+        self.done += processed + failed
+
+        elapsed = time.perf_counter() - self.start
+        rate = self.processed / elapsed if elapsed else 0.0
+        remaining = max(self.total - self.done, 0)
+        eta = remaining / rate if rate else float("inf")
+        logger.info(
+            f"{self.table}: {self.done}/{self.total} "
+            f"({rate:.1f} items/s, failed {self.failed}, eta {eta:.0f}s)"
+        )
+
+
+def fetch_bytes(url: str) -> bytes:
+    with urllib.request.urlopen(url, timeout=30) as res:
+        return res.read()
+
+
+async def load_images(urls: list[str], concurrency: int) -> list[Any]:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def load(url: str):
+        async with sem:
+            try:
+                data = await asyncio.to_thread(fetch_bytes, url)
+                return await asyncio.to_thread(image_io.load_image, data)
+            except Exception as e:
+                logger.warning(f"Skip image {url}: {e!r}")
+                return None
+
+    return await asyncio.gather(*[load(u) for u in urls])
+
+
+def product_query(after: str | None):
+    query = (
+        sqla.select(
+            Product.id,
+            Product.image_url,
+            Product.product_types,
+            ProductDoc.description,
+        )
+        .join(ProductDoc, ProductDoc.id == Product.id)
+        .order_by(Product.id)
+    )
+    return query.filter(Product.id > after) if after else query
+
+
+def blog_query(after: str | None):
+    query = sqla.select(Blog.id, Blog.description).order_by(Blog.id)
+    return query.filter(Blog.id > after) if after else query
+
+
+async def embed_products(rows, models, concurrency: int) -> list[dict[str, Any]]:
+    images = await load_images([r.image_url for r in rows], concurrency)
+    ok = [(r, img) for r, img in zip(rows, images) if img is not None]
+    if not ok:
+        return []
+
+    clip_model = models["clip"]
+    descriptions = [r.description for r, _ in ok]
+    pixels = [img for _, img in ok]
+
+    text = await asyncio.to_thread(clip_model.encode_text, descriptions)
+    clip_vec = await asyncio.to_thread(clip_model.encode_image, pixels)
+    yolo_vec = await asyncio.to_thread(models["yolo"].embed, pixels)
+
+    return [
+        {
+            "id": r.id,
+            "description_embed": np.asarray(text[i]),
+            "images_embed_clip": np.asarray(clip_vec[i]),
+            "images_embed_yolo": np.asarray(yolo_vec[i]),
+            "product_type": r.product_types,
+        }
+        for i, (r, _) in enumerate(ok)
+    ]
+
+
+async def embed_blogs(rows, models, concurrency: int) -> list[dict[str, Any]]:
+    text = await asyncio.to_thread(
+        models["clip"].encode_text, [r.description for r in rows]
+    )
+    return [
+        {"id": r.id, "description_embed": np.asarray(text[i])}
+        for i, r in enumerate(rows)
+    ]
+
+
+TABLES = {
+    "product": (ProductEmbedding, product_query, embed_products),
+    "blog": (BlogEmbedding, blog_query, embed_blogs),
+}
+
+
+async def write_vectors(ss, model, values: list[dict[str, Any]]):
+    # one INSERT .. ON CONFLICT per batch, also fills rows that never got an
+    # embedding
+    if not values:
+        return
+    target = embedding_version.table(model)
+    stmt = psql.insert(target).values(values)
+    columns = [c for c in values[0] if c != "id"]
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[target.c.id],
+        set_={c: stmt.excluded[c] for c in columns},
+    )
+    await ss.execute(stmt)
+
+
+async def reembed_table(
+    table: str,
+    models: dict[str, Any],
+    checkpoint: Checkpoint,
+    batch_size: int,
+    concurrency: int,
+):
+    target, query, embed = TABLES[table]
+    # a new version starts from the beginning
+    key = f"{table}@{env.EMBEDDING_VERSION}"
+    after = checkpoint.last_id(key)
+
+    async with DBSession() as ss, ss.begin():
+        total = await ss.scalar(
+            sqla.select(sqla.func.count()).select_from(query(None).subquery())
+        )
+        # server-side cursor, only one batch of rows is held in memory
+        result = await ss.stream(query(after).execution_options(yield_per=batch_size))
+
+        progress = Progress(table, total or 0, checkpoint.done(key))
+        async for rows in result.partitions(batch_size):
+            values = await embed(rows, models, concurrency)
+            embedded = {v["id"] for v in values}
+            failed = [r.id for r in rows if r.id not in embedded]
+
+            # the checkpoint passes failed rows, the backlog retries them
+            async with DBSession() as ws, ws.begin():
+                await write_vectors(ws, target, values)
+                await embedding_version.queue(
+                    ws, target, [(env.EMBEDDING_VERSION, id) for id in failed]
+                )
+
+            checkpoint.save(key, rows[-1].id, progress.done + len(rows))
+            progress.update(len(values), len(rows) - len(values))
+
+    logger.info(f"{table}: finished, {progress.processed} re-embedded")
+
+
+async def drain_backlog(
+    table: str,
+    models: dict[str, Any],
+    batch_size: int,
+    concurrency: int,
+):
+    target, query, embed = TABLES[table]
+    version = env.EMBEDDING_VERSION
+    processed = 0
+    failed: set[str] = set()
+    while True:
+        async with DBSession() as ss, ss.begin():
+            taken = await embedding_version.take_backlog(
+                ss, target, version, batch_size, failed
+            )
+        if not taken:
+            break
+
+        stmt = query(None)
+        async with DBSession() as ss, ss.begin():
+            rows = (
+                await ss.execute(
+                    stmt.filter(stmt.selected_columns.id.in_([id for id, _ in taken]))
+                )
+            ).all()
+
+        values = await embed(rows, models, concurrency)
+        # rows deleted since they were queued have nothing to embed
+        gone = {id for id, _ in taken} - {r.id for r in rows}
+        done = gone | {v["id"] for v in values}
+        async with DBSession() as ss, ss.begin():
+            await write_vectors(ss, target, values)
+            await embedding_version.clear_backlog(
+                ss, target, version, [t for t in taken if t[0] in done]
+            )
+
+        failed.update(id for id, _ in taken if id not in done)
+        processed += len(values)
+
+    logger.info(
+        f"{table}: backlog drained, {processed} re-embedded, "
+        f"{len(failed)} failed and left queued"
+    )
+
+
+async def main(
+    tables: list[str],
+    checkpoint_path: str,
+    restart: bool,
+    backlog_only: bool,
+    **kwargs,
+):
+    async with engine.begin() as conn:
+        await embedding_version.register(conn, env.EMBEDDING_VERSION)
+
+    checkpoint = Checkpoint(checkpoint_path, restart)
+    models = ai.load_all_model()
+
+    for table in tables:
+        if not backlog_only:
+            await reembed_table(table, models, checkpoint, **kwargs)
+        await drain_backlog(table, models, **kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--tables", nargs="+", choices=list(TABLES), default=list(TABLES)
+    )
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--fetch-concurrency", type=int, default=16)
+    parser.add_argument("--checkpoint", default="./reembed.checkpoint.json")
+    parser.add_argument("--restart", action="store_true")
+    parser.add_argument("--backlog-only", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(
+        main(
+            args.tables,
+            args.checkpoint,
+            args.restart,
+            args.backlog_only,
+            batch_size=args.batch_size,
+            concurrency=args.fetch_concurrency,
+        )
+    )
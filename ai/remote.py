@@ -0,0 +1,185 @@
+import asyncio
+import json
+import socket
+import struct
+import threading
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any
+
+import numpy as np
+
+from config import env
+from etc.local_error import HandledError, ServiceUnavailableError
+
+HEADER = struct.Struct("!I")
+
+
+def untrack(shm: shared_memory.SharedMemory):
+    # the other process owns this segment's unlink, keep our tracker from
+    # unlinking it (or warning about it) when this process exits
+    resource_tracker.unregister(shm._name, "shared_memory")  # type: ignore
+
+
+def pack_arrays(
+    arrays: list[np.ndarray],
+) -> tuple[shared_memory.SharedMemory, list[dict[str, Any]]]:
+    arrays = [np.ascontiguousarray(a) for a in arrays]
+    total = max(1, sum(a.nbytes for a in arrays))
+    shm = shared_memory.SharedMemory(create=True, size=total)
+
+    meta = []
+    offset = 0
+    for a in arrays:
+        view = np.ndarray(a.shape, a.dtype, buffer=shm.buf, offset=offset)
+        view[...] = a
+        meta.append({"shape": a.shape, "dtype": a.dtype.str, "offset": offset})
+        offset += a.nbytes
+        del view
+
+    return shm, meta
+
+
+def pack_bytes(arrays: list[np.ndarray]) -> tuple[bytes, list[dict[str, Any]]]:
+    # results are a few KB of embeddings, they go inline after the header
+    arrays = [np.ascontiguousarray(a) for a in arrays]
+
+    meta = []
+    offset = 0
+    for a in arrays:
+        meta.append({"shape": a.shape, "dtype": a.dtype.str, "offset": offset})
+        offset += a.nbytes
+
+    return b"".join(a.tobytes() for a in arrays), meta
+
+
+def view_arrays(buf, meta: list[dict[str, Any]]) -> list[np.ndarray]:
+    return [
+        np.ndarray(m["shape"], np.dtype(m["dtype"]), buffer=buf, offset=m["offset"])
+        for m in meta
+    ]
+
+
+def encode_msg(header: dict[str, Any]) -> bytes:
+    body = json.dumps(header).encode()
+    return HEADER.pack(len(body)) + body
+
+
+async def read_msg(reader: asyncio.StreamReader) -> dict[str, Any]:
+    (size,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return json.loads(await reader.readexactly(size))
+
+
+def recv_exactly(sock: socket.socket, size: int) -> bytearray:
+    buf = bytearray(size)
+    view = memoryview(buf)
+    while view:
+        read = sock.recv_into(view)
+        if not read:
+            raise ConnectionError("Inference server closed the connection")
+        view = view[read:]
+    return buf
+
+
+class InferenceClient:
+    # one blocking connection per thread, the calls come from executor threads
+
+    def __init__(self, socket_path: str) -> None:
+        self.socket_path = socket_path
+        self.local = threading.local()
+
+    def __connection(self) -> socket.socket:
+        sock = getattr(self.local, "sock", None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(env.INFERENCE_SERVER_TIMEOUT)
+            sock.connect(self.socket_path)
+            self.local.sock = sock
+        return sock
+
+    def __drop_connection(self):
+        sock = getattr(self.local, "sock", None)
+        if sock is not None:
+            sock.close()
+        self.local.sock = None
+
+    def close(self):
+        # the calling thread's connection
+        self.__drop_connection()
+
+    def __roundtrip(
+        self,
+        header: dict[str, Any],
+    ) -> tuple[dict[str, Any], bytearray]:
+        sock = self.__connection()
+        try:
+            sock.sendall(encode_msg(header))
+            (size,) = HEADER.unpack(recv_exactly(sock, HEADER.size))
+            res = json.loads(recv_exactly(sock, size))
+            return res, recv_exactly(sock, res.get("size", 0))
+        except TimeoutError:
+            # a late answer would be read as the next call's, start over
+            self.__drop_connection()
+            raise ServiceUnavailableError(
+                "Inference server timed out", env.INFERENCE_RETRY_AFTER
+            )
+        except (ConnectionError, OSError):
+            self.__drop_connection()
+            raise
+
+    def call(
+        self,
+        header: dict[str, Any],
+        arrays: list[np.ndarray] | None = None,
+    ) -> tuple[dict[str, Any], list[np.ndarray]]:
+        shm = None
+        if arrays:
+            shm, meta = pack_arrays(arrays)
+            header = {**header, "shm": shm.name, "arrays": meta}
+
+        try:
+            res, payload = self.__roundtrip(header)
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+
+        if "retry_after" in res:
+            raise ServiceUnavailableError(res["error"], res["retry_after"])
+        if "error" in res:
+            raise HandledError(f"Inference server error: {res['error']}")
+
+        # the arrays view the received buffer, nothing is copied again
+        return res, view_arrays(payload, res.get("arrays", []))
+
+
+class RemoteOpenCLIP:
+    def __init__(self, client: InferenceClient) -> None:
+        self.client = client
+        self.model_id = f"remote-clip:{client.socket_path}"
+
+    def encode_text(self, search_text: str | list[str]):
+        texts = [search_text] if isinstance(search_text, str) else list(search_text)
+        _, out = self.client.call({"op": "clip.encode_text", "texts": texts})
+        return out[0]
+
+    def encode_image(self, images):
+        pixels = [np.asarray(img.convert("RGB")) for img in images]
+        _, out = self.client.call({"op": "clip.encode_image"}, pixels)
+        return out[0]
+
+
+class RemoteYOLOEmbed:
+    def __init__(self, client: InferenceClient) -> None:
+        self.client = client
+        self.model_id = f"remote-yolo:{client.socket_path}"
+
+    def classify_embed(self, image, top_k: int = 5):
+        pixels = [np.asarray(img.convert("RGB")) for img in image]
+        res, out = self.client.call(
+            {"op": "yolo.classify_embed", "top_k": top_k},
+            pixels,
+        )
+        return list(zip(res["classes"], out[0]))
+
+    def embed(self, image):
+        return [vec for _, vec in self.classify_embed(image)]
@@ -0,0 +1,152 @@
+# Shared inference process. Owns one copy of the CLIP and YOLO models and
+# serves every uvicorn worker on the node over a unix socket. Pixels travel
+# through shared memory the worker creates and unlinks, the embeddings come
+# back on the socket after the header.
+#
+#   python -m ai.server --socket /tmp/culcon_inference.sock
+#   INFERENCE_SERVER_SOCKET=/tmp/culcon_inference.sock fastapi run main.py
+import argparse
+import asyncio
+import logging
+import os
+from multiprocessing import shared_memory
+from typing import Any
+
+import numpy as np
+from PIL import Image
+
+import ai
+from ai import batching, executor
+from ai.remote import encode_msg, pack_bytes, read_msg, untrack, view_arrays
+from config import env
+from etc.local_error import ServiceUnavailableError
+
+logger = logging.getLogger("uvicorn.info")
+
+
+class InferenceServer:
+    def __init__(self, models: dict[str, Any]) -> None:
+        self.models = models
+
+    async def __dispatch(
+        self,
+        header: dict[str, Any],
+        inputs: list[np.ndarray],
+    ) -> tuple[dict[str, Any], list[np.ndarray]]:
+        clip_model = self.models["clip"]
+        yolo_model = self.models["yolo"]
+
+        match header["op"]:
+            case "clip.encode_text":
+                # each text joins the shared batcher, so requests from all
+                # workers are batched together
+                rows = await asyncio.gather(*[
+                    batching.encode_text(clip_model, t) for t in header["texts"]
+                ])
+                return {}, [np.stack(rows).astype(np.float32)]
+
+            case "clip.encode_image":
+                images = [Image.fromarray(a) for a in inputs]
+                rows = await asyncio.gather(*[
+                    batching.encode_image(clip_model, img) for img in images
+                ])
+                return {}, [np.stack(rows).astype(np.float32)]
+
+            case "yolo.classify_embed":
+                images = [Image.fromarray(a) for a in inputs]
+                results = await executor.run(
+                    yolo_model.classify_embed,
+                    images,
+                    header.get("top_k", 5),
+                )
+                classes = [c for c, _ in results]
+                vectors = np.stack([v for _, v in results]).astype(np.float32)
+                return {"classes": classes}, [vectors]
+
+            case op:
+                raise Exception(f"Unknow inference op:{op}")
+
+    async def __handle_one(
+        self,
+        header: dict[str, Any],
+    ) -> tuple[dict[str, Any], bytes]:
+        in_shm = None
+        if "shm" in header:
+            in_shm = shared_memory.SharedMemory(name=header["shm"])
+            untrack(in_shm)
+
+        try:
+            inputs = view_arrays(in_shm.buf, header["arrays"]) if in_shm else []
+            res, outputs = await self.__dispatch(header, inputs)
+            del inputs
+        finally:
+            if in_shm is not None:
+                try:
+                    in_shm.close()
+                except BufferError:
+                    # a decoded image still views the segment, gc closes it
+                    pass
+
+        payload, meta = pack_bytes(outputs)
+        return {**res, "arrays": meta, "size": len(payload)}, payload
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                try:
+                    header = await read_msg(reader)
+                except asyncio.IncompleteReadError:
+                    break
+
+                payload = b""
+                try:
+                    res, payload = await self.__handle_one(header)
+                except ServiceUnavailableError as e:
+                    # full queue, the worker answers 503 with the same delay
+                    res = {"error": str(e), "retry_after": e.retry_after}
+                except Exception as e:
+                    logger.error(f"Inference request failed: {e!r}")
+                    res = {"error": repr(e)}
+
+                writer.write(encode_msg(res))
+                writer.write(payload)
+                try:
+                    await writer.drain()
+                except ConnectionError:
+                    # the worker timed out and hung up
+                    break
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path: str):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+        server = await asyncio.start_unix_server(self.handle, path=socket_path)
+        logger.info(f"Inference server listening on {socket_path}")
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batching.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", default=env.INFERENCE_SERVER_SOCKET)
+    parser.add_argument("--stub", action="store_true")
+    args = parser.parse_args()
+
+    if not args.socket:
+        raise SystemExit("--socket or INFERENCE_SERVER_SOCKET is required")
+
+    logging.basicConfig(level=logging.INFO)
+    if args.stub:
+        models = ai.load_all_stub_model()
+    else:
+        # not model_loaders, with the socket set it would return clients of
+        # this very server
+        models = {n: s.load() for n, s in ai.local_model_loaders().items()}
+
+    asyncio.run(InferenceServer(models).serve(args.socket))
@@ -0,0 +1,27 @@
+# Rebuild the similar products of every product from the stored vectors of
+# EMBEDDING_VERSION, no model is loaded. Product writes keep the lists up to
+# date in between, run it nightly and after an embedding cutover.
+#
+#   python -m ai.similar_product
+#   python -m ai.similar_product -k 20
+import argparse
+import asyncio
+import logging
+
+from db.postgresql import DBSession, engine
+from services import similar_product
+
+
+async def main(k: int | None):
+    async with DBSession() as ss, ss.begin():
+        await similar_product.rebuild(ss, k)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-k", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(args.k))
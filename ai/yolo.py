@@ -1,31 +1,81 @@
-from typing import Any
-from ultralytics import YOLO
+import threading
+from typing import TYPE_CHECKING, Any
 import numpy as np
 
 from PIL import ImageFile
 
+# deferred like in ai.clip, ultralytics imports torch
+if TYPE_CHECKING:
+    import torch
+    from ultralytics import YOLO
+
 
 class YOLOEmbed:
-    model_predict: YOLO
-    model_embed: YOLO
+    model: "YOLO"
 
     def __init__(self, model_path: str) -> None:
-        self.model_predict = self.__load_yolo(model_path)
-        self.model_embed = self.__load_yolo(model_path)
+        self.model_id = model_path
+        self.model = self.__load_yolo(model_path)
+        # the predictor and the forward hook are shared state
+        self.lock = threading.Lock()
+
+    def __load_yolo(self, model_path: str) -> "YOLO":
+        from ultralytics import YOLO
 
-    def __load_yolo(self, model_path: str) -> YOLO:
         return YOLO(model=model_path, verbose=False)
 
+    def __embed_layer(self) -> "torch.nn.Module":
+        # same layer ultralytics uses for YOLO.embed, the one before Classify
+        return self.model.model.model[-2]  # type: ignore
+
+    def __forward(self, image: list[ImageFile.ImageFile]):
+        import torch
+
+        features: list[torch.Tensor] = []
+
+        def capture(_module, _input, output):
+            features.append(output)
+
+        with self.lock:
+            handle = self.__embed_layer().register_forward_hook(capture)
+            try:
+                results = self.model.predict(image, stream=False, verbose=False)
+            finally:
+                handle.remove()
+
+        # the first predict on CUDA runs a warm-up batch through the hook too,
+        # only the last rows belong to these images
+        embeds = torch.cat([
+            torch.nn.functional.adaptive_avg_pool2d(f, (1, 1)).flatten(1)
+            for f in features
+        ])[-len(results) :]
+
+        return results, embeds.float().cpu().numpy()
+
+    def classify_embed(
+        self,
+        image: list[ImageFile.ImageFile],
+        top_k: int = 5,
+    ) -> list[tuple[list[dict[str, Any]], np.ndarray]]:
+        results, embeds = self.__forward(image)
+        return [(r.summary()[:top_k], e) for r, e in zip(results, embeds)]
+
     def embed(self, image: list[ImageFile.ImageFile]):
-        return self.model_embed.embed(image, stream=False)
+        return self.__forward(image)[1]
 
     def predict(self, image: list[ImageFile.ImageFile]):
-        return self.model_predict.predict(image, stream=False, verbose=False)
+        return self.__forward(image)[0]
 
 
 class YOLOEmbedStub:
     def __init__(self) -> None:
-        pass
+        self.model_id = "stub"
+
+    def classify_embed(self, image: Any, top_k: int = 5):
+        return [
+            ([{"name": "stub", "class": 0, "confidence": 1.0}], np.ones(512))
+            for _ in image
+        ]
 
     def embed(self, image: Any):
         return [np.ones(512)]
@@ -0,0 +1,99 @@
+# Re-embed a sample of the catalog with the configured runtimes
+# (CLIP_RUNTIME / YOLO_RUNTIME) and compare against the vectors stored in
+# product_embedding, which were produced by the PyTorch models.
+#
+#   CLIP_RUNTIME=onnx YOLO_RUNTIME=onnx python -m bench.embedding_parity --limit 100
+import argparse
+import asyncio
+import urllib.request
+from io import BytesIO
+
+import numpy as np
+import sqlalchemy as sqla
+from PIL import Image
+
+import ai
+from db.postgresql import DBSession
+from db.postgresql.models.blog import ProductDoc
+from db.postgresql.models.product import Product, ProductEmbedding
+
+
+def fetch_image(url: str) -> Image.Image:
+    with urllib.request.urlopen(url, timeout=30) as res:
+        return Image.open(BytesIO(res.read()))
+
+
+async def load_sample(limit: int):
+    async with DBSession() as ss, ss.begin():
+        rows = await ss.execute(
+            sqla.select(
+                Product.id,
+                Product.image_url,
+                ProductDoc.description,
+                ProductEmbedding.description_embed,
+                ProductEmbedding.images_embed_clip,
+                ProductEmbedding.images_embed_yolo,
+            )
+            .join(ProductDoc, ProductDoc.id == Product.id)
+            .join(ProductEmbedding, ProductEmbedding.id == Product.id)
+            .order_by(Product.id)
+            .limit(limit)
+        )
+        return rows.all()
+
+
+def batched(fn, items: list, size: int = 16) -> np.ndarray:
+    return np.concatenate([
+        np.asarray(fn(items[i : i + size]), dtype=np.float32)
+        for i in range(0, len(items), size)
+    ])
+
+
+def compare(name: str, stored: np.ndarray, fresh: np.ndarray, min_cos: float) -> bool:
+    cos = np.einsum("ij,ij->i", stored, fresh) / (
+        np.linalg.norm(stored, axis=1) * np.linalg.norm(fresh, axis=1)
+    )
+    l2 = np.linalg.norm(stored - fresh, axis=1)
+    bad = int((cos < min_cos).sum())
+    print(
+        f"{name:<18} cos mean {cos.mean():.5f} min {cos.min():.5f} | "
+        f"l2 max {l2.max():.5f} | below {min_cos}: {bad}/{len(cos)}"
+    )
+    return bad == 0
+
+
+async def main(limit: int, min_cos: float):
+    models = ai.load_all_model()
+    rows = await load_sample(limit)
+    if not rows:
+        raise SystemExit("product_embedding is empty")
+
+    images = await asyncio.gather(*[
+        asyncio.to_thread(fetch_image, r.image_url) for r in rows
+    ])
+
+    fresh = {
+        "description_embed": batched(
+            models["clip"].encode_text, [r.description for r in rows]
+        ),
+        "images_embed_clip": batched(models["clip"].encode_image, images),
+        "images_embed_yolo": batched(models["yolo"].embed, images),
+    }
+
+    print(f"clip={models['clip'].model_id} yolo={models['yolo'].model_id}")
+    ok = True
+    for column, vectors in fresh.items():
+        stored = np.stack([np.asarray(getattr(r, column)) for r in rows])
+        ok &= compare(column, stored, vectors, min_cos)
+
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--min-cos", type=float, default=0.999)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.limit, args.min_cos))
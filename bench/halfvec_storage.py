@@ -0,0 +1,122 @@
+# Table size, ANN index size, build time and recall of halfvec storage against
+# the same vectors in full precision. Exact neighbours come from a seq scan
+# over the full precision copy. Runs on scratch tables.
+#
+#   python -m bench.halfvec_storage --sizes 10000 50000
+#   python -m bench.halfvec_storage --column product_embedding.description_embed
+import argparse
+import asyncio
+import statistics
+
+import numpy as np
+import sqlalchemy as sqla
+
+from bench.vector_index import (
+    build_index,
+    fill_table,
+    random_vectors,
+    run_queries,
+    set_search_params,
+    summary,
+)
+from config import env
+from db.postgresql import engine
+
+
+async def fill_from_column(conn, table: str, column_ref: str):
+    source, column = column_ref.split(".")
+    await conn.execute(sqla.text(f"DROP TABLE IF EXISTS {table}"))
+    await conn.execute(
+        sqla.text(
+            f"CREATE TABLE {table} AS SELECT "
+            f"CAST(row_number() OVER () AS integer) AS id, {column}::vector AS v "
+            f"FROM {source}"
+        )
+    )
+    await conn.execute(sqla.text(f"ALTER TABLE {table} ADD PRIMARY KEY (id)"))
+    await conn.execute(sqla.text(f"ANALYZE {table}"))
+
+
+async def sample_queries(conn, table: str, n: int) -> np.ndarray:
+    rows = await conn.scalars(
+        sqla.text(f"SELECT v::text FROM {table} ORDER BY random() LIMIT :n"),
+        {"n": n},
+    )
+    return np.array(
+        [np.array(r[1:-1].split(","), dtype=np.float32) for r in rows.all()]
+    )
+
+
+async def half_copy(conn, full: str, half: str):
+    await conn.execute(sqla.text(f"DROP TABLE IF EXISTS {half}"))
+    await conn.execute(
+        sqla.text(f"CREATE TABLE {half} AS SELECT id, v::halfvec AS v FROM {full}")
+    )
+    await conn.execute(sqla.text(f"ALTER TABLE {half} ADD PRIMARY KEY (id)"))
+    await conn.execute(sqla.text(f"ANALYZE {half}"))
+
+
+async def size_mb(conn, function: str, table: str) -> float:
+    size = await conn.scalar(
+        sqla.text(f"SELECT {function}(CAST(:table AS regclass))"), {"table": table}
+    )
+    return (size or 0) / 2**20
+
+
+async def compare(conn, name: str, full: str, queries: np.ndarray, k: int):
+    half = f"{full}_half"
+    await half_copy(conn, full, half)
+
+    await conn.execute(sqla.text("SET enable_indexscan = off"))
+    _, exact_ids = await run_queries(conn, full, queries, k)
+    await conn.execute(sqla.text("SET enable_indexscan = on"))
+
+    for storage, table in (("vector", full), ("halfvec", half)):
+        pk_mb = await size_mb(conn, "pg_indexes_size", table)
+        build = await build_index(conn, table, storage)
+        index_mb = await size_mb(conn, "pg_indexes_size", table) - pk_mb
+        table_mb = await size_mb(conn, "pg_table_size", table)
+
+        latencies, ids = await run_queries(conn, table, queries, k, storage)
+        recall = statistics.mean(
+            len(a & e) / len(e) for a, e in zip(ids, exact_ids) if e
+        )
+        print(
+            f"{name:>24} {storage:>8} | table {table_mb:8.1f}MB | "
+            f"index {index_mb:8.1f}MB | build {build:6.2f}s | "
+            f"{summary(latencies)} | recall@{k} {recall:.3f}"
+        )
+
+    await conn.execute(sqla.text(f"DROP TABLE {half}"))
+    await conn.execute(sqla.text(f"DROP TABLE {full}"))
+    await conn.commit()
+
+
+async def main(sizes: list[int], column: str | None, queries: int, k: int):
+    async with engine.connect() as conn:
+        await conn.execute(sqla.text("CREATE EXTENSION IF NOT EXISTS vector"))
+        await set_search_params(conn, k)
+
+        print(f"index={env.VECTOR_INDEX_TYPE} k={k} queries={queries}")
+        if column:
+            await fill_from_column(conn, "bench_storage", column)
+            query_vecs = await sample_queries(conn, "bench_storage", queries)
+            await compare(conn, column, "bench_storage", query_vecs, k)
+            return
+
+        query_vecs = random_vectors(queries)
+        for size in sizes:
+            table = f"bench_storage_{size}"
+            await fill_table(conn, table, size)
+            await compare(conn, f"{size} rows", table, query_vecs, k)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--column", default=None, help="table.column to copy")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("-k", type=int, default=env.SEARCH_CANDIDATE_LIMIT)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.sizes, args.column, args.queries, args.k))
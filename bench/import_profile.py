@@ -0,0 +1,64 @@
+# Import-time breakdown of the API process, from `python -X importtime`.
+# Run it before and after touching imports, the heavy ML and SDK packages
+# should not appear here.
+#
+#   python -m bench.import_profile --module main --top 25 --budget-ms 3000
+import argparse
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)$")
+
+
+def profile(module: str) -> list[tuple[int, int, int, str]]:
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if out.returncode != 0:
+        raise SystemExit(out.stderr)
+
+    rows = []
+    for line in out.stderr.splitlines():
+        m = LINE.match(line)
+        if m:
+            self_us, cumulative_us, indent, name = m.groups()
+            # nesting is two spaces per level after the separator
+            depth = (len(indent) - 1) // 2
+            rows.append((int(self_us), int(cumulative_us), depth, name))
+    return rows
+
+
+def main(module: str, top: int, budget_ms: float | None):
+    rows = profile(module)
+
+    total_ms = sum(r[0] for r in rows) / 1000
+    by_package: dict[str, int] = defaultdict(int)
+    for self_us, _, _, name in rows:
+        by_package[name.split(".")[0]] += self_us
+
+    print(f"import {module}: {total_ms:.0f}ms over {len(rows)} modules\n")
+    print(f"{'package':<32} {'self ms':>9}")
+    for package, us in sorted(by_package.items(), key=lambda p: -p[1])[:top]:
+        print(f"{package:<32} {us / 1000:>9.1f}")
+
+    print(f"\n{'module':<48} {'cumulative ms':>14}")
+    slowest = sorted(rows, key=lambda r: -r[1])[:top]
+    for _, cumulative_us, depth, name in slowest:
+        print(f"{'  ' * min(depth, 4) + name:<48} {cumulative_us / 1000:>14.1f}")
+
+    if budget_ms is not None and total_ms > budget_ms:
+        raise SystemExit(f"import time {total_ms:.0f}ms is over {budget_ms:.0f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--top", type=int, default=25)
+    parser.add_argument("--budget-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    main(args.module, args.top, args.budget_ms)
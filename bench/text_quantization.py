@@ -0,0 +1,111 @@
+# Compare the INT8 CLIP text encoder (CLIP_TEXT_INT8) against fp32 on the
+# real catalog: both encode the same queries, rank the stored
+# product_embedding.description_embed vectors, and the int8 top-k is scored
+# against the fp32 top-k.
+#
+#   python -m bench.text_quantization --limit 500 -k 10
+import argparse
+import asyncio
+import statistics
+import time
+
+import numpy as np
+import sqlalchemy as sqla
+
+import ai
+from ai import clip
+from db.postgresql import DBSession
+from db.postgresql.models.blog import ProductDoc
+from db.postgresql.models.product import Product, ProductEmbedding
+
+
+async def load_catalog(limit: int, source: str):
+    query_col = Product.product_name if source == "names" else ProductDoc.description
+    async with DBSession() as ss, ss.begin():
+        rows = (
+            await ss.execute(
+                sqla.select(
+                    Product.id,
+                    query_col,
+                    ProductEmbedding.description_embed,
+                )
+                .join(ProductDoc, ProductDoc.id == Product.id)
+                .join(ProductEmbedding, ProductEmbedding.id == Product.id)
+                .order_by(Product.id)
+                .limit(limit)
+            )
+        ).all()
+
+    ids = [r[0] for r in rows]
+    queries = [r[1] for r in rows]
+    matrix = np.stack([np.asarray(r[2], dtype=np.float32) for r in rows])
+    return ids, queries, matrix
+
+
+def encode(model: clip.OpenCLIP, queries: list[str]):
+    # one query per call, like a search request
+    latencies = []
+    embeds = []
+    for q in queries:
+        start = time.perf_counter()
+        embeds.append(model.encode_text(q)[0])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.stack(embeds), latencies
+
+
+def top_k(matrix: np.ndarray, embeds: np.ndarray, k: int) -> np.ndarray:
+    sq = (matrix**2).sum(1)[None, :] - 2 * embeds @ matrix.T
+    return np.argsort(sq, axis=1)[:, :k]
+
+
+def summary(latencies: list[float]) -> str:
+    p50 = statistics.median(latencies)
+    p95 = sorted(latencies)[int(len(latencies) * 0.95) - 1]
+    return f"p50 {p50:7.2f}ms  p95 {p95:7.2f}ms"
+
+
+async def main(limit: int, k: int, source: str):
+    ids, queries, matrix = await load_catalog(limit, source)
+    if not ids:
+        raise SystemExit("product_embedding is empty")
+
+    fp32 = clip.OpenCLIP(ai.CLIP_NAME, ai.CLIP_WEIGHTS, device="cpu")
+    int8 = clip.OpenCLIP(
+        ai.CLIP_NAME, ai.CLIP_WEIGHTS, device="cpu", quantize_text=True
+    )
+
+    # warm up both before timing
+    fp32.encode_text(queries[0])
+    int8.encode_text(queries[0])
+
+    fp32_embeds, fp32_lat = encode(fp32, queries)
+    int8_embeds, int8_lat = encode(int8, queries)
+
+    fp32_top = top_k(matrix, fp32_embeds, k)
+    int8_top = top_k(matrix, int8_embeds, k)
+
+    recall = statistics.mean(
+        len(set(a) & set(e)) / len(e) for a, e in zip(int8_top, fp32_top)
+    )
+    # how often the query's own product is retrieved, for each encoder
+    own = np.arange(len(ids))[:, None]
+    fp32_hit = (fp32_top == own).any(1).mean()
+    int8_hit = (int8_top == own).any(1).mean()
+    cos = np.einsum("ij,ij->i", fp32_embeds, int8_embeds) / (
+        np.linalg.norm(fp32_embeds, axis=1) * np.linalg.norm(int8_embeds, axis=1)
+    )
+
+    print(f"{len(ids)} products, queries from {source}, k={k}")
+    print(f"fp32 encode {summary(fp32_lat)} | own product@{k} {fp32_hit:.3f}")
+    print(f"int8 encode {summary(int8_lat)} | own product@{k} {int8_hit:.3f}")
+    print(f"int8 recall@{k} vs fp32 {recall:.3f} | query cos min {cos.min():.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--limit", type=int, default=500)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--queries", choices=["names", "descriptions"], default="names")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.limit, args.k, args.queries))
@@ -0,0 +1,136 @@
+# Latency of top-k vector search against catalog size, with and without the
+# managed ANN index. Runs against scratch tables, the real catalog is untouched.
+#
+#   python -m bench.vector_index --sizes 1000 10000 50000 --queries 50
+import argparse
+import asyncio
+import statistics
+import time
+
+import numpy as np
+import sqlalchemy as sqla
+
+from config import env
+from db.postgresql import engine, vector_index
+
+DIM = 768
+
+
+def random_vectors(n: int) -> np.ndarray:
+    vec = np.random.default_rng(0).standard_normal((n, DIM)).astype(np.float32)
+    return vec / np.linalg.norm(vec, axis=1, keepdims=True)
+
+
+def vector_literal(vec: np.ndarray) -> str:
+    return "[" + ",".join(f"{v:.6f}" for v in vec) + "]"
+
+
+async def fill_table(conn, table: str, size: int):
+    await conn.execute(sqla.text(f"DROP TABLE IF EXISTS {table}"))
+    await conn.execute(
+        sqla.text(f"CREATE TABLE {table} (id integer PRIMARY KEY, v vector({DIM}))")
+    )
+    # random() is correlated with the outer row so every vector differs
+    await conn.execute(
+        sqla.text(
+            f"INSERT INTO {table} "
+            "SELECT i, l2_normalize(ARRAY("
+            f"  SELECT random() - 0.5 + i * 0 FROM generate_series(1, {DIM})"
+            ")::vector) "
+            "FROM generate_series(1, :size) i"
+        ),
+        {"size": size},
+    )
+    await conn.execute(sqla.text(f"ANALYZE {table}"))
+
+
+async def build_index(conn, table: str, storage: str = "vector") -> float:
+    if env.VECTOR_INDEX_TYPE == "none":
+        return 0.0
+
+    # same DDL the app manages, only the storage type differs per run
+    configured = env.VECTOR_STORAGE
+    env.VECTOR_STORAGE = storage
+    try:
+        sql = vector_index.create_index_sql(table, "v")
+    finally:
+        env.VECTOR_STORAGE = configured
+
+    start = time.perf_counter()
+    await conn.execute(sqla.text(sql))
+    return time.perf_counter() - start
+
+
+async def run_queries(
+    conn, table: str, queries: np.ndarray, k: int, storage: str = "vector"
+):
+    latencies = []
+    ids = []
+    for q in queries:
+        start = time.perf_counter()
+        r = await conn.execute(
+            sqla.text(
+                f"SELECT id FROM {table} "
+                f"ORDER BY v <-> CAST(:q AS {storage}) LIMIT :k"
+            ),
+            {"q": vector_literal(q), "k": k},
+        )
+        ids.append({row[0] for row in r})
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies, ids
+
+
+async def set_search_params(conn, k: int):
+    await conn.execute(
+        sqla.text(f"SET hnsw.ef_search = {max(env.HNSW_EF_SEARCH, k)}")
+    )
+    await conn.execute(sqla.text(f"SET ivfflat.probes = {env.IVFFLAT_PROBES}"))
+
+
+def summary(latencies: list[float]) -> str:
+    p50 = statistics.median(latencies)
+    p95 = sorted(latencies)[int(len(latencies) * 0.95) - 1]
+    return f"p50 {p50:8.2f}ms  p95 {p95:8.2f}ms"
+
+
+async def main(sizes: list[int], queries: int, k: int):
+    query_vecs = random_vectors(queries)
+
+    async with engine.connect() as conn:
+        await conn.execute(sqla.text("CREATE EXTENSION IF NOT EXISTS vector"))
+        await set_search_params(conn, k)
+
+        print(f"index={env.VECTOR_INDEX_TYPE} k={k} queries={queries}")
+        for size in sizes:
+            table = f"bench_vector_{size}"
+            await fill_table(conn, table, size)
+
+            await conn.execute(sqla.text("SET enable_indexscan = off"))
+            exact_lat, exact_ids = await run_queries(conn, table, query_vecs, k)
+            await conn.execute(sqla.text("SET enable_indexscan = on"))
+
+            build = await build_index(conn, table)
+            ann_lat, ann_ids = await run_queries(conn, table, query_vecs, k)
+
+            recall = statistics.mean(
+                len(a & e) / len(e) for a, e in zip(ann_ids, exact_ids)
+            )
+
+            print(
+                f"{size:>8} rows | seq scan {summary(exact_lat)} | "
+                f"index {summary(ann_lat)} | build {build:6.2f}s | "
+                f"recall@{k} {recall:.3f}"
+            )
+
+            await conn.execute(sqla.text(f"DROP TABLE {table}"))
+            await conn.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("-k", type=int, default=env.SEARCH_CANDIDATE_LIMIT)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.sizes, args.queries, args.k))
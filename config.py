@@ -1,5 +1,7 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
+from etc.product_type import ProductType
+
 
 class Environment(BaseSettings):
     SECRET_KEY: str = ""
@@ -21,6 +23,49 @@ class Environment(BaseSettings):
     SENDER_NAME: str = "Culinary Connect"
     PAYPAL_CLIENT_ID: str = ""
     PAYPAL_CLIENT_SECRET: str = ""
+    CLIP_BATCH_SIZE: int = 16
+    CLIP_BATCH_WAIT_MS: float = 5
+    INFERENCE_WORKERS: int = 2
+    INFERENCE_QUEUE_SIZE: int = 16
+    INFERENCE_RETRY_AFTER: int = 2
+    TEXT_EMBED_CACHE_SIZE: int = 4096
+    TEXT_EMBED_CACHE_TTL: float = 60 * 60
+    IMAGE_EMBED_CACHE_SIZE: int = 1024
+    IMAGE_EMBED_CACHE_TTL: float = 60 * 30
+    IMAGE_EMBED_CACHE_MB: int = 64
+    IMAGE_EMBED_CACHE_PIXEL_HASH: bool = False
+    VECTOR_STORAGE: str = "vector"
+    VECTOR_INDEX_TYPE: str = "hnsw"
+    HNSW_M: int = 16
+    HNSW_EF_CONSTRUCTION: int = 64
+    HNSW_EF_SEARCH: int = 100
+    IVFFLAT_LISTS: int = 100
+    IVFFLAT_PROBES: int = 10
+    VECTOR_FILTER_MODE: str = "iterative"
+    YOLO_CATEGORY_MAP: dict[str, ProductType] = {}
+    YOLO_CATEGORY_CONFIDENCE: float = 0.8
+    SEARCH_CANDIDATE_LIMIT: int = 70
+    SEARCH_TEXT_CONFIG: str = "english"
+    SEARCH_RRF_K: int = 60
+    SEARCH_BATCH_LIMIT: int = 16
+    SIMILAR_PRODUCT_COUNT: int = 10
+    SEARCH_SESSION_SIZE: int = 4096
+    SEARCH_SESSION_TTL: float = 60 * 10
+    SEARCH_BACKEND: str = "pgvector"
+    VECTOR_SNAPSHOT_DIR: str = "./vector_snapshot"
+    VECTOR_SNAPSHOT_REFRESH: float = 60 * 5
+    INFERENCE_SERVER_SOCKET: str = ""
+    INFERENCE_SERVER_TIMEOUT: float = 30
+    CLIP_RUNTIME: str = "torch"
+    YOLO_RUNTIME: str = "torch"
+    ONNX_DIR: str = "./ai/weights/onnx"
+    ORT_INTRA_OP_THREADS: int = 0
+    CLIP_TEXT_INT8: bool = False
+    IMAGE_MAX_PIXELS: int = 64_000_000
+    MODEL_RETRY_AFTER: int = 10
+    MODEL_WATCH_INTERVAL: float = 0
+    MODEL_DRAIN_TIMEOUT: float = 60
+    EMBEDDING_VERSION: str = "v1"
     model_config = SettingsConfigDict(env_file="dev.env")
 
 
@@ -9,6 +9,7 @@ from db.postgresql.models import Base
 
 ## DO NOT DELETE THIS LINE
 from db.postgresql.models import *  # noqa: F403
+from db.postgresql import embedding_version, text_index, vector_index
 
 
 engine = create_async_engine(
@@ -31,6 +32,13 @@ async def init_db():
     async with engine.begin() as conn:
         await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
         await conn.run_sync(Base.metadata.create_all)
+        await vector_index.check_extension(conn)
+        await embedding_version.ensure_backlog(conn)
+        await vector_index.ensure_product_type(conn)
+        await vector_index.ensure_vector_storage(conn)
+        await vector_index.ensure_vector_indexes(conn)
+        await text_index.ensure_text_indexes(conn)
+        await embedding_version.check(conn)
         await conn.commit()
 
 
@@ -0,0 +1,337 @@
+import logging
+import re
+from datetime import datetime, timedelta
+from functools import cache
+from typing import Any, Iterable
+
+import sqlalchemy as sqla
+from pgvector.sqlalchemy import Vector
+from sqlalchemy import orm
+from sqlalchemy.dialects import postgresql as psql
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from config import env
+from db.postgresql.models.blog import BlogEmbedding
+from db.postgresql.models.embedding import (
+    EmbeddingBacklog,
+    EmbeddingVersion,
+    EmbeddingVersionState,
+    HalfVec,
+)
+from db.postgresql.models.product import Product, ProductEmbedding
+
+logger = logging.getLogger("uvicorn.info")
+
+# vectors written before versioning, they stay in the mapped tables
+LEGACY_VERSION = "v1"
+
+EMBEDDING_MODELS = [ProductEmbedding, BlogEmbedding]
+
+VECTOR_TYPES = (Vector, HalfVec)
+
+__metadata = sqla.MetaData()
+
+
+def table_name(model, version: str) -> str:
+    if version == LEGACY_VERSION:
+        return model.__tablename__
+    slug = re.sub(r"[^a-z0-9]+", "_", version.lower()).strip("_")
+    return f"{model.__tablename__}__{slug}"
+
+
+@cache
+def __table(model, version: str) -> sqla.Table:
+    if version == LEGACY_VERSION:
+        return model.__table__
+    return model.__table__.to_metadata(__metadata, name=table_name(model, version))
+
+
+@cache
+def __entity(model, version: str):
+    if version == LEGACY_VERSION:
+        return model
+    # same attributes as the mapped class, so search code takes either
+    return orm.aliased(model, __table(model, version), adapt_on_names=True)
+
+
+def table(model, version: str | None = None) -> sqla.Table:
+    return __table(model, version or env.EMBEDDING_VERSION)
+
+
+def entity(model, version: str | None = None):
+    # vectors are only comparable with queries from the same models, so a
+    # worker reads the version its own models produce
+    return __entity(model, version or env.EMBEDDING_VERSION)
+
+
+async def live_versions(ss: AsyncSession | AsyncConnection) -> list[str]:
+    versions = await ss.scalars(
+        sqla.select(EmbeddingVersion.version).filter(
+            EmbeddingVersion.state != EmbeddingVersionState.RETIRED
+        )
+    )
+    return versions.all()  # type: ignore
+
+
+async def live_tables(conn: AsyncSession | AsyncConnection, model) -> list[sqla.Table]:
+    # the mapped table alone until a version is registered, and without it
+    # once its version is retired
+    versions = await live_versions(conn)
+    return [table(model, v) for v in versions or [LEGACY_VERSION]]
+
+
+def __denormalized(model, id: str) -> dict[str, Any]:
+    # copied from the product row on every full write
+    if model is ProductEmbedding:
+        return {
+            "product_type": sqla.select(Product.product_types)
+            .filter(Product.id == id)
+            .scalar_subquery()
+        }
+    return {}
+
+
+async def write(ss: AsyncSession, model, id: str, vectors: dict[str, Any]):
+    # this worker can only compute its own version, every other live version
+    # gets a backlog row instead
+    target = table(model)
+    missing = []
+    if set(vectors) == {c.name for c in target.c if isinstance(c.type, VECTOR_TYPES)}:
+        values = {**vectors, **__denormalized(model, id)}
+        stmt = psql.insert(target).values(id=id, **values)
+        await ss.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[target.c.id],
+                set_={c: stmt.excluded[c] for c in values},
+            )
+        )
+    else:
+        res = await ss.execute(
+            sqla.update(target).where(target.c.id == id).values(**vectors)
+        )
+        if not res.rowcount:  # type: ignore
+            # not re-embedded yet, the job computes the whole row
+            missing.append(env.EMBEDDING_VERSION)
+
+    missing.extend(v for v in await live_versions(ss) if v != env.EMBEDDING_VERSION)
+    await queue(ss, model, [(v, id) for v in missing])
+
+
+async def queue(ss: AsyncSession, model, entries: list[tuple[str, str]]):
+    if not entries:
+        return
+    stmt = psql.insert(EmbeddingBacklog).values(
+        [
+            {"version": v, "table_name": model.__tablename__, "id": id}
+            for v, id in entries
+        ]
+    )
+    await ss.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[
+                EmbeddingBacklog.version,
+                EmbeddingBacklog.table_name,
+                EmbeddingBacklog.id,
+            ],
+            set_={"queued_at": sqla.func.clock_timestamp()},
+        )
+    )
+
+
+async def take_backlog(
+    ss: AsyncSession, model, version: str, limit: int, skip: Iterable[str] = ()
+) -> list[tuple[str, datetime]]:
+    # left in place, clear_backlog removes them with the new vectors. `skip`
+    # holds ids that already failed in this run
+    backlog = EmbeddingBacklog.__table__
+    rows = await ss.execute(
+        sqla.select(backlog.c.id, backlog.c.queued_at)
+        .filter(
+            backlog.c.version == version,
+            backlog.c.table_name == model.__tablename__,
+            backlog.c.id.not_in(list(skip)),
+        )
+        .order_by(backlog.c.queued_at)
+        .limit(limit)
+    )
+    return [tuple(r) for r in rows.all()]  # type: ignore
+
+
+async def clear_backlog(
+    ss: AsyncSession, model, version: str, taken: list[tuple[str, datetime]]
+):
+    # an entry queued again since it was taken keeps its row, that write may
+    # not be in the vectors just computed
+    if not taken:
+        return
+    backlog = EmbeddingBacklog.__table__
+    await ss.execute(
+        sqla.delete(backlog).where(
+            backlog.c.version == version,
+            backlog.c.table_name == model.__tablename__,
+            sqla.tuple_(backlog.c.id, backlog.c.queued_at).in_(taken),
+        )
+    )
+
+
+async def ensure_backlog(conn: AsyncConnection):
+    # create_all does not add columns to existing tables
+    await conn.execute(
+        sqla.text(
+            f"ALTER TABLE {EmbeddingBacklog.__tablename__} ADD COLUMN IF NOT EXISTS "
+            "queued_at timestamp DEFAULT clock_timestamp()"
+        )
+    )
+
+
+async def register(conn: AsyncConnection, version: str):
+    registered = await conn.scalar(
+        sqla.select(sqla.func.count()).select_from(EmbeddingVersion)
+    )
+    if not registered:
+        # the first registration records what is already being served
+        await conn.execute(
+            psql.insert(EmbeddingVersion).values(
+                version=LEGACY_VERSION,
+                state=EmbeddingVersionState.ACTIVE,
+                activated_at=sqla.func.now(),
+            )
+        )
+    if version == LEGACY_VERSION:
+        return
+
+    for model in EMBEDDING_MODELS:
+        # copies the primary key, vector indexes copied along are replaced by
+        # ensure_vector_indexes with the current settings
+        await conn.execute(
+            sqla.text(
+                f"CREATE TABLE IF NOT EXISTS {table_name(model, version)} "
+                f"(LIKE {model.__tablename__} INCLUDING ALL)"
+            )
+        )
+
+    await conn.execute(
+        psql.insert(EmbeddingVersion)
+        .values(version=version, state=EmbeddingVersionState.MIGRATING)
+        .on_conflict_do_nothing()
+    )
+
+
+async def __row_count(conn: AsyncConnection, model, version: str) -> int:
+    count = await conn.scalar(
+        sqla.select(sqla.func.count()).select_from(table(model, version))
+    )
+    return count or 0
+
+
+async def __backlog_count(conn: AsyncConnection, version: str) -> int:
+    count = await conn.scalar(
+        sqla.select(sqla.func.count()).filter(EmbeddingBacklog.version == version)
+    )
+    return count or 0
+
+
+async def status(conn: AsyncConnection) -> list[dict[str, Any]]:
+    rows = await conn.execute(
+        sqla.select(EmbeddingVersion).order_by(EmbeddingVersion.created_at)
+    )
+    result = []
+    for row in rows.all():
+        result.append({
+            "version": row.version,
+            "state": row.state,
+            "activated_at": row.activated_at,
+            "retired_at": row.retired_at,
+            "backlog": await __backlog_count(conn, row.version),
+            "rows": {
+                m.__tablename__: await __row_count(conn, m, row.version)
+                for m in EMBEDDING_MODELS
+            },
+        })
+    return result
+
+
+async def cutover(conn: AsyncConnection, version: str, force: bool = False):
+    # registry rows are locked so two cutovers cannot both win
+    rows = await conn.execute(
+        sqla.select(EmbeddingVersion.version, EmbeddingVersion.state)
+        .filter(EmbeddingVersion.state != EmbeddingVersionState.RETIRED)
+        .with_for_update()
+    )
+    states = dict(rows.all())  # type: ignore
+    if states.get(version) != EmbeddingVersionState.MIGRATING:
+        raise Exception(f"Embedding version {version} is not migrating")
+
+    active = [v for v, s in states.items() if s == EmbeddingVersionState.ACTIVE]
+    if not force:
+        backlog = await __backlog_count(conn, version)
+        if backlog:
+            raise Exception(f"Embedding version {version} has {backlog} backlog rows")
+        for model in EMBEDDING_MODELS:
+            have = await __row_count(conn, model, version)
+            for old in active:
+                want = await __row_count(conn, model, old)
+                if have < want:
+                    raise Exception(
+                        f"{table_name(model, version)} has {have} rows, "
+                        f"{table_name(model, old)} has {want}"
+                    )
+
+    await conn.execute(
+        sqla.update(EmbeddingVersion)
+        .where(EmbeddingVersion.version.in_(active))
+        .values(state=EmbeddingVersionState.RETIRED, retired_at=sqla.func.now())
+    )
+    await conn.execute(
+        sqla.update(EmbeddingVersion)
+        .where(EmbeddingVersion.version == version)
+        .values(state=EmbeddingVersionState.ACTIVE, activated_at=sqla.func.now())
+    )
+    await conn.execute(
+        sqla.delete(EmbeddingBacklog).where(EmbeddingBacklog.version.in_(active))
+    )
+
+
+async def gc(conn: AsyncConnection, min_age: float) -> list[str]:
+    # workers still on a retired version read its tables until they restart,
+    # so they are only dropped once it has been retired for a while
+    retired = await conn.scalars(
+        sqla.select(EmbeddingVersion.version).filter(
+            EmbeddingVersion.state == EmbeddingVersionState.RETIRED,
+            EmbeddingVersion.retired_at
+            < sqla.func.now() - timedelta(seconds=min_age),
+        )
+    )
+    collected = retired.all()
+    for version in collected:
+        for model in EMBEDDING_MODELS:
+            name = table_name(model, version)
+            if version == LEGACY_VERSION:
+                # the mapped tables are recreated on startup, keep them
+                await conn.execute(sqla.text(f"TRUNCATE {name}"))
+            else:
+                await conn.execute(sqla.text(f"DROP TABLE IF EXISTS {name}"))
+
+        await conn.execute(
+            sqla.delete(EmbeddingVersion).where(EmbeddingVersion.version == version)
+        )
+        logger.info(f"Embedding version {version} collected")
+    return collected  # type: ignore
+
+
+async def check(conn: AsyncConnection):
+    state = await conn.scalar(
+        sqla.select(EmbeddingVersion.state).filter(
+            EmbeddingVersion.version == env.EMBEDDING_VERSION
+        )
+    )
+    if state is None and env.EMBEDDING_VERSION != LEGACY_VERSION:
+        logger.warning(
+            f"Embedding version {env.EMBEDDING_VERSION} is not registered, "
+            "run `python -m ai.embedding_version start` first"
+        )
+    elif state == EmbeddingVersionState.RETIRED:
+        logger.warning(
+            f"Embedding version {env.EMBEDDING_VERSION} is retired, "
+            "its vectors are garbage collected soon"
+        )
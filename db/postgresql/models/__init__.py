@@ -10,6 +10,7 @@ __all__ = [
     "blog",
     "chat",
     "shipper",
+    "embedding",
 ]
 # Base = declarative_base()
 
@@ -3,6 +3,7 @@ from db.postgresql.models import Base
 from sqlalchemy.dialects import postgresql as psql
 from sqlalchemy import orm
 from db.postgresql.models import product as prod
+from db.postgresql.models.embedding import embedding_type
 
 import sqlalchemy as sqla
 
@@ -61,5 +62,5 @@ class BlogEmbedding(Base):
         sqla.ForeignKey(Blog.id),
         primary_key=True,
     )
-    description_embed: orm.Mapped[Vector] = orm.mapped_column(Vector(768))
+    description_embed: orm.Mapped[Vector] = orm.mapped_column(embedding_type(768))
     doc: orm.Mapped[Blog] = orm.relationship(back_populates="embed")
@@ -0,0 +1,83 @@
+from datetime import datetime
+from enum import Enum
+
+import numpy as np
+import sqlalchemy as sqla
+from pgvector.sqlalchemy import HALFVEC, Vector
+from pgvector.utils import HalfVector
+from sqlalchemy import orm
+from sqlalchemy.sql import sqltypes
+
+from config import env
+from db.postgresql.models import Base
+
+
+class HalfVec(HALFVEC):
+    # reads back as float32 arrays, same as Vector columns
+    cache_ok = True
+
+    def result_processor(self, dialect, coltype):
+        def process(value):
+            if value is None:
+                return None
+            return HalfVector._from_db(value).to_numpy().astype(np.float32)
+
+        return process
+
+
+def embedding_type(dim: int):
+    match env.VECTOR_STORAGE:
+        case "vector":
+            return Vector(dim)
+        case "halfvec":
+            return HalfVec(dim)
+        case _:
+            raise Exception(f"Unknow vector storage:{env.VECTOR_STORAGE}")
+
+
+class EmbeddingVersionState(str, Enum):
+    MIGRATING = "MIGRATING"
+    ACTIVE = "ACTIVE"
+    RETIRED = "RETIRED"
+
+
+class EmbeddingVersion(Base):
+    __tablename__: str = "embedding_version"
+    version: orm.Mapped[str] = orm.mapped_column(
+        sqltypes.VARCHAR(64),
+        primary_key=True,
+    )
+    state: orm.Mapped[EmbeddingVersionState]
+    created_at: orm.Mapped[datetime] = orm.mapped_column(
+        sqltypes.TIMESTAMP,
+        server_default=sqla.func.now(),
+    )
+    activated_at: orm.Mapped[datetime | None] = orm.mapped_column(
+        sqltypes.TIMESTAMP,
+    )
+    retired_at: orm.Mapped[datetime | None] = orm.mapped_column(
+        sqltypes.TIMESTAMP,
+    )
+
+
+class EmbeddingBacklog(Base):
+    # rows written by a worker on another version, the re-embed job running
+    # with this version's models fills them in
+    __tablename__: str = "embedding_backlog"
+    version: orm.Mapped[str] = orm.mapped_column(
+        sqltypes.VARCHAR(64),
+        primary_key=True,
+    )
+    table_name: orm.Mapped[str] = orm.mapped_column(
+        sqltypes.VARCHAR(64),
+        primary_key=True,
+    )
+    id: orm.Mapped[str] = orm.mapped_column(
+        sqltypes.VARCHAR(255),
+        primary_key=True,
+    )
+    # moved by every write, so the job only clears entries it has embedded
+    queued_at: orm.Mapped[datetime] = orm.mapped_column(
+        sqltypes.TIMESTAMP,
+        server_default=sqla.func.clock_timestamp(),
+    )
@@ -4,20 +4,16 @@ from typing import Any
 
 import sqlalchemy as sqla
 from sqlalchemy import orm
+from sqlalchemy.dialects import postgresql as psql
 from sqlalchemy.sql import sqltypes
 
 from db.postgresql.models import Base
+from db.postgresql.models.embedding import embedding_type
+from etc.product_type import ProductType  # noqa: F401
 
 from pgvector.sqlalchemy import Vector
 
 
-class ProductType(str, Enum):
-    VEGETABLE = "VEG"
-    MEAT = "MEAT"
-    SEASON = "SS"
-    MEALKIT = "MK"
-
-
 class ProductStatus(str, Enum):
     IN_STOCK = "IN_STOCK"
     OUT_OF_STOCK = "OUT_OF_STOCK"
@@ -105,12 +101,42 @@ class ProductEmbedding(Base):
         sqla.ForeignKey(Product.id),
         primary_key=True,
     )
-    images_embed_yolo: orm.Mapped[Vector] = orm.mapped_column(Vector(512))
-    images_embed_clip: orm.Mapped[Vector] = orm.mapped_column(Vector(768))
-    description_embed: orm.Mapped[Vector] = orm.mapped_column(Vector(768))
+    images_embed_yolo: orm.Mapped[Vector] = orm.mapped_column(embedding_type(512))
+    images_embed_clip: orm.Mapped[Vector] = orm.mapped_column(embedding_type(768))
+    description_embed: orm.Mapped[Vector] = orm.mapped_column(embedding_type(768))
+    # copy of Product.product_types, so vector search can filter on it
+    product_type: orm.Mapped[ProductType | None]
     product: orm.Mapped[Product] = orm.relationship(back_populates="embed")
 
 
+class ProductNeighbor(Base):
+    # precomputed similar products, nearest first, see services.similar_product
+    __tablename__: str = "product_neighbor"
+    id: orm.Mapped[str] = orm.mapped_column(
+        sqla.ForeignKey(Product.id),
+        primary_key=True,
+    )
+    neighbors: orm.Mapped[list[str]] = orm.mapped_column(
+        psql.ARRAY(psql.VARCHAR(255)),
+    )
+    distances: orm.Mapped[list[float]] = orm.mapped_column(
+        psql.ARRAY(sqltypes.REAL),
+    )
+    updated_at: orm.Mapped[datetime] = orm.mapped_column(
+        sqltypes.TIMESTAMP,
+        server_default=sqla.func.now(),
+        onupdate=sqla.func.now(),
+    )
+    __table_args__ = (
+        # finds the lists a product appears in when its vectors change
+        sqla.Index(
+            "product_neighbor_neighbors_idx",
+            "neighbors",
+            postgresql_using="gin",
+        ),
+    )
+
+
 class ProductStockHistory(Base):
     __tablename__: str = "product_stock_history"
     product_id: orm.Mapped[str] = orm.mapped_column(
@@ -0,0 +1,31 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from db.postgresql import engine
+
+
+class QueryCount:
+    def __init__(self) -> None:
+        self.count = 0
+
+
+_current: ContextVar[QueryCount | None] = ContextVar("query_count", default=None)
+
+
+@event.listens_for(engine.sync_engine, "before_cursor_execute")
+def __count_query(*_):
+    counter = _current.get()
+    if counter is not None:
+        counter.count += 1
+
+
+@contextmanager
+def count_queries():
+    counter = QueryCount()
+    token = _current.set(counter)
+    try:
+        yield counter
+    finally:
+        _current.reset(token)
@@ -0,0 +1,59 @@
+import sqlalchemy as sqla
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from config import env
+from db.postgresql.models.blog import ProductDoc
+from db.postgresql.models.product import Product
+
+TEXT_COLUMNS = [
+    (Product.__tablename__, "product_name"),
+    (ProductDoc.__tablename__, "description"),
+]
+
+INDEX_PREFIX = "tidx"
+
+
+def __config():
+    # a constant, not a bind parameter, or the expression would not match the
+    # index
+    return sqla.literal_column(f"'{env.SEARCH_TEXT_CONFIG}'::regconfig")
+
+
+def tsvector(column):
+    return sqla.func.to_tsvector(__config(), column)
+
+
+def tsquery(text: str):
+    # any term may match, ts_rank_cd puts rows with more of them first
+    terms = sqla.cast(sqla.func.plainto_tsquery(__config(), text), sqla.Text)
+    return sqla.func.to_tsquery(__config(), sqla.func.replace(terms, "&", "|"))
+
+
+def index_name(table: str, column: str) -> str:
+    return f"{INDEX_PREFIX}_{table}_{column}_{env.SEARCH_TEXT_CONFIG}"
+
+
+def create_index_sql(table: str, column: str) -> str:
+    return (
+        f"CREATE INDEX IF NOT EXISTS {index_name(table, column)} ON {table} "
+        f"USING gin (to_tsvector('{env.SEARCH_TEXT_CONFIG}'::regconfig, {column}))"
+    )
+
+
+async def ensure_text_indexes(conn: AsyncConnection):
+    for table, column in TEXT_COLUMNS:
+        wanted = index_name(table, column)
+
+        existing = await conn.scalars(
+            sqla.text(
+                "SELECT indexname FROM pg_indexes "
+                "WHERE tablename = :table AND indexname LIKE :prefix"
+            ),
+            {"table": table, "prefix": f"{INDEX_PREFIX}_{table}_{column}_%"},
+        )
+
+        for name in existing.all():
+            if name != wanted:
+                await conn.execute(sqla.text(f"DROP INDEX IF EXISTS {name}"))
+
+        await conn.execute(sqla.text(create_index_sql(table, column)))
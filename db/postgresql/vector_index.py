@@ -0,0 +1,242 @@
+import hashlib
+import logging
+import re
+
+import sqlalchemy as sqla
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from config import env
+from db.postgresql import embedding_version
+from db.postgresql.models.blog import BlogEmbedding
+from db.postgresql.models.product import Product, ProductEmbedding, ProductType
+
+VECTOR_COLUMNS = [
+    (ProductEmbedding.__tablename__, "images_embed_yolo"),
+    (ProductEmbedding.__tablename__, "images_embed_clip"),
+    (ProductEmbedding.__tablename__, "description_embed"),
+    (BlogEmbedding.__tablename__, "description_embed"),
+]
+
+# tables with a product_type column
+FILTER_TABLES = [ProductEmbedding.__tablename__]
+
+INDEX_PREFIX = "vidx"
+MAX_NAME = 63
+
+logger = logging.getLogger("uvicorn.info")
+
+# pgvector 0.8 added iterative index scans, set by check_extension on startup
+__iterative_scan = True
+
+
+def index_params() -> dict[str, int]:
+    match env.VECTOR_INDEX_TYPE:
+        case "hnsw":
+            return {"m": env.HNSW_M, "ef_construction": env.HNSW_EF_CONSTRUCTION}
+        case "ivfflat":
+            return {"lists": env.IVFFLAT_LISTS}
+        case "none":
+            return {}
+        case _:
+            raise Exception(f"Unknow vector index type:{env.VECTOR_INDEX_TYPE}")
+
+
+def filter_mode() -> str:
+    if env.VECTOR_FILTER_MODE == "iterative" and not __iterative_scan:
+        return "partial"
+    return env.VECTOR_FILTER_MODE
+
+
+def partial_types(table: str) -> list[ProductType]:
+    # one extra index per type, each only holds that type's rows
+    match filter_mode():
+        case "partial" if table in FILTER_TABLES:
+            return list(ProductType)
+        case "partial" | "iterative":
+            return []
+        case _:
+            raise Exception(f"Unknow vector filter mode:{env.VECTOR_FILTER_MODE}")
+
+
+def index_name(
+    table: str, column: str, product_type: ProductType | None = None
+) -> str:
+    # build parameters are part of the name so a config change rebuilds the index
+    params = "_".join(f"{k}{v}" for k, v in index_params().items())
+    name = f"{INDEX_PREFIX}_{table}_{column}_{env.VECTOR_INDEX_TYPE}_{params}"
+    if env.VECTOR_STORAGE == "halfvec":
+        name = f"{name}_half"
+    if product_type is not None:
+        name = f"{name}_{product_type.name.lower()}"
+    if len(name) > MAX_NAME:
+        # postgres cuts identifiers at 63 bytes, which would drop the params
+        digest = hashlib.sha1(name.encode()).hexdigest()[:10]
+        name = f"{name[: MAX_NAME - 11]}_{digest}"
+    return name
+
+
+def create_index_sql(
+    table: str, column: str, product_type: ProductType | None = None
+) -> str:
+    params = ", ".join(f"{k} = {int(v)}" for k, v in index_params().items())
+    sql = (
+        f"CREATE INDEX IF NOT EXISTS {index_name(table, column, product_type)} "
+        f"ON {table} USING {env.VECTOR_INDEX_TYPE} "
+        f"({column} {env.VECTOR_STORAGE}_l2_ops) WITH ({params})"
+    )
+    if product_type is not None:
+        sql = f"{sql} WHERE product_type = '{product_type.name}'"
+    return sql
+
+
+def type_filter(model, product_type: ProductType):
+    # inlined, a bind parameter cannot be matched against a partial index
+    # predicate in a generic plan
+    return model.product_type == sqla.bindparam(
+        "product_type",
+        product_type,
+        type_=model.product_type.type,
+        unique=True,
+        literal_execute=True,
+    )
+
+
+async def __live_tables(conn: AsyncConnection, table: str) -> list[str]:
+    model = {m.__tablename__: m for m in embedding_version.EMBEDDING_MODELS}[table]
+    return [t.name for t in await embedding_version.live_tables(conn, model)]
+
+
+async def __drop_indexes(
+    conn: AsyncConnection, table: str, column: str, keep: tuple[str, ...] = ()
+):
+    # by name, or by method for the ones a version table copied at registration
+    existing = await conn.scalars(
+        sqla.text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = :table "
+            "AND (indexname LIKE :prefix OR indexdef ~ :method)"
+        ),
+        {
+            "table": table,
+            "prefix": f"{INDEX_PREFIX}_{table}_{column}_%",
+            "method": rf"USING (hnsw|ivfflat) \({column} ",
+        },
+    )
+
+    for name in existing.all():
+        if name not in keep:
+            await conn.execute(sqla.text(f"DROP INDEX IF EXISTS {name}"))
+
+
+async def ensure_vector_storage(conn: AsyncConnection):
+    # converts the columns in place when VECTOR_STORAGE changes, the index
+    # opclass is tied to the type so the old indexes go first. Every live
+    # version, queries cast to VECTOR_STORAGE and find no operator otherwise
+    for base, column in VECTOR_COLUMNS:
+        for table in await __live_tables(conn, base):
+            await __convert(conn, table, column)
+
+
+async def __convert(conn: AsyncConnection, table: str, column: str):
+    current = (
+        await conn.execute(
+            sqla.text(
+                "SELECT t.typname, a.atttypmod FROM pg_attribute a "
+                "JOIN pg_type t ON t.oid = a.atttypid "
+                "WHERE a.attrelid = CAST(:table AS regclass) "
+                "AND a.attname = :column"
+            ),
+            {"table": table, "column": column},
+        )
+    ).one()
+    storage, dim = current
+    if storage == env.VECTOR_STORAGE:
+        return
+
+    await __drop_indexes(conn, table, column)
+    wanted = f"{env.VECTOR_STORAGE}({int(dim)})"
+    await conn.execute(
+        sqla.text(
+            f"ALTER TABLE {table} ALTER COLUMN {column} "
+            f"TYPE {wanted} USING {column}::{wanted}"
+        )
+    )
+    logger.info(f"Converted {table}.{column} from {storage} to {wanted}")
+
+
+async def check_extension(conn: AsyncConnection):
+    global __iterative_scan
+    version = await conn.scalar(
+        sqla.text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+    )
+    major, minor = (int(p) for p in re.findall(r"\d+", version or "0.0")[:2])
+    __iterative_scan = (major, minor) >= (0, 8)
+
+    if not __iterative_scan and env.VECTOR_FILTER_MODE == "iterative":
+        logger.warning(
+            f"pgvector {version} has no iterative index scan (0.8+), "
+            "filtered vector search uses partial indexes instead"
+        )
+
+
+async def ensure_product_type(conn: AsyncConnection):
+    # create_all does not add columns to existing tables, and version tables
+    # registered before the column existed copied the table without it
+    for target in await embedding_version.live_tables(conn, ProductEmbedding):
+        await conn.execute(
+            sqla.text(
+                f"ALTER TABLE {target.name} ADD COLUMN IF NOT EXISTS "
+                f"product_type {ProductEmbedding.product_type.type.name}"
+            )
+        )
+        synced = await conn.execute(
+            sqla.update(target)
+            .where(
+                target.c.id == Product.id,
+                target.c.product_type.is_distinct_from(Product.product_types),
+            )
+            .values(product_type=Product.product_types)
+        )
+        if synced.rowcount:
+            logger.info(f"Synced product_type of {synced.rowcount} {target.name} rows")
+
+
+async def ensure_vector_indexes(conn: AsyncConnection):
+    # on the tables of every live version, a settings change reaches the
+    # version that serves reads
+    for table, column in VECTOR_COLUMNS:
+        for name in await __live_tables(conn, table):
+            if env.VECTOR_INDEX_TYPE == "none":
+                wanted = {}
+            else:
+                wanted = {
+                    index_name(name, column, t): create_index_sql(name, column, t)
+                    for t in [None, *partial_types(table)]
+                }
+
+            await __drop_indexes(conn, name, column, tuple(wanted))
+
+            for sql in wanted.values():
+                await conn.execute(sqla.text(sql))
+
+
+async def apply_search_params(ss: AsyncSession, k: int, filtered: bool = False):
+    # must run inside the search transaction, SET LOCAL resets on commit
+    match env.VECTOR_INDEX_TYPE:
+        case "hnsw":
+            # hnsw returns at most ef_search rows, keep it above the LIMIT
+            ef_search = max(env.HNSW_EF_SEARCH, k)
+            await ss.execute(sqla.text(f"SET LOCAL hnsw.ef_search = {int(ef_search)}"))
+        case "ivfflat":
+            probes = env.IVFFLAT_PROBES
+            await ss.execute(sqla.text(f"SET LOCAL ivfflat.probes = {int(probes)}"))
+        case _:
+            return
+
+    if filtered and filter_mode() == "iterative":
+        # pgvector >= 0.8, keeps scanning the index until the WHERE clause has
+        # let k rows through instead of filtering the first ef_search
+        await ss.execute(
+            sqla.text(
+                f"SET LOCAL {env.VECTOR_INDEX_TYPE}.iterative_scan = relaxed_order"
+            )
+        )
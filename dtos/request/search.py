@@ -1,5 +1,27 @@
+from typing import Literal
+
 from pydantic import BaseModel
 
+from db.postgresql.models import product as p
+
 
 class SearchPrompt(BaseModel):
     prompt: str
+
+
+class BatchQuery(BaseModel):
+    key: str
+    target: Literal["product", "blog"] = "product"
+    prompt: str | None = None
+    # index into the uploaded images
+    image: int | None = None
+    type: p.ProductType | None = None
+    text_dist: float = 0.7
+    img_dist: float = 0.7
+    yolo_dist: float = 1.4
+    clip_dist: float = 0.7
+
+
+class BatchSearch(BaseModel):
+    queries: list[BatchQuery]
+
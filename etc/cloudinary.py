@@ -1,14 +1,21 @@
-import cloudinary
-import cloudinary.uploader
+from functools import cache
 from config import env
 
 uri = f"cloudinary://{env.CLOUDINARY_API_KEY}:{env.CLOUDINARY_API_SECRET}@{env.CLOUDINARY_NAME}"
 
-cloudinary.config(
-    api_secret=env.CLOUDINARY_API_SECRET,
-    api_key=env.CLOUDINARY_API_KEY,
-    cloud_name=env.CLOUDINARY_NAME,
-)
+
+@cache
+def __uploader():
+    # the SDK is imported and configured on the first upload
+    import cloudinary
+    import cloudinary.uploader
+
+    cloudinary.config(
+        api_secret=env.CLOUDINARY_API_SECRET,
+        api_key=env.CLOUDINARY_API_KEY,
+        cloud_name=env.CLOUDINARY_NAME,
+    )
+    return cloudinary.uploader
 
 
 def upload(
@@ -16,7 +23,7 @@ def upload(
     dir: str,
     public_id: str,
 ) -> str:
-    return cloudinary.uploader.upload(
+    return __uploader().upload(
         image,
         public_id=public_id,
         asset_folder=dir,
@@ -7,3 +7,9 @@ class HandledError(Exception):
         return self.msg
 
     pass
+
+
+class ServiceUnavailableError(HandledError):
+    def __init__(self, msg: str, retry_after: int) -> None:
+        self.retry_after = retry_after
+        super().__init__(msg)
@@ -1,26 +1,42 @@
 import logging
-from paypalserversdk.http.auth.o_auth_2 import ClientCredentialsAuthCredentials
-from paypalserversdk.controllers.payments_controller import PaymentsController
-from paypalserversdk.logging.configuration.api_logging_configuration import (
-    LoggingConfiguration,
-    RequestLoggingConfiguration,
-    ResponseLoggingConfiguration,
-)
-from paypalserversdk.paypal_serversdk_client import PaypalServersdkClient
-from paypalserversdk.configuration import Environment
+from functools import cache
+from typing import TYPE_CHECKING
 from config import env
 
-client = PaypalServersdkClient(
-    client_credentials_auth_credentials=ClientCredentialsAuthCredentials(
-        o_auth_client_id=env.PAYPAL_CLIENT_ID,
-        o_auth_client_secret=env.PAYPAL_CLIENT_SECRET,
-    ),
-    environment=Environment.SANDBOX,
-    logging_configuration=LoggingConfiguration(
-        log_level=logging.ERROR,
-        request_logging_config=RequestLoggingConfiguration(log_body=True),
-        response_logging_config=ResponseLoggingConfiguration(log_headers=True),
-    ),
-)
-
-payment_controller: PaymentsController = client.payments
+# the SDK is imported when the first payment call is made
+if TYPE_CHECKING:
+    from paypalserversdk.controllers.payments_controller import PaymentsController
+
+
+@cache
+def payments() -> "PaymentsController":
+    from paypalserversdk.http.auth.o_auth_2 import ClientCredentialsAuthCredentials
+    from paypalserversdk.logging.configuration.api_logging_configuration import (
+        LoggingConfiguration,
+        RequestLoggingConfiguration,
+        ResponseLoggingConfiguration,
+    )
+    from paypalserversdk.paypal_serversdk_client import PaypalServersdkClient
+    from paypalserversdk.configuration import Environment
+
+    client = PaypalServersdkClient(
+        client_credentials_auth_credentials=ClientCredentialsAuthCredentials(
+            o_auth_client_id=env.PAYPAL_CLIENT_ID,
+            o_auth_client_secret=env.PAYPAL_CLIENT_SECRET,
+        ),
+        environment=Environment.SANDBOX,
+        logging_configuration=LoggingConfiguration(
+            log_level=logging.ERROR,
+            request_logging_config=RequestLoggingConfiguration(log_body=True),
+            response_logging_config=ResponseLoggingConfiguration(log_headers=True),
+        ),
+    )
+    return client.payments
+
+
+class LazyPaymentsController:
+    def __getattr__(self, name: str):
+        return getattr(payments(), name)
+
+
+payment_controller = LazyPaymentsController()
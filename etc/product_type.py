@@ -0,0 +1,9 @@
+from enum import Enum
+
+
+# outside the models so config can validate against it without importing the db
+class ProductType(str, Enum):
+    VEGETABLE = "VEG"
+    MEAT = "MEAT"
+    SEASON = "SS"
+    MEALKIT = "MK"
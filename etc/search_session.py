@@ -0,0 +1,43 @@
+import secrets
+from typing import Any, Hashable, NamedTuple
+
+from ai.embed_cache import EmbeddingCache
+from config import env
+from db.postgresql.paging import Page
+
+
+class SearchSession(NamedTuple):
+    query: Hashable
+    rows: list[tuple[Any, ...]]
+    extra: dict[str, Any]
+
+
+sessions = EmbeddingCache(env.SEARCH_SESSION_SIZE, env.SEARCH_SESSION_TTL)
+
+
+def save(
+    query: Hashable,
+    rows: list[tuple[Any, ...]],
+    extra: dict[str, Any] | None = None,
+) -> str:
+    token = secrets.token_urlsafe(16)
+    sessions.put(token, SearchSession(query, rows, extra or {}))
+    return token
+
+
+def load(token: str | None, query: Hashable) -> SearchSession | None:
+    if not token:
+        return None
+
+    session = sessions.get(token)
+
+    # a token from a different query is treated as a fresh search
+    if session is None or session.query != query:
+        return None
+
+    return session
+
+
+def page_rows(rows: list[tuple[Any, ...]], pg: Page) -> list[tuple[Any, ...]]:
+    start = pg.page_index * pg.page_size
+    return rows[start : start + pg.page_size]
@@ -1,4 +1,3 @@
-import asyncio
 from typing import Annotated, Any
 import uuid
 from sqlalchemy.exc import (
@@ -10,7 +9,7 @@ import traceback
 from fastapi import Cookie, FastAPI, Request
 from fastapi.responses import JSONResponse
 from auth import api as auth_api
-from etc.local_error import HandledError
+from etc.local_error import HandledError, ServiceUnavailableError
 from routers import (
     shipper,
     staff,
@@ -24,17 +23,26 @@ from routers import (
 from contextlib import asynccontextmanager
 import logging
 import ai
+from ai import batching
+from ai.loader import ModelStore, model_leases
 from fastapi.middleware.cors import CORSMiddleware
 import db.postgresql as db
-
-asyncio.run(db.init_db())
+from services.search_backend import backend as search_backend
 
 preload: dict[Any, Any] = dict()
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
-    yield {"ai_models": ai.load_all_model(), "test": "lesus"}
+    # models load in the background, endpoints that need one answer 503
+    # until it is ready, the schema init runs meanwhile
+    ai_models = ModelStore({**ai.model_loaders(), **ai.forecast_loaders()})
+    ai_models.start()
+    await db.init_db()
+    search_backend.start()
+    yield {"ai_models": ai_models, "test": "lesus"}
+    search_backend.stop()
+    batching.stop()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -59,6 +67,22 @@ app.add_middleware(
     allow_methods=["*"],
 )
 
+MODEL_VERSION_HEADER = "X-Model-Versions"
+
+
+@app.middleware("http")
+async def model_versions(req: Request, call_next):
+    # models looked up during the request stay on the version they first got,
+    # and the old version is not unloaded until these leases are released
+    with model_leases() as leases:
+        res = await call_next(req)
+        if leases:
+            res.headers[MODEL_VERSION_HEADER] = ",".join(
+                f"{name}={v.version}" for name, v in leases.items()
+            )
+    return res
+
+
 app.include_router(dev.router)
 app.include_router(general.router)
 app.include_router(manager.router)
@@ -102,6 +126,18 @@ async def local_error_handler(req: Request, exc: HandledError | NoResultFound):
     )
 
 
+@app.exception_handler(ServiceUnavailableError)
+async def unavailable_error_handler(req: Request, exc: ServiceUnavailableError):
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": str(exc.retry_after)},
+        content={
+            "api": str(req.url),
+            "message": (f"{exc}"),
+        },
+    )
+
+
 @app.exception_handler(StatementError)
 async def sql_error_handler(req: Request, exc: StatementError):
     msg = exc.orig.__str__().splitlines()
@@ -131,5 +167,10 @@ async def read_root(cookie: Annotated[str, Cookie()] = None):
     return response
 
 
+@app.get("/ready")
+async def ready(req: Request):
+    return req.state.ai_models.status()
+
+
 if __name__ == "__main__":
     uvicorn.run(app)
@@ -3,13 +3,23 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 import uvicorn
 from main import app
+import db.postgresql as db
+from services.search_backend import backend as search_backend
 
 import ai
+from ai import batching
+from ai.loader import ModelStore
 
 
 @asynccontextmanager
 async def lifespan(_: FastAPI):
-    yield {"ai_models": ai.load_all_stub_model(), "test": "lesus"}
+    ai_models = ModelStore({**ai.stub_model_loaders(), **ai.forecast_loaders()})
+    ai_models.start()
+    await db.init_db()
+    search_backend.start()
+    yield {"ai_models": ai_models, "test": "lesus"}
+    search_backend.stop()
+    batching.stop()
 
 
 app.router.lifespan_context = lifespan
@@ -2,7 +2,7 @@ from email.mime.multipart import MIMEMultipart
 import smtplib
 from typing import Annotated
 from emails.utils import MIMEText
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
 from pydantic import EmailStr
 from sqlalchemy.ext.asyncio import AsyncSession
 from db.postgresql.db_session import get_session
@@ -11,7 +11,9 @@ from services import account as acc_sv
 from datetime import datetime
 from etc import smtp
 from config import env
+from ai import batching, embed_cache, executor
 import auth
+from etc.local_error import HandledError
 
 Permission = Annotated[bool, Depends(auth.manager_permission)]
 
@@ -31,6 +33,26 @@ async def cors() -> str:
     return "CORS"
 
 
+@router.get("/ai/metrics")
+async def ai_metrics():
+    return {
+        "batching": batching.metrics(),
+        "executor": executor.stats(),
+        "embed_cache": embed_cache.stats(),
+    }
+
+
+@router.post("/ai/models/{name}/reload")
+async def reload_model(name: str, req: Request, _: Permission):
+    if name not in req.state.ai_models:
+        raise HandledError(f"Unknown model: {name}")
+    switched = await req.state.ai_models.reload(name, force=True)
+    return {
+        "switched": switched,
+        "model": req.state.ai_models.status()["models"][name],
+    }
+
+
 @router.get("/mail/smtp/test")
 def test_smtp_connection():
     smtp_host = "smtp.gmail.com"
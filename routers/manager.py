@@ -1,16 +1,14 @@
 from datetime import date
 from enum import Enum
 from typing import Annotated
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from services import shipper as s_sv
 from dtos.request import shipper as s_dto
 from services.predict import (
-    load_product_model,
     predict_top_selling_products,
-    load_revenue_model,
     predict_next_month_revenue,
 )
 from db.postgresql.db_session import get_session
@@ -46,10 +44,6 @@ router = APIRouter(prefix="/api/manager", tags=["Manager function"])
 
 oauth2_scheme = auth.oauth2_scheme
 
-product_model = load_product_model("product_prediction_linear.pkl")
-revenue_model = load_revenue_model("revenue_prediction_xgb.pkl")
-
-
 class DailyRevenue(BaseModel):
     date: str
     revenue: float
@@ -270,11 +264,13 @@ async def get_revenue_and_top_products(
 async def get_predicted_top_products(
     _: StaffPermission,
     ss: Session,
+    req: Request,
 ) -> PredictedProductsResponse:
     today = date.today()
     last_month = today.month - 1 if today.month > 1 else 12
     last_year = today.year if today.month > 1 else today.year - 1
 
+    product_model = req.state.ai_models["product_forecast"]
     predicted_products = await predict_top_selling_products(
         ss, product_model, last_year, last_month
     )
@@ -289,11 +285,13 @@ async def get_predicted_top_products(
 async def get_next_month_revenue_prediction(
     _: StaffPermission,
     ss: Session,
+    req: Request,
 ) -> RevenuePredictionResponse:
     today = date.today()
     next_month = today.month + 1 if today.month < 12 else 1
     next_year = today.year if today.month < 12 else today.year + 1
 
+    revenue_model = req.state.ai_models["revenue_forecast"]
     predicted_revenue = await predict_next_month_revenue(
         ss, revenue_model, next_year, next_month
     )
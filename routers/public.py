@@ -1,11 +1,14 @@
 from typing import Annotated
-from fastapi import APIRouter, Depends, File, Request, UploadFile
+from fastapi import APIRouter, Depends, File, Form, Request, Response, UploadFile
+from pydantic import Json
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from db.postgresql.db_session import get_session
+from db.postgresql.query_counter import count_queries
 from db.postgresql.models.product import ProductType
-from dtos.request.search import SearchPrompt
+from dtos.request.search import BatchSearch, SearchPrompt
 from services import public
+from services.search_backend import HybridWeights
 
 from db.postgresql.paging import Page, page_param
 
@@ -14,70 +17,151 @@ Session = Annotated[AsyncSession, Depends(get_session)]
 
 router = APIRouter(prefix="/public", tags=["Public"])
 
+ROUND_TRIP_HEADER = "X-DB-Round-Trips"
+
 
 @router.post("/search/desc")
 async def search_vec_desc(
     prompt: SearchPrompt,
     req: Request,
+    res: Response,
     pg: Paging,
     ss: Session,
     type: ProductType | None = None,
     text_dist: float = 0.7,
     img_dist: float = 0.7,
+    search_token: str | None = None,
+):
+    with count_queries() as queries:
+        result = await public.vector_search_prompt(
+            prompt.prompt,
+            req.state.ai_models,
+            type,
+            pg,
+            ss,
+            text_dist,
+            img_dist,
+            search_token,
+        )
+    res.headers[ROUND_TRIP_HEADER] = str(queries.count)
+    return result
+
+
+@router.post("/search/hybrid")
+async def search_hybrid(
+    prompt: SearchPrompt,
+    req: Request,
+    res: Response,
+    pg: Paging,
+    ss: Session,
+    type: ProductType | None = None,
+    text_weight: float = 1.0,
+    image_weight: float = 1.0,
+    keyword_weight: float = 1.0,
+    search_token: str | None = None,
 ):
-    yolo_model = req.state.ai_models["clip"]
-    return await public.vector_search_prompt(
-        prompt.prompt,
-        yolo_model,
-        type,
-        pg,
-        ss,
-        text_dist,
-        img_dist,
-    )
+    with count_queries() as queries:
+        result = await public.hybrid_search_prompt(
+            prompt.prompt,
+            req.state.ai_models,
+            type,
+            pg,
+            ss,
+            HybridWeights(text_weight, image_weight, keyword_weight),
+            search_token,
+        )
+    res.headers[ROUND_TRIP_HEADER] = str(queries.count)
+    return result
 
 
 @router.post("/search/image")
 async def search_vec_yolo(
-    image: Annotated[UploadFile, File(media_type="image")],
     req: Request,
+    res: Response,
     pg: Paging,
     ss: Session,
+    image: Annotated[UploadFile | None, File(media_type="image")] = None,
     type: ProductType | None = None,
     yolo_dist: float = 1.4,
     clip_dist: float = 0.7,
+    search_token: str | None = None,
 ):
-    yolo_model = req.state.ai_models["yolo"]
-    clip_model = req.state.ai_models["clip"]
-
-    image_preload = await image.read()
+    # later pages of an image search only need the token
+    image_preload = await image.read() if image else None
 
-    return await public.vector_search_image_yolo(
-        image_preload,
-        yolo_model,
-        clip_model,
-        type,
-        pg,
-        ss,
-        yolo_dist,
-        clip_dist,
-    )
+    with count_queries() as queries:
+        result = await public.vector_search_image_yolo(
+            image_preload,
+            req.state.ai_models,
+            type,
+            pg,
+            ss,
+            yolo_dist,
+            clip_dist,
+            search_token,
+        )
+    res.headers[ROUND_TRIP_HEADER] = str(queries.count)
+    return result
 
 
 @router.post("/search/blog")
 async def search_vec_blog(
     req: Request,
+    res: Response,
     pg: Paging,
     ss: Session,
     prompt: str,
     text_dist: float = 0.7,
+    search_token: str | None = None,
 ):
+    with count_queries() as queries:
+        result = await public.vector_search_blog(
+            prompt,
+            req.state.ai_models,
+            pg,
+            ss,
+            text_dist,
+            search_token,
+        )
+    res.headers[ROUND_TRIP_HEADER] = str(queries.count)
+    return result
+
+
+@router.post("/search/batch")
+async def search_batch(
+    # a JSON form field, sent next to the photos
+    batch: Annotated[Json[BatchSearch], Form()],
+    req: Request,
+    res: Response,
+    pg: Paging,
+    ss: Session,
+    images: list[Annotated[UploadFile, File(media_type="image")]] | None = None,
+):
+    yolo_model = req.state.ai_models["yolo"]
     clip_model = req.state.ai_models["clip"]
 
-    return await public.vector_search_blog(
-        prompt,
-        clip_model,
-        pg,
-        ss,
-        text_dist,
-    )
+    images_preload = [await f.read() for f in images] if images else []
+
+    with count_queries() as queries:
+        result = await public.batch_search(
+            batch.queries,
+            images_preload,
+            yolo_model,
+            clip_model,
+            pg,
+            ss,
+        )
+    res.headers[ROUND_TRIP_HEADER] = str(queries.count)
+    return result
+
+
+@router.get("/product/similar")
+async def similar_products(
+    prod_id: str,
+    res: Response,
+    ss: Session,
+):
+    with count_queries() as queries:
+        result = await public.similar_products(prod_id, ss)
+    res.headers[ROUND_TRIP_HEADER] = str(queries.count)
+    return result
@@ -1,7 +1,9 @@
 from uuid import uuid4
 
 from sqlalchemy.ext.asyncio import AsyncSession
+from ai import batching
 from ai.clip import OpenCLIP
+from db.postgresql import embedding_version
 from db.postgresql.models.blog import Blog, BlogEmbedding
 from db.postgresql.models.user_account import (
     CommentStatus,
@@ -12,6 +14,7 @@ from db.postgresql.models.user_account import (
 from dtos.request.blog import BlogCreation
 from etc import cloudinary
 from etc.local_error import HandledError
+from services.search_backend import backend as search_backend
 import sqlalchemy as sqla
 
 
@@ -47,20 +50,18 @@ async def create(
             thumbnail=thumbnail_url,
         )
 
-        embed = clip_model.encode_text(blog_dto.description)[0]
-
-        blog_embed = BlogEmbedding(
-            id=id,
-            description_embed=embed,
-        )
+        embed = await batching.encode_text(clip_model, blog_dto.description)
 
         ss.add(blog)
-        ss.add(blog_embed)
         await ss.flush()
 
+        await embedding_version.write(
+            ss, BlogEmbedding, id, {"description_embed": embed}
+        )
+
         b_rfetch = await ss.get_one(Blog, id)
 
-        return {
+        content = {
             "id": b_rfetch.id,
             "title": b_rfetch.title,
             "description": b_rfetch.description,
@@ -69,6 +70,10 @@ async def create(
             "infos": b_rfetch.infos,
         }
 
+    search_backend.upsert(BlogEmbedding, id, {"description_embed": embed})
+
+    return content
+
 
 async def edit(
     id: str,
@@ -93,17 +98,17 @@ async def edit(
         blog.description = blog_dto.description
         blog.infos = blog_dto.infos
 
-        blog_embed = await ss.get_one(BlogEmbedding, id)
-
-        embed = clip_model.encode_text(blog_dto.description)[0]
+        embed = await batching.encode_text(clip_model, blog_dto.description)
 
-        blog_embed.description_embed = embed
+        await embedding_version.write(
+            ss, BlogEmbedding, id, {"description_embed": embed}
+        )
 
         await ss.flush()
 
         b_rfetch = await ss.get_one(Blog, id)
 
-        return {
+        content = {
             "id": b_rfetch.id,
             "title": b_rfetch.title,
             "description": b_rfetch.description,
@@ -112,6 +117,10 @@ async def edit(
             "infos": b_rfetch.infos,
         }
 
+    search_backend.upsert(BlogEmbedding, id, {"description_embed": embed})
+
+    return content
+
 
 async def get(id: str, ss: AsyncSession):
     async with ss.begin():
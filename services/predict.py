@@ -1,5 +1,4 @@
-import pickle
-import pandas as pd
+from typing import TYPE_CHECKING
 import sqlalchemy as sqla
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
@@ -9,22 +8,16 @@ from db.postgresql.models.product import Product
 from db.postgresql.models.order_history import OrderHistoryItems, OrderHistory
 from db.postgresql.models.user_account import Cart
 
+# pandas is only needed by the prediction endpoints, keep it off startup
+if TYPE_CHECKING:
+    import pandas as pd
 
-def load_product_model(file_path_product: str):
-    file_path_product = r"./ai/weights/linear_regression_product_model.pkl"
-    with open(file_path_product, "rb") as f:
-        model = pickle.load(f)
-    return model
 
+async def prepare_data_for_prediction(
+    ss: AsyncSession, year: int, month: int
+) -> "pd.DataFrame":
+    import pandas as pd
 
-def load_revenue_model(file_path_revenue: str):
-    file_path_revenue = r"./ai/weights/xgb_revenue.pkl"
-    with open(file_path_revenue, "rb") as f:
-        model = pickle.load(f)
-    return model
-
-
-async def prepare_data_for_prediction(ss: AsyncSession, year: int, month: int):
     r = await ss.execute(
         sqla.select(
             OrderHistoryItems.product_id.label("product_id"),
@@ -2,7 +2,9 @@ from typing import Any
 
 import sqlalchemy as sqla
 from sqlalchemy.ext.asyncio import AsyncSession
+from ai import batching
 from ai.clip import OpenCLIP
+from db.postgresql import embedding_version
 from db.postgresql.models.blog import ProductDoc
 from datetime import datetime
 from db.postgresql.models import product as prod
@@ -13,6 +15,8 @@ from dtos.request.product import (
     MealKitUpdate,
 )
 from etc.local_error import HandledError
+from services import similar_product
+from services.search_backend import backend as search_backend
 from sqlalchemy import func
 from db.postgresql.paging import Page, display_page, paging, table_size
 
@@ -38,11 +42,12 @@ async def update_info(
         prod_doc.article_md = prod_info.article_md
         prod_doc.infos = prod_info.infos
 
-        embed = clip_model.encode_text(prod_info.description)[0]
+        embed = await batching.encode_text(clip_model, prod_info.description)
 
-        prod_embed = await ss.get_one(prod.ProductEmbedding, prod_id)
-
-        prod_embed.description_embed = embed
+        await embedding_version.write(
+            ss, prod.ProductEmbedding, prod_id, {"description_embed": embed}
+        )
+        await similar_product.update(ss, prod_id)
 
         if type(prod_info) is MealKitUpdate:
             await ss.execute(
@@ -87,6 +92,12 @@ async def update_info(
             content["instructions"] = doc_refetch.instructions
             content["ingredients"] = ingredients.all()
 
+    search_backend.upsert(
+        prod.ProductEmbedding,
+        prod_id,
+        {"description_embed": embed},
+    )
+
     return content
 
 
@@ -1,10 +1,10 @@
-from io import BytesIO
 import logging
 import re
-from PIL import Image, ImageFile
+from PIL import Image
 from fastapi import BackgroundTasks
 from sqlalchemy.ext.asyncio import AsyncSession
-from ai import clip, yolo
+from ai import batching, clip, executor, image_io, yolo
+from db.postgresql import embedding_version
 from db.postgresql.models.blog import ProductDoc
 import db.postgresql.models.product as prod
 import sqlalchemy as sqla
@@ -13,11 +13,13 @@ from db.postgresql.paging import Page, display_page, paging
 from dtos.request.product import MealKitCreation, ProductCreation
 from etc import cloudinary
 from etc.local_error import HandledError
+from services import similar_product
+from services.search_backend import backend as search_backend
 # from etc.prog_tracker import ProdCrtStg, ProgressTrackerManager
 
 
-def read_image(file: bytes) -> ImageFile.ImageFile:
-    return Image.open(BytesIO(file))
+def read_image(file: bytes) -> Image.Image:
+    return image_io.load_image(file)
 
 
 IMG_DIR = "prod_dir"
@@ -33,30 +35,44 @@ async def __embed_data(
     clip_model: clip.OpenCLIP,
     description: str,
     main_image: bytes,
+    product_type: prod.ProductType,
     ss: AsyncSession,
     # prod_tcker: ProgressTrackerManager,
 ):
     async with ss.begin():
         images_bytes = [read_image(main_image)]
 
-        description_embed = clip_model.encode_text(description)[0]
+        description_embed = await batching.encode_text(clip_model, description)
         # prod_tcker.update(ProdCrtStg.EMBED_DATA, 1)
 
-        images_embed_clip = clip_model.encode_image(images_bytes)[0]
+        images_embed_clip = await batching.encode_image(clip_model, images_bytes[0])
         # prod_tcker.update(ProdCrtStg.EMBED_DATA, 2)
 
-        images_embed_yolo = yolo_model.embed(images_bytes)[0]
+        images_embed_yolo = (await executor.run(yolo_model.embed, images_bytes))[0]
         # prod_tcker.update(ProdCrtStg.EMBED_DATA, 3)
 
-        product_embedded = prod.ProductEmbedding(
-            id=prod_id,
-            images_embed_clip=images_embed_clip,
-            images_embed_yolo=images_embed_yolo,
-            description_embed=description_embed,
+        await embedding_version.write(
+            ss,
+            prod.ProductEmbedding,
+            prod_id,
+            {
+                "images_embed_clip": images_embed_clip,
+                "images_embed_yolo": images_embed_yolo,
+                "description_embed": description_embed,
+            },
         )
+        await similar_product.update(ss, prod_id)
 
-        ss.add(product_embedded)
-        await ss.flush()
+    search_backend.upsert(
+        prod.ProductEmbedding,
+        prod_id,
+        {
+            "images_embed_clip": images_embed_clip,
+            "images_embed_yolo": images_embed_yolo,
+            "description_embed": description_embed,
+            "product_type": product_type,
+        },
+    )
 
 
 async def __upload_images(
@@ -214,6 +230,7 @@ async def product_creation(
         clip_model,
         prod_info.description,
         main_image,
+        prod_info.product_type,
         ss,
     )
 
@@ -1,21 +1,31 @@
-from io import BytesIO
-from typing import Any
-from PIL import Image, ImageFile
+import asyncio
+from typing import Any, Mapping
 from sqlalchemy.ext.asyncio import AsyncSession
 from db.postgresql.models.blog import Blog, BlogEmbedding
-from db.postgresql.models.product import Product, ProductEmbedding, ProductType
-from ai import clip, yolo
+from db.postgresql.models.product import (
+    Product,
+    ProductEmbedding,
+    ProductNeighbor,
+    ProductType,
+)
+from ai import clip, embed_cache, yolo
 import sqlalchemy as sqla
-from db.postgresql.paging import Page, display_page, paging
+from config import env
+from db.postgresql.paging import Page, display_page
+from etc import search_session
+from dtos.request.search import BatchQuery
+from services.search_backend import (
+    HybridWeights,
+    Leg,
+    RankQuery,
+    backend,
+    rank_hybrid,
+    yolo_category,
+)
 from etc.local_error import HandledError
 
 
-def read_image(file: bytes) -> ImageFile.ImageFile:
-    return Image.open(BytesIO(file))
-
-
-async def __prod_dto(r) -> dict[str, Any]:
-    product: Product = await r[0].awaitable_attrs.product
+def __prod_dto(product: Product, scores: dict[str, float]) -> dict[str, Any]:
     return {
         "id": product.id,
         "product_name": product.product_name,
@@ -25,179 +35,439 @@ async def __prod_dto(r) -> dict[str, Any]:
         "image_url": product.image_url,
         "price": product.price,
         "sale_percent": product.sale_percent,
-        "dist_1": r[1],
-        "dist_2": r[2],
+        **scores,
     }
 
 
+async def __load_products(ss: AsyncSession, ids: list[str]) -> dict[str, Product]:
+    if not ids:
+        return {}
+    return {
+        p.id: p
+        for p in await ss.scalars(sqla.select(Product).filter(Product.id.in_(ids)))
+    }
+
+
+def __product_rows(
+    products: dict[str, Product],
+    rows: list[tuple[Any, ...]],
+    fields: tuple[str, ...] = ("dist_1", "dist_2"),
+) -> list[dict[str, Any]]:
+    return [
+        __prod_dto(products[id], dict(zip(fields, scores)))
+        for id, *scores in rows
+        if id in products
+    ]
+
+
+async def __hydrate_products(
+    ss: AsyncSession,
+    rows: list[tuple[Any, ...]],
+    fields: tuple[str, ...] = ("dist_1", "dist_2"),
+) -> list[dict[str, Any]]:
+    products = await __load_products(ss, [r[0] for r in rows])
+    return __product_rows(products, rows, fields)
+
+
+async def __load_blogs(ss: AsyncSession, ids: list[str]) -> dict[str, Any]:
+    if not ids:
+        return {}
+    return {
+        b.id: b
+        for b in (
+            await ss.execute(
+                sqla.select(
+                    Blog.id,
+                    Blog.title,
+                    Blog.description,
+                    Blog.thumbnail,
+                ).filter(Blog.id.in_(ids))
+            )
+        ).all()
+    }
+
+
+def __blog_rows(
+    blogs: dict[str, Any],
+    rows: list[tuple[Any, ...]],
+) -> list[dict[str, Any]]:
+    return [
+        {
+            "id": id,
+            "title": blogs[id].title,
+            "description": blogs[id].description,
+            "thumbnail": blogs[id].thumbnail,
+            "dist_text": dist_text,
+        }
+        for id, dist_text in rows
+        if id in blogs
+    ]
+
+
+async def __hydrate_blogs(
+    ss: AsyncSession,
+    rows: list[tuple[Any, ...]],
+) -> list[dict[str, Any]]:
+    return __blog_rows(await __load_blogs(ss, [r[0] for r in rows]), rows)
+
+
+def __search_page(content, rows, pg: Page, token: str | None) -> dict[str, Any]:
+    # rows is the whole ranked list up to SEARCH_CANDIDATE_LIMIT, computed by
+    # one statement, so its length is the total without a count scan or a
+    # count(*) OVER () column
+    page = display_page(content, len(rows), pg)
+    page["search_token"] = token
+    return page
+
+
 async def vector_search_prompt(
     prompt: str,
-    clip_model: clip.OpenCLIP,
+    models: Mapping[str, Any],
     type: ProductType | None,
     pg: Page,
     ss: AsyncSession,
     text_dist: float = 0.5,
     img_dist: float = 0.8,
+    search_token: str | None = None,
 ):
-    if type:
-        filters = [ProductEmbedding.id.like(f"{type}%")]
-    else:
-        filters = []
+    k = env.SEARCH_CANDIDATE_LIMIT
+
+    query = (
+        "prompt",
+        embed_cache.normalize_prompt(prompt),
+        type,
+        text_dist,
+        img_dist,
+    )
+    cached = search_session.load(search_token, query)
+
     async with ss.begin():
-        prompt_vec = clip_model.encode_text(prompt)[0]
-        dist_text = ProductEmbedding.description_embed.l2_distance(prompt_vec)
-        dist_img = ProductEmbedding.images_embed_clip.l2_distance(prompt_vec)
-        results = await ss.execute(
-            paging(
-                sqla.select(
-                    ProductEmbedding,
-                    dist_text,
-                    dist_img,
-                )
-                .filter(
-                    (dist_img < img_dist) | (dist_text < text_dist),
-                    *filters,
-                )
-                .order_by(dist_text, dist_img)
-                .limit(70),
-                pg,
-            )
-        )
+        if cached:
+            rows, token = cached.rows, search_token
+        else:
+            # models are looked up only here, a token page is served while
+            # they still load
+            prompt_vec = await embed_cache.encode_prompt(models["clip"], prompt)
 
-        count = (
-            await ss.scalar(
-                sqla.select(sqla.func.count(ProductEmbedding.id))
-                .filter(
-                    (dist_img < img_dist) | (dist_text < text_dist),
-                    *filters,
-                )
-                .limit(70),
+            # the whole ranked id list is small, its length is the total and
+            # every later page is a slice of it
+            rows = await backend.rank(
+                ss,
+                ProductEmbedding,
+                [
+                    Leg("description_embed", prompt_vec, text_dist),
+                    Leg("images_embed_clip", prompt_vec, img_dist),
+                ],
+                [0, 1],
+                k,
+                type,
             )
-            or 0
-        )
+            token = search_session.save(query, rows)
 
-        content = []
+        content = await __hydrate_products(ss, search_session.page_rows(rows, pg))
 
-        for r in results.all():
-            content.append(await __prod_dto(r))
+    return __search_page(content, rows, pg, token)
 
-    return display_page(content, count, pg)
+
+async def hybrid_search_prompt(
+    prompt: str,
+    models: Mapping[str, Any],
+    type: ProductType | None,
+    pg: Page,
+    ss: AsyncSession,
+    weights: HybridWeights,
+    search_token: str | None = None,
+):
+    if any(w < 0 for w in weights) or not any(w > 0 for w in weights):
+        raise HandledError("Search weights must be positive")
+
+    k = env.SEARCH_CANDIDATE_LIMIT
+
+    query = ("hybrid", embed_cache.normalize_prompt(prompt), type, *weights)
+    cached = search_session.load(search_token, query)
+
+    async with ss.begin():
+        if cached:
+            rows, token = cached.rows, search_token
+        else:
+            prompt_vec = await embed_cache.encode_prompt(models["clip"], prompt)
+
+            rows = await rank_hybrid(
+                ss,
+                prompt,
+                prompt_vec,
+                weights,
+                k,
+                type,
+            )
+            token = search_session.save(query, rows)
+
+        content = await __hydrate_products(
+            ss, search_session.page_rows(rows, pg), ("score",)
+        )
+
+    return __search_page(content, rows, pg, token)
 
 
 async def vector_search_image_yolo(
-    image_bytes: bytes,
-    yolo_: yolo.YOLOEmbed,
-    clip_model: clip.OpenCLIP,
+    image_bytes: bytes | None,
+    models: Mapping[str, Any],
     type: ProductType | None,
     pg: Page,
     ss: AsyncSession,
     yolo_dist: float = 1.4,
     clip_dist: float = 0.5,
+    search_token: str | None = None,
 ):
-    image = [read_image(image_bytes)]
-    yp = yolo_.predict(image)[0].summary()[0]
-    prompt_vec = yolo_.embed(image)[0]
-    clip_vec = clip_model.encode_image(image)[0]
-
-    if type:
-        filters = [ProductEmbedding.id.like(f"{type}%")]
-    else:
-        filters = []
-
-    predict_result = {
-        "name": yp["name"],
-        "confidence": f"{yp['confidence'] * 100:2.2f}",
-    }
+    k = env.SEARCH_CANDIDATE_LIMIT
 
-    async with ss.begin():
-        dist_img_yolo = ProductEmbedding.images_embed_yolo.l2_distance(prompt_vec)
-        dist_img_clip = ProductEmbedding.images_embed_clip.l2_distance(clip_vec)
-        results = await ss.execute(
-            paging(
-                sqla.select(
-                    ProductEmbedding,
-                    dist_img_yolo,
-                    dist_img_clip,
-                )
-                .filter(
-                    (dist_img_yolo < yolo_dist) | (dist_img_clip < clip_dist),
-                    *filters,
-                )
-                .order_by(dist_img_clip, dist_img_yolo)
-                .limit(70),
-                pg,
-            )
-        )
+    query = ("image", type, yolo_dist, clip_dist)
+    cached = search_session.load(search_token, query)
+    image_key = await embed_cache.hash_image(image_bytes) if image_bytes else None
+
+    # a token sent along with a different photo starts a new search
+    if cached and image_key and cached.extra["image_key"] != image_key:
+        cached = None
 
-        content: list[dict[str, str | float]] = []
+    if not cached and not image_bytes:
+        raise HandledError("Search token is expired, please upload the image again")
 
-        for r in results.all():
-            content.append(await __prod_dto(r))
+    async with ss.begin():
+        if cached:
+            rows, token = cached.rows, search_token
+            predict_result = cached.extra["predict"]
+        else:
+            embedded = await embed_cache.encode_search_image(
+                image_bytes,  # type: ignore
+                models["yolo"],
+                models["clip"],
+                image_key,
+            )
+            yp = embedded.yolo_classes[0]
+            legs = [
+                Leg("images_embed_yolo", embedded.yolo_vec, yolo_dist),
+                Leg("images_embed_clip", embedded.clip_vec, clip_dist),
+            ]
 
-        count = (
-            await ss.scalar(
-                sqla.select(sqla.func.count(ProductEmbedding.id))
-                .filter(
-                    (dist_img_yolo < yolo_dist) | (dist_img_clip < clip_dist),
-                    *filters,
+            # a confident prediction narrows the search to its category, an
+            # empty result there still falls back to the whole catalog
+            category = None if type else yolo_category(embedded.yolo_classes)
+            rows = []
+            if category:
+                rows = await backend.rank(
+                    ss, ProductEmbedding, legs, [1, 0], k, category
                 )
-                .limit(70),
+            if not rows:
+                category = None
+                rows = await backend.rank(ss, ProductEmbedding, legs, [1, 0], k, type)
+
+            predict_result = {
+                "name": yp["name"],
+                "confidence": f"{yp['confidence'] * 100:2.2f}",
+                "category": category,
+            }
+            token = search_session.save(
+                query,
+                rows,
+                {"predict": predict_result, "image_key": image_key},
             )
-            or 0
-        )
 
-    page_content = display_page(content, count, pg)
+        content = await __hydrate_products(ss, search_session.page_rows(rows, pg))
+
+    page_content = __search_page(content, rows, pg, token)
 
     return {"predict": predict_result, "page": page_content}
 
 
 async def vector_search_blog(
     prompt: str,
-    clip_model: clip.OpenCLIP,
+    models: Mapping[str, Any],
     pg: Page,
     ss: AsyncSession,
     text_dist: float = 0.5,
+    search_token: str | None = None,
 ):
+    k = env.SEARCH_CANDIDATE_LIMIT
+
+    query = ("blog", embed_cache.normalize_prompt(prompt), text_dist)
+    cached = search_session.load(search_token, query)
+
     async with ss.begin():
-        prompt_vec = clip_model.encode_text(prompt)[0]
-        dist_text = BlogEmbedding.description_embed.l2_distance(prompt_vec)
-        results = await ss.execute(
-            paging(
-                sqla.select(
-                    BlogEmbedding,
-                    Blog.id,
-                    Blog.title,
-                    Blog.description,
-                    Blog.thumbnail,
-                    dist_text,
-                )
-                .filter(
-                    (dist_text < text_dist),
-                )
-                .order_by(dist_text)
-                .join(Blog, Blog.id == BlogEmbedding.id),
-                pg,
+        if cached:
+            rows, token = cached.rows, search_token
+        else:
+            prompt_vec = await embed_cache.encode_prompt(models["clip"], prompt)
+
+            rows = await backend.rank(
+                ss,
+                BlogEmbedding,
+                [Leg("description_embed", prompt_vec, text_dist)],
+                [0],
+                k,
             )
+            token = search_session.save(query, rows)
+
+        content = await __hydrate_blogs(ss, search_session.page_rows(rows, pg))
+
+    return __search_page(content, rows, pg, token)
+
+
+def __check_batch(queries: list[BatchQuery], images: list[bytes]):
+    if len(queries) > env.SEARCH_BATCH_LIMIT:
+        raise HandledError(f"At most {env.SEARCH_BATCH_LIMIT} queries per batch")
+    if len({q.key for q in queries}) != len(queries):
+        raise HandledError("Query keys must be unique")
+
+    for q in queries:
+        if (q.prompt is None) == (q.image is None):
+            raise HandledError(f"Query {q.key} needs either a prompt or an image")
+        if q.target == "blog" and q.prompt is None:
+            raise HandledError(f"Query {q.key} is a blog search without prompt")
+        if q.image is not None and not 0 <= q.image < len(images):
+            raise HandledError(f"Query {q.key} refers to a missing image")
+
+
+def __batch_rank_query(q: BatchQuery, embedded) -> RankQuery:
+    if q.target == "blog":
+        return RankQuery([Leg("description_embed", embedded, q.text_dist)], [0])
+    if q.image is None:
+        return RankQuery(
+            [
+                Leg("description_embed", embedded, q.text_dist),
+                Leg("images_embed_clip", embedded, q.img_dist),
+            ],
+            [0, 1],
+            q.type,
         )
+    return RankQuery(
+        [
+            Leg("images_embed_yolo", embedded.yolo_vec, q.yolo_dist),
+            Leg("images_embed_clip", embedded.clip_vec, q.clip_dist),
+        ],
+        [1, 0],
+        q.type or yolo_category(embedded.yolo_classes),
+    )
+
+
+async def __batch_rank(ss: AsyncSession, model, queries: dict[int, RankQuery]):
+    k = env.SEARCH_CANDIDATE_LIMIT
+    ranked = await backend.rank_many(ss, model, list(queries.values()), k)
+    return dict(zip(queries, ranked))
+
+
+async def batch_search(
+    queries: list[BatchQuery],
+    images: list[bytes],
+    yolo_: yolo.YOLOEmbed,
+    clip_model: clip.OpenCLIP,
+    pg: Page,
+    ss: AsyncSession,
+):
+    __check_batch(queries, images)
+
+    image_keys = await asyncio.gather(*[embed_cache.hash_image(i) for i in images])
 
-        count = (
-            await ss.scalar(
-                sqla.select(sqla.func.count(BlogEmbedding.id)).filter(
-                    (dist_text < text_dist),
+    # submitted together, the prompts and the photos each reach CLIP as one
+    # micro-batch
+    embedded = await asyncio.gather(
+        *[
+            (
+                embed_cache.encode_prompt(clip_model, q.prompt)
+                if q.prompt is not None
+                else embed_cache.encode_search_image(
+                    images[q.image],  # type: ignore
+                    yolo_,
+                    clip_model,
+                    image_keys[q.image],  # type: ignore
                 )
             )
-            or 0
+            for q in queries
+        ]
+    )
+    rank_queries = [__batch_rank_query(q, e) for q, e in zip(queries, embedded)]
+
+    async with ss.begin():
+        # one statement per table for the whole batch
+        rows = await __batch_rank(
+            ss,
+            ProductEmbedding,
+            {i: r for i, r in enumerate(rank_queries) if queries[i].target != "blog"},
         )
+        rows |= await __batch_rank(
+            ss,
+            BlogEmbedding,
+            {i: r for i, r in enumerate(rank_queries) if queries[i].target == "blog"},
+        )
+
+        # a routed photo search that found nothing in its category reruns
+        # over the whole catalog
+        rerun = {
+            i: r._replace(product_type=None)
+            for i, r in enumerate(rank_queries)
+            if queries[i].image is not None
+            and r.product_type != queries[i].type
+            and not rows[i]
+        }
+        rows |= await __batch_rank(ss, ProductEmbedding, rerun)
+
+        pages = {i: search_session.page_rows(r, pg) for i, r in rows.items()}
+        ids = {"product": set(), "blog": set()}
+        for i, page in pages.items():
+            ids[queries[i].target].update(row[0] for row in page)
+        products = await __load_products(ss, list(ids["product"]))
+        blogs = await __load_blogs(ss, list(ids["blog"]))
 
-        content = []
+    # tokens are saved under the single search keys, later pages come from the
+    # /search endpoints with the same parameters
+    results: dict[str, Any] = {}
+    for i, q in enumerate(queries):
+        if q.target == "blog":
+            query = ("blog", embed_cache.normalize_prompt(q.prompt), q.text_dist)
+            token = search_session.save(query, rows[i])
+            content = __blog_rows(blogs, pages[i])
+            results[q.key] = __search_page(content, rows[i], pg, token)
+        elif q.image is None:
+            query = (
+                "prompt",
+                embed_cache.normalize_prompt(q.prompt),  # type: ignore
+                q.type,
+                q.text_dist,
+                q.img_dist,
+            )
+            token = search_session.save(query, rows[i])
+            content = __product_rows(products, pages[i])
+            results[q.key] = __search_page(content, rows[i], pg, token)
+        else:
+            yp = embedded[i].yolo_classes[0]
+            routed = q.type is None and i not in rerun
+            predict_result = {
+                "name": yp["name"],
+                "confidence": f"{yp['confidence'] * 100:2.2f}",
+                "category": rank_queries[i].product_type if routed else None,
+            }
+            query = ("image", q.type, q.yolo_dist, q.clip_dist)
+            token = search_session.save(
+                query,
+                rows[i],
+                {"predict": predict_result, "image_key": image_keys[q.image]},
+            )
+            content = __product_rows(products, pages[i])
+            results[q.key] = {
+                "predict": predict_result,
+                "page": __search_page(content, rows[i], pg, token),
+            }
+
+    return results
+
+
+async def similar_products(prod_id: str, ss: AsyncSession):
+    # two primary key lookups, the lists are kept by services.similar_product
+    async with ss.begin():
+        row = await ss.get(ProductNeighbor, prod_id)
+        if row is None:
+            return []
 
-        for r in results.all():
-            content.append({
-                "id": r[1],
-                "title": r[2],
-                "description": r[3],
-                "thumbnail": r[4],
-                "dist_text": r[5],
-            })
+        rows = list(zip(row.neighbors, row.distances))
+        products = await __load_products(ss, row.neighbors)
 
-    return display_page(content, count, pg)
+    return __product_rows(products, rows, ("distance",))
@@ -0,0 +1,574 @@
+import asyncio
+import fcntl
+import logging
+import os
+import time
+from typing import Any, NamedTuple
+
+import numpy as np
+import sqlalchemy as sqla
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import env
+from db.postgresql import DBSession, embedding_version, text_index, vector_index
+from db.postgresql.models.blog import BlogEmbedding, ProductDoc
+from db.postgresql.models.product import Product, ProductEmbedding, ProductType
+
+logger = logging.getLogger("uvicorn.info")
+
+VECTOR_TABLES = {
+    ProductEmbedding.__tablename__: (
+        ProductEmbedding,
+        ["images_embed_yolo", "images_embed_clip", "description_embed"],
+    ),
+    BlogEmbedding.__tablename__: (
+        BlogEmbedding,
+        ["description_embed"],
+    ),
+}
+
+
+class Leg(NamedTuple):
+    column: str
+    vec: Any
+    max_dist: float
+
+
+class RankQuery(NamedTuple):
+    legs: list[Leg]
+    order: list[int]
+    product_type: ProductType | None = None
+
+
+class PgVectorBackend:
+    def __distance(self, model, leg: Leg):
+        column = getattr(model, leg.column)
+        # typed query parameter, the operator and the index it can use follow
+        # the column's storage type (vector or halfvec)
+        return column.l2_distance(sqla.cast(leg.vec, column.type))
+
+    def __nearest(self, model, dist, filters: list, k: int):
+        # plain ORDER BY distance LIMIT k so the planner can use the ANN index
+        return (
+            sqla.select(model.id.label("id"))
+            .filter(*filters)
+            .order_by(dist)
+            .limit(k)
+        )
+
+    def __ranked(self, model, query: RankQuery, k: int, i: int):
+        filters = (
+            [vector_index.type_filter(model, query.product_type)]
+            if query.product_type
+            else []
+        )
+        dists = [self.__distance(model, leg) for leg in query.legs]
+        ordering = [dists[j] for j in query.order]
+
+        nearest = [self.__nearest(model, d, filters, k) for d in dists]
+        candidates = (
+            sqla.union(*nearest) if len(nearest) > 1 else nearest[0]
+        ).subquery()
+
+        return (
+            sqla.select(
+                sqla.literal_column(str(i), sqla.Integer).label("query"),
+                sqla.func.row_number().over(order_by=ordering).label("pos"),
+                model.id,
+                *dists,
+            )
+            .filter(
+                model.id.in_(sqla.select(candidates.c.id)),
+                sqla.or_(*[d < leg.max_dist for d, leg in zip(dists, query.legs)]),
+            )
+            .order_by(*ordering)
+            .limit(k)
+        )
+
+    async def rank_many(
+        self,
+        ss: AsyncSession,
+        model,
+        queries: list[RankQuery],
+        k: int,
+    ) -> list[list[tuple[Any, ...]]]:
+        # one statement for the whole batch, the queries must have the same
+        # number of legs to line up in the UNION ALL
+        if not queries:
+            return []
+        if len({len(q.legs) for q in queries}) > 1:
+            raise Exception("Batched queries need the same number of legs")
+
+        model = embedding_version.entity(model)
+        await vector_index.apply_search_params(
+            ss, k, any(q.product_type for q in queries)
+        )
+
+        ranked = [self.__ranked(model, q, k, i) for i, q in enumerate(queries)]
+        rows = await ss.execute(
+            sqla.union_all(*ranked) if len(ranked) > 1 else ranked[0]
+        )
+
+        results: list[list[tuple[Any, ...]]] = [[] for _ in queries]
+        for i, _, *row in sorted(rows.all(), key=lambda r: (r[0], r[1])):
+            results[i].append(tuple(row))
+        return results
+
+    async def rank(
+        self,
+        ss: AsyncSession,
+        model,
+        legs: list[Leg],
+        order: list[int],
+        k: int,
+        product_type: ProductType | None = None,
+    ) -> list[tuple[Any, ...]]:
+        query = RankQuery(legs, order, product_type)
+        return (await self.rank_many(ss, model, [query], k))[0]
+
+    def upsert(self, model, id: str, vectors: dict[str, Any]):
+        pass
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+class VectorSnapshot:
+    # base rows are memory-mapped from .npy files so workers share the pages,
+    # writes after the snapshot go to a small in-process overlay
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        columns: dict[str, np.ndarray],
+        types: np.ndarray | None = None,
+    ) -> None:
+        self.ids = ids
+        self.pos = {id: i for i, id in enumerate(ids.tolist())}
+        self.columns = columns
+        self.sq_norms = {
+            c: np.einsum("ij,ij->i", m, m, dtype=np.float32) for c, m in columns.items()
+        }
+        # product type names, "" for unknown
+        self.types = types if types is not None else np.full(len(ids), "")
+        self.dead = np.zeros(len(ids), dtype=bool)
+        self.delta: dict[str, dict[str, np.ndarray]] = {}
+        self.delta_types: dict[str, str] = {}
+        self.type_masks: dict[str, np.ndarray] = {}
+
+    def __mask(self, product_type: ProductType | None) -> np.ndarray:
+        if not product_type:
+            return ~self.dead
+        if product_type.name not in self.type_masks:
+            self.type_masks[product_type.name] = self.types == product_type.name
+        return self.type_masks[product_type.name] & ~self.dead
+
+    def product_type(self, id: str) -> str:
+        if id in self.delta_types:
+            return self.delta_types[id]
+        return str(self.types[self.pos[id]]) if id in self.pos else ""
+
+    def vector(self, id: str, column: str) -> np.ndarray | None:
+        if id in self.delta:
+            return self.delta[id].get(column)
+        if id in self.pos and not self.dead[self.pos[id]]:
+            return np.asarray(self.columns[column][self.pos[id]])
+        return None
+
+    def nearest(
+        self,
+        column: str,
+        vec: np.ndarray,
+        k: int,
+        product_type: ProductType | None = None,
+    ) -> list[tuple[str, float]]:
+        matrix = self.columns[column]
+        q = np.asarray(vec, dtype=np.float32)
+
+        # |x - q|^2 = |x|^2 + |q|^2 - 2 x.q, one matrix-vector product
+        sq = self.sq_norms[column] + q @ q - 2 * (matrix @ q)
+        sq[~self.__mask(product_type)] = np.inf
+
+        if k < len(sq):
+            top = np.argpartition(sq, k)[:k]
+        else:
+            top = np.arange(len(sq))
+
+        found = [
+            (str(self.ids[i]), float(np.sqrt(max(sq[i], 0.0))))
+            for i in top
+            if np.isfinite(sq[i])
+        ]
+
+        for id, vectors in self.delta.items():
+            if product_type and self.product_type(id) != product_type.name:
+                continue
+            if vectors.get(column) is None:
+                continue
+            found.append((id, float(np.linalg.norm(vectors[column] - q))))
+
+        found.sort(key=lambda r: r[1])
+        return found[:k]
+
+    def upsert(self, id: str, vectors: dict[str, Any]):
+        if id not in self.delta:
+            self.delta[id] = {
+                c: self.vector(id, c) for c in self.columns  # type: ignore
+            }
+            self.delta_types[id] = self.product_type(id)
+            if id in self.pos:
+                self.dead[self.pos[id]] = True
+
+        for column, vec in vectors.items():
+            if column == "product_type":
+                self.delta_types[id] = vec.name
+            else:
+                self.delta[id][column] = np.asarray(vec, dtype=np.float32)
+
+
+class NumpyBackend:
+    def __init__(self, snapshot_dir: str, session_maker=DBSession) -> None:
+        self.snapshot_dir = snapshot_dir
+        self.session_maker = session_maker
+        self.snapshots: dict[str, VectorSnapshot] = {}
+        # writes that land while a table is being rebuilt, replayed after load
+        self.building: dict[str, dict[str, dict[str, Any]]] = {}
+        # mtime of the files each snapshot was loaded from
+        self.loaded: dict[str, float | None] = {}
+        # serve from postgres until the snapshot is loaded
+        self.fallback = PgVectorBackend()
+        self.refresher: asyncio.Task | None = None
+
+    def __path(self, table: str, name: str) -> str:
+        # per version, a new version must not load the old snapshot
+        model, _ = VECTOR_TABLES[table]
+        table = embedding_version.table(model).name
+        return os.path.join(self.snapshot_dir, f"{table}.{name}.npy")
+
+    async def build(self, table: str):
+        model, columns = VECTOR_TABLES[table]
+        model = embedding_version.entity(model)
+
+        async with self.session_maker() as ss, ss.begin():
+            rows = (
+                await ss.execute(
+                    sqla.select(
+                        model.id,
+                        *[getattr(model, c) for c in columns],
+                    ).order_by(model.id)
+                )
+            ).all()
+
+        types = None
+        if table in vector_index.FILTER_TABLES:
+            async with self.session_maker() as ss, ss.begin():
+                types = dict(
+                    (await ss.execute(sqla.select(model.id, model.product_type))).all()
+                )
+
+        # stacking and saving a whole table, off the event loop
+        await asyncio.to_thread(self.__write, table, rows, types)
+        logger.info(f"Built vector snapshot of {table}: {len(rows)} rows")
+
+    def __write(self, table: str, rows, types: dict[str, Any] | None):
+        model, columns = VECTOR_TABLES[table]
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+
+        arrays = {"ids": np.array([r[0] for r in rows], dtype=str)}
+        if types is not None:
+            arrays["product_type"] = np.array(
+                [types[r[0]].name if types.get(r[0]) else "" for r in rows], dtype=str
+            )
+        for i, column in enumerate(columns):
+            dim = getattr(model, column).type.dim
+            arrays[column] = (
+                np.stack([np.asarray(r[i + 1], dtype=np.float32) for r in rows])
+                if rows
+                else np.zeros((0, dim), dtype=np.float32)
+            )
+
+        for name, array in arrays.items():
+            # write then rename, other workers may be mapping the old file
+            tmp = self.__path(table, name) + f".{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp, self.__path(table, name))
+
+    def load(self, table: str):
+        _, columns = VECTOR_TABLES[table]
+        self.snapshots[table] = VectorSnapshot(
+            np.load(self.__path(table, "ids")),
+            {c: np.load(self.__path(table, c), mmap_mode="r") for c in columns},
+            (
+                np.load(self.__path(table, "product_type"))
+                if table in vector_index.FILTER_TABLES
+                else None
+            ),
+        )
+
+    def __mtime(self, table: str) -> float | None:
+        path = self.__path(table, "ids")
+        return os.path.getmtime(path) if os.path.exists(path) else None
+
+    def __is_stale(self, table: str) -> bool:
+        mtime = self.__mtime(table)
+        if mtime is None:
+            return True
+        return time.time() - mtime > env.VECTOR_SNAPSHOT_REFRESH
+
+    async def __lock(self, table: str, wait: bool):
+        # one worker rebuilds a table, the others load its files
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        lock = open(self.__path(table, "lock"), "w")
+        flags = fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            await asyncio.to_thread(fcntl.flock, lock, flags)
+        except BlockingIOError:
+            lock.close()
+            return None
+        return lock
+
+    async def __rebuild(self, table: str, force: bool):
+        # with no file yet, wait for the worker that is building it
+        lock = await self.__lock(table, wait=self.__mtime(table) is None)
+        if lock is None:
+            return
+
+        try:
+            # another worker may have rebuilt it while this one waited
+            if force or self.__is_stale(table):
+                await self.build(table)
+        finally:
+            lock.close()
+
+    async def refresh(self, force: bool = False):
+        for table in VECTOR_TABLES:
+            # writes during the rebuild and the threaded load are replayed
+            written: dict[str, dict[str, Any]] = {}
+            self.building[table] = written
+            try:
+                if force or self.__is_stale(table):
+                    await self.__rebuild(table, force)
+
+                # the loaded snapshot keeps its overlay until the files change
+                mtime = self.__mtime(table)
+                if table in self.snapshots and self.loaded.get(table) == mtime:
+                    continue
+
+                await asyncio.to_thread(self.load, table)
+                self.loaded[table] = mtime
+                for id, vectors in written.items():
+                    self.snapshots[table].upsert(id, vectors)
+            finally:
+                del self.building[table]
+
+    async def __refresh_loop(self):
+        # checks twice per interval, a snapshot another worker rebuilt is
+        # picked up soon after
+        while True:
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Vector snapshot refresh failed: {e!r}")
+            await asyncio.sleep(env.VECTOR_SNAPSHOT_REFRESH / 2)
+
+    def start(self):
+        # the first build runs in the background too, ranks fall back to
+        # postgres until it is loaded. Writes from other workers only reach
+        # this one through a rebuild.
+        self.refresher = asyncio.get_running_loop().create_task(self.__refresh_loop())
+
+    def stop(self):
+        if self.refresher is not None:
+            self.refresher.cancel()
+            self.refresher = None
+
+    async def rank(
+        self,
+        ss: AsyncSession,
+        model,
+        legs: list[Leg],
+        order: list[int],
+        k: int,
+        product_type: ProductType | None = None,
+    ) -> list[tuple[Any, ...]]:
+        snapshot = self.snapshots.get(model.__tablename__)
+        if snapshot is None:
+            return await self.fallback.rank(ss, model, legs, order, k, product_type)
+
+        candidates: set[str] = set()
+        for leg in legs:
+            candidates.update(
+                id
+                for id, _ in snapshot.nearest(leg.column, leg.vec, k, product_type)
+            )
+
+        rows = []
+        for id in candidates:
+            dists = []
+            for leg in legs:
+                vec = snapshot.vector(id, leg.column)
+                q = np.asarray(leg.vec, dtype=np.float32)
+                dists.append(
+                    float(np.linalg.norm(vec - q)) if vec is not None else np.inf
+                )
+            if any(d < leg.max_dist for d, leg in zip(dists, legs)):
+                rows.append((id, *dists))
+
+        rows.sort(key=lambda r: [r[1 + i] for i in order])
+        return rows[:k]
+
+    async def rank_many(
+        self,
+        ss: AsyncSession,
+        model,
+        queries: list[RankQuery],
+        k: int,
+    ) -> list[list[tuple[Any, ...]]]:
+        if model.__tablename__ not in self.snapshots:
+            return await self.fallback.rank_many(ss, model, queries, k)
+        return [
+            await self.rank(ss, model, q.legs, q.order, k, q.product_type)
+            for q in queries
+        ]
+
+    def upsert(self, model, id: str, vectors: dict[str, Any]):
+        table = model.__tablename__
+        if table in self.building:
+            self.building[table].setdefault(id, {}).update(vectors)
+
+        snapshot = self.snapshots.get(table)
+        if snapshot is not None:
+            snapshot.upsert(id, vectors)
+
+
+class HybridWeights(NamedTuple):
+    text: float
+    image: float
+    keyword: float
+
+
+def __ranked(ids, order):
+    return sqla.select(
+        ids, sqla.func.row_number().over(order_by=order).label("rank")
+    )
+
+
+def __vector_leg(model, column: str, vec, filters: list, k: int):
+    column = getattr(model, column)
+    dist = column.l2_distance(sqla.cast(vec, column.type))
+    # ORDER BY distance LIMIT k on its own, so each leg is an index scan
+    nearest = (
+        sqla.select(model.id.label("id"), dist.label("dist"))
+        .filter(*filters)
+        .order_by(dist)
+        .limit(k)
+        .subquery()
+    )
+    return __ranked(nearest.c.id, nearest.c.dist)
+
+
+def __keyword_leg(prompt: str, product_type: ProductType | None, k: int):
+    query = text_index.tsquery(prompt)
+
+    hits = []
+    for column in (Product.product_name, ProductDoc.description):
+        model = column.class_
+        doc = text_index.tsvector(column)
+        score = sqla.func.ts_rank_cd(doc, query)
+        hit = (
+            sqla.select(model.id.label("id"), score.label("score"))
+            .filter(doc.op("@@")(query))
+            .order_by(score.desc())
+            .limit(k)
+        )
+        if product_type:
+            if model is not Product:
+                hit = hit.join(Product, Product.id == model.id)
+            hit = hit.filter(Product.product_types == product_type)
+        hits.append(hit)
+
+    union = sqla.union_all(*hits).subquery()
+    total = sqla.func.sum(union.c.score)
+    return (
+        __ranked(union.c.id, total.desc())
+        .group_by(union.c.id)
+        .order_by(total.desc())
+        .limit(k)
+    )
+
+
+async def rank_hybrid(
+    ss: AsyncSession,
+    prompt: str,
+    prompt_vec,
+    weights: HybridWeights,
+    k: int,
+    product_type: ProductType | None = None,
+) -> list[tuple[Any, ...]]:
+    # reciprocal rank fusion, sum of weight / (SEARCH_RRF_K + rank) over the
+    # legs a product shows up in. Ranks are comparable where raw L2 distances
+    # and text scores are not.
+    model = embedding_version.entity(ProductEmbedding)
+    filters = [vector_index.type_filter(model, product_type)] if product_type else []
+
+    vector_legs = {
+        "description_embed": weights.text,
+        "images_embed_clip": weights.image,
+    }
+    legs = [
+        (weight, __vector_leg(model, column, prompt_vec, filters, k))
+        for column, weight in vector_legs.items()
+        if weight > 0
+    ]
+    if weights.keyword > 0:
+        legs.append((weights.keyword, __keyword_leg(prompt, product_type, k)))
+
+    await vector_index.apply_search_params(ss, k, bool(filters))
+
+    scored = []
+    for weight, leg in legs:
+        ranked = leg.subquery()
+        score = sqla.literal(float(weight), sqla.Float) / (
+            env.SEARCH_RRF_K + ranked.c.rank
+        )
+        scored.append(sqla.select(ranked.c.id, score.label("score")))
+
+    fused = (sqla.union_all(*scored) if len(scored) > 1 else scored[0]).subquery()
+    total = sqla.func.sum(fused.c.score)
+
+    rows = await ss.execute(
+        sqla.select(fused.c.id, total)
+        .group_by(fused.c.id)
+        .order_by(total.desc(), fused.c.id)
+        .limit(k)
+    )
+    return [(id, float(score)) for id, score in rows.all()]
+
+
+def yolo_category(yolo_classes: list[dict[str, Any]]) -> ProductType | None:
+    # only the top class routes, an unsure or unmapped one searches everything
+    if not yolo_classes:
+        return None
+
+    top = yolo_classes[0]
+    if top["confidence"] < env.YOLO_CATEGORY_CONFIDENCE:
+        return None
+
+    return env.YOLO_CATEGORY_MAP.get(top["name"])
+
+
+def __create_backend():
+    match env.SEARCH_BACKEND:
+        case "pgvector":
+            return PgVectorBackend()
+        case "numpy":
+            return NumpyBackend(env.VECTOR_SNAPSHOT_DIR)
+        case _:
+            raise Exception(f"Unknow search backend:{env.SEARCH_BACKEND}")
+
+
+backend: PgVectorBackend | NumpyBackend = __create_backend()
@@ -0,0 +1,207 @@
+import logging
+from typing import Any, Iterator
+
+import numpy as np
+import sqlalchemy as sqla
+from sqlalchemy.dialects import postgresql as psql
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import env
+from db.postgresql import embedding_version
+from db.postgresql.models.product import ProductEmbedding, ProductNeighbor
+from services.search_backend import Leg, PgVectorBackend
+
+logger = logging.getLogger("uvicorn.info")
+
+# distance between two products is the sum of the L2 distances of these
+SIMILAR_COLUMNS = ["images_embed_clip", "description_embed"]
+
+WRITE_BATCH = 500
+
+
+def nearest_neighbors(
+    ids: list[str],
+    matrices: list[np.ndarray],
+    k: int,
+    chunk: int = 1024,
+) -> Iterator[tuple[str, list[str], list[float]]]:
+    n = len(ids)
+    k = min(k, n - 1)
+    if k <= 0:
+        return
+
+    sq_norms = [np.einsum("ij,ij->i", m, m) for m in matrices]
+
+    # a block of rows against the whole catalog at a time, memory stays at
+    # chunk x n
+    for start in range(0, n, chunk):
+        end = min(start + chunk, n)
+        dist = np.zeros((end - start, n), dtype=np.float32)
+        for m, sq in zip(matrices, sq_norms):
+            d2 = sq[start:end, None] + sq[None, :] - 2 * (m[start:end] @ m.T)
+            dist += np.sqrt(np.maximum(d2, 0))
+        dist[np.arange(end - start), np.arange(start, end)] = np.inf
+
+        top = np.argpartition(dist, k - 1, axis=1)[:, :k]
+        top_dist = np.take_along_axis(dist, top, axis=1)
+        order = np.argsort(top_dist, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_dist = np.take_along_axis(top_dist, order, axis=1)
+
+        for i in range(end - start):
+            yield (
+                ids[start + i],
+                [ids[j] for j in top[i]],
+                top_dist[i].tolist(),
+            )
+
+
+async def __upsert(ss: AsyncSession, values: list[dict[str, Any]]):
+    stmt = psql.insert(ProductNeighbor).values(values)
+    await ss.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[ProductNeighbor.id],
+            set_={
+                "neighbors": stmt.excluded.neighbors,
+                "distances": stmt.excluded.distances,
+                "updated_at": sqla.func.now(),
+            },
+        )
+    )
+
+
+async def rebuild(ss: AsyncSession, k: int | None = None) -> int:
+    k = k or env.SIMILAR_PRODUCT_COUNT
+    model = embedding_version.entity(ProductEmbedding)
+
+    rows = (
+        await ss.execute(
+            sqla.select(model.id, *[getattr(model, c) for c in SIMILAR_COLUMNS])
+            .filter(*[getattr(model, c).is_not(None) for c in SIMILAR_COLUMNS])
+            .order_by(model.id)
+        )
+    ).all()
+    if not rows:
+        await ss.execute(sqla.delete(ProductNeighbor))
+        return 0
+
+    ids = [r[0] for r in rows]
+    matrices = [
+        np.stack([np.asarray(r[i + 1], dtype=np.float32) for r in rows])
+        for i in range(len(SIMILAR_COLUMNS))
+    ]
+
+    values = []
+    for id, neighbors, distances in nearest_neighbors(ids, matrices, k):
+        values.append({"id": id, "neighbors": neighbors, "distances": distances})
+        if len(values) >= WRITE_BATCH:
+            await __upsert(ss, values)
+            values = []
+    if values:
+        await __upsert(ss, values)
+
+    # products without vectors anymore
+    await ss.execute(
+        sqla.delete(ProductNeighbor).filter(ProductNeighbor.id.not_in(ids))
+    )
+
+    logger.info(f"Built similar products of {len(ids)} products, k={k}")
+    return len(ids)
+
+
+async def __distances(
+    ss: AsyncSession, vectors, ids: list[str]
+) -> dict[str, float]:
+    if not ids:
+        return {}
+    model = embedding_version.entity(ProductEmbedding)
+
+    rows = await ss.execute(
+        sqla.select(model.id, *[getattr(model, c) for c in SIMILAR_COLUMNS])
+        .filter(model.id.in_(ids))
+        .filter(*[getattr(model, c).is_not(None) for c in SIMILAR_COLUMNS])
+    )
+    query = [np.asarray(v, dtype=np.float32) for v in vectors]
+    return {
+        id: float(
+            sum(
+                np.linalg.norm(np.asarray(v, dtype=np.float32) - q)
+                for v, q in zip(others, query)
+            )
+        )
+        for id, *others in rows.all()
+    }
+
+
+async def update(ss: AsyncSession, prod_id: str, k: int | None = None):
+    # runs in the transaction that wrote the vectors. The product gets a fresh
+    # list, it is merged into the lists of its new neighbours and re-ranked in
+    # the lists that already hold it. Lists it should join without being a
+    # neighbour itself wait for the next rebuild.
+    k = k or env.SIMILAR_PRODUCT_COUNT
+    model = embedding_version.entity(ProductEmbedding)
+
+    vectors = (
+        await ss.execute(
+            sqla.select(*[getattr(model, c) for c in SIMILAR_COLUMNS]).filter(
+                model.id == prod_id
+            )
+        )
+    ).one_or_none()
+    if vectors is None or any(v is None for v in vectors):
+        return
+
+    rows = await PgVectorBackend().rank(
+        ss,
+        ProductEmbedding,
+        [Leg(c, v, float("inf")) for c, v in zip(SIMILAR_COLUMNS, vectors)],
+        list(range(len(SIMILAR_COLUMNS))),
+        max(env.SEARCH_CANDIDATE_LIMIT, k + 1),
+    )
+    found = sorted(
+        ((id, sum(dists)) for id, *dists in rows if id != prod_id),
+        key=lambda r: r[1],
+    )[:k]
+    distance = dict(found)
+
+    await __upsert(
+        ss,
+        [
+            {
+                "id": prod_id,
+                "neighbors": [id for id, _ in found],
+                "distances": [d for _, d in found],
+            }
+        ],
+    )
+
+    affected = (
+        await ss.scalars(
+            sqla.select(ProductNeighbor)
+            .filter(
+                ProductNeighbor.id != prod_id,
+                sqla.or_(
+                    ProductNeighbor.neighbors.contains([prod_id]),
+                    ProductNeighbor.id.in_(list(distance)),
+                ),
+            )
+            .with_for_update()
+        )
+    ).all()
+
+    # lists that hold the product but are outside its own top k, it may
+    # still belong in theirs
+    distance.update(
+        await __distances(
+            ss, vectors, [row.id for row in affected if row.id not in distance]
+        )
+    )
+
+    for row in affected:
+        pairs = [(n, d) for n, d in zip(row.neighbors, row.distances) if n != prod_id]
+        if row.id in distance:
+            pairs.append((prod_id, distance[row.id]))
+        pairs = sorted(pairs, key=lambda p: p[1])[:k]
+
+        row.neighbors = [n for n, _ in pairs]
+        row.distances = [d for _, d in pairs]
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from ai.batching import MicroBatcher
+from etc.local_error import ServiceUnavailableError
+
+
+class FakeModel:
+    def __init__(self) -> None:
+        self.calls: list[list[str]] = []
+
+    def encode_text(self, texts: list[str]):
+        self.calls.append(list(texts))
+        return [f"vec_{t}" for t in texts]
+
+
+@pytest_asyncio.fixture()
+async def make_batcher():
+    batchers: list[MicroBatcher] = []
+
+    def make(*args, **kwargs) -> MicroBatcher:
+        batchers.append(MicroBatcher(*args, **kwargs))
+        return batchers[-1]
+
+    yield make
+
+    for batcher in batchers:
+        batcher.stop()
+    # let the cancelled workers finish before the loop closes
+    await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_batch(make_batcher):
+    model = FakeModel()
+    batcher = make_batcher(model.encode_text, max_batch_size=8, max_wait_ms=20)
+
+    results = await asyncio.gather(*[batcher.submit(t) for t in ["a", "b", "c"]])
+
+    assert results == ["vec_a", "vec_b", "vec_c"]
+    assert model.calls == [["a", "b", "c"]]
+    assert batcher.metrics.to_dict()["batch_fill_ratio"] == 3 / 8
+
+
+@pytest.mark.asyncio
+async def test_batch_is_split_at_max_size(make_batcher):
+    model = FakeModel()
+    batcher = make_batcher(model.encode_text, max_batch_size=2, max_wait_ms=20)
+
+    results = await asyncio.gather(*[batcher.submit(t) for t in "abcde"])
+
+    assert results == [f"vec_{t}" for t in "abcde"]
+    assert [len(c) for c in model.calls] == [2, 2, 1]
+
+
+@pytest.mark.asyncio
+async def test_error_is_propagated_to_every_caller(make_batcher):
+    def broken(_):
+        raise ValueError("boom")
+
+    batcher = make_batcher(broken, max_batch_size=4, max_wait_ms=1)
+
+    results = await asyncio.gather(
+        batcher.submit("a"),
+        batcher.submit("b"),
+        return_exceptions=True,
+    )
+
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+@pytest.mark.asyncio
+async def test_row_count_mismatch_fails_instead_of_hanging(make_batcher):
+    batcher = make_batcher(lambda _: ["only_one"], max_batch_size=4, max_wait_ms=1)
+
+    results = await asyncio.gather(
+        batcher.submit("a"),
+        batcher.submit("b"),
+        return_exceptions=True,
+    )
+
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+@pytest.mark.asyncio
+async def test_stop_fails_queued_and_running_items(make_batcher):
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def slow(items):
+        started.set()
+        await release.wait()
+        return items
+
+    batcher = make_batcher(None, max_batch_size=1, max_wait_ms=1)
+    batcher._run = slow
+    running = asyncio.ensure_future(batcher.submit("a"))
+    await started.wait()
+    queued = asyncio.ensure_future(batcher.submit("b"))
+    await asyncio.sleep(0)
+
+    batcher.stop()
+
+    for fut in [queued, running]:
+        with pytest.raises(ServiceUnavailableError):
+            await fut
+    assert batcher.worker is None
@@ -0,0 +1,127 @@
+import asyncio
+import time
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from ai import embed_cache
+from ai.embed_cache import EmbeddingCache, image_key, normalize_prompt
+
+
+def test_normalize_prompt():
+    assert normalize_prompt("  Beef   SALAD ") == "beef salad"
+
+
+def test_lru_eviction():
+    cache = EmbeddingCache(max_entries=2, ttl_seconds=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_expiry(monkeypatch):
+    cache = EmbeddingCache(max_entries=2, ttl_seconds=10)
+    cache.put("a", 1)
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 11)
+
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_compute_once():
+    cache = EmbeddingCache(max_entries=8, ttl_seconds=60)
+    calls = 0
+
+    async def compute():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "vec"
+
+    results = await asyncio.gather(
+        *[cache.get_or_compute("k", compute) for _ in range(5)]
+    )
+
+    assert results == ["vec"] * 5
+    assert calls == 1
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hits"] == 4
+
+
+
+@pytest.mark.asyncio
+async def test_cancelled_owner_does_not_fail_waiters():
+    cache = EmbeddingCache(max_entries=8, ttl_seconds=60)
+    release = asyncio.Event()
+
+    async def compute():
+        await release.wait()
+        return "vec"
+
+    owner = asyncio.ensure_future(cache.get_or_compute("k", compute))
+    await asyncio.sleep(0)
+    waiter = asyncio.ensure_future(cache.get_or_compute("k", compute))
+    await asyncio.sleep(0)
+
+    owner.cancel()
+    release.set()
+
+    assert await waiter == "vec"
+    with pytest.raises(asyncio.CancelledError):
+        await owner
+    # the computation still finished and filled the cache
+    assert cache.get("k") == "vec"
+    assert not cache.in_flight
+
+def test_size_aware_eviction():
+    cache = EmbeddingCache(
+        max_entries=10,
+        ttl_seconds=60,
+        max_bytes=100,
+        sizeof=len,
+    )
+    cache.put("a", "x" * 40)
+    cache.put("b", "x" * 40)
+    cache.put("c", "x" * 40)
+
+    assert cache.get("a") is None
+    assert cache.stats()["bytes"] == 80
+
+    cache.put("huge", "x" * 101)
+    assert cache.get("huge") is None
+    assert cache.stats()["size"] == 2
+
+
+def photo(colour: tuple[int, int, int], format: str = "PNG", **save) -> bytes:
+    image = Image.new("RGB", (256, 256), (128, 128, 128))
+    image.paste(colour, (64, 64, 192, 192))
+    buf = BytesIO()
+    image.save(buf, format=format, **save)
+    return buf.getvalue()
+
+
+def test_image_key_defaults_to_bytes(monkeypatch):
+    monkeypatch.setattr(embed_cache.env, "IMAGE_EMBED_CACHE_PIXEL_HASH", False)
+
+    assert image_key(photo((200, 40, 40))) == image_key(photo((200, 40, 40)))
+    assert image_key(photo((200, 40, 40))) != image_key(photo((40, 40, 200)))
+
+
+def test_pixel_key_keeps_colour(monkeypatch):
+    monkeypatch.setattr(embed_cache.env, "IMAGE_EMBED_CACHE_PIXEL_HASH", True)
+
+    # same layout and grayscale brightness, different colour
+    assert image_key(photo((200, 40, 40))) != image_key(photo((40, 100, 151)))
+    # same photo saved in another format
+    assert image_key(photo((200, 40, 40))) == image_key(
+        photo((200, 40, 40), "JPEG", quality=100)
+    )
@@ -0,0 +1,40 @@
+import asyncio
+import threading
+
+import pytest
+
+from ai.executor import InferenceExecutor
+from etc.local_error import ServiceUnavailableError
+
+
+@pytest.mark.asyncio
+async def test_run_returns_result_off_loop():
+    executor = InferenceExecutor(max_workers=1, max_queue=1, retry_after=3)
+
+    result = await executor.run(lambda: threading.current_thread().name)
+
+    assert result.startswith("inference")
+    assert executor.stats()["in_flight"] == 0
+    assert executor.stats()["queue_depth"] == 0
+
+
+@pytest.mark.asyncio
+async def test_full_queue_fails_fast():
+    executor = InferenceExecutor(max_workers=1, max_queue=1, retry_after=3)
+    release = threading.Event()
+
+    running = asyncio.ensure_future(executor.run(release.wait))
+    queued = asyncio.ensure_future(executor.run(release.wait))
+    await asyncio.sleep(0.05)
+
+    stats = executor.stats()
+    assert stats["in_flight"] == 1
+    assert stats["queue_depth"] == 1
+
+    with pytest.raises(ServiceUnavailableError) as e:
+        await executor.run(release.wait)
+    assert e.value.retry_after == 3
+
+    release.set()
+    await asyncio.gather(running, queued)
+    assert executor.stats()["rejected"] == 1
@@ -0,0 +1,40 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from ai import image_io
+from etc.local_error import HandledError
+
+
+def encode(size: tuple[int, int], format: str) -> bytes:
+    buf = BytesIO()
+    Image.new("RGB", size, (120, 30, 200)).save(buf, format=format)
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize("format", ["JPEG", "PNG"])
+def test_load_image_decodes_reduced(format):
+    image = image_io.load_image(encode((4000, 3000), format))
+
+    assert image.mode == "RGB"
+    assert image_io.MODEL_INPUT_SIZE <= min(image.size) < 2 * image_io.MODEL_INPUT_SIZE
+    assert image.size[0] / image.size[1] == pytest.approx(4 / 3, rel=0.01)
+
+
+def test_small_image_is_kept():
+    image = image_io.load_image(encode((200, 100), "PNG"))
+
+    assert image.size == (200, 100)
+
+
+def test_rejects_oversized_image(monkeypatch):
+    monkeypatch.setattr(image_io.env, "IMAGE_MAX_PIXELS", 1000 * 1000)
+
+    with pytest.raises(HandledError):
+        image_io.load_image(encode((1200, 1000), "JPEG"))
+
+
+def test_rejects_garbage():
+    with pytest.raises(HandledError):
+        image_io.load_image(b"not an image")
@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+import ai
+from ai.loader import ModelSpec, ModelStore, model_leases
+from etc.local_error import ServiceUnavailableError
+
+
+class FakeModel:
+    def __init__(self, weights: str) -> None:
+        with open(weights) as f:
+            self.model_id = f.read()
+
+
+@pytest.mark.asyncio
+async def test_models_unavailable_until_loaded():
+    store = ModelStore(ai.stub_model_loaders())
+
+    with pytest.raises(ServiceUnavailableError):
+        store["clip"]
+    assert store.status()["models"]["clip"]["state"] == "pending"
+
+    await store.load_all()
+
+    assert store.ready()
+    assert store["clip"].model_id == "stub@static"
+    status = store.status()["models"]["yolo"]
+    assert status["state"] == "ready"
+    assert status["version"] == "static"
+    assert status["load_seconds"] is not None
+
+
+@pytest.mark.asyncio
+async def test_failed_load_is_reported():
+    def broken():
+        raise FileNotFoundError("weights")
+
+    store = ModelStore({
+        "clip": ModelSpec(broken),
+        "yolo": ai.stub_model_loaders()["yolo"],
+    })
+    await store.load_all()
+
+    assert not store.ready()
+    assert store.status()["models"]["clip"]["state"] == "failed"
+    assert "weights" in store.status()["models"]["clip"]["error"]
+    assert store["yolo"].model_id == "stub@static"
+    with pytest.raises(ServiceUnavailableError):
+        store["clip"]
+
+
+@pytest.mark.asyncio
+async def test_reload_switches_and_drains(tmp_path, monkeypatch):
+    monkeypatch.setattr(ai.loader.env, "MODEL_DRAIN_TIMEOUT", 5)
+    weights = tmp_path / "weights.bin"
+    weights.write_text("v1")
+    store = ModelStore({
+        "forecast": ModelSpec(lambda: FakeModel(str(weights)), (str(weights),))
+    })
+    await store.load_all()
+    first_version = store.status()["models"]["forecast"]["version"]
+
+    # unchanged weights are not reloaded
+    assert not await store.reload("forecast")
+
+    with model_leases() as leases:
+        old = store["forecast"]
+        assert old.model_id.startswith("v1@")
+
+        weights.write_text("v2 weights")
+        assert await store.reload("forecast")
+
+        # this request keeps the version it started with
+        assert store["forecast"] is old
+        assert leases["forecast"].version == first_version
+        assert store.status()["models"]["forecast"]["draining"][0]["in_flight"] == 1
+
+    assert store["forecast"].model_id.startswith("v2 weights@")
+    await asyncio.sleep(0.05)
+    assert store.status()["models"]["forecast"]["draining"] == []
+
+
+@pytest.mark.asyncio
+async def test_failed_reload_keeps_active_version(tmp_path):
+    weights = tmp_path / "weights.bin"
+    weights.write_text("v1")
+    store = ModelStore({
+        "forecast": ModelSpec(lambda: FakeModel(str(weights)), (str(weights),))
+    })
+    await store.load_all()
+    version = store.status()["models"]["forecast"]["version"]
+
+    weights.unlink()
+    assert not await store.reload("forecast", force=True)
+
+    status = store.status()["models"]["forecast"]
+    assert status["state"] == "ready"
+    assert status["version"] == version
+    assert "FileNotFoundError" in status["error"]
+    assert store["forecast"].model_id.startswith("v1@")
+
+
+@pytest.mark.asyncio
+async def test_drain_timeout_keeps_model_until_released(tmp_path, monkeypatch):
+    monkeypatch.setattr(ai.loader.env, "MODEL_DRAIN_TIMEOUT", 0.01)
+    weights = tmp_path / "weights.bin"
+    weights.write_text("v1")
+    store = ModelStore({
+        "forecast": ModelSpec(lambda: FakeModel(str(weights)), (str(weights),))
+    })
+    await store.load_all()
+
+    with model_leases() as leases:
+        store["forecast"]
+        old = leases["forecast"]
+
+        weights.write_text("v2 weights")
+        assert await store.reload("forecast")
+        await asyncio.sleep(0.05)
+
+        # out of the slot, still usable by the request holding it
+        assert store.status()["models"]["forecast"]["draining"] == []
+        assert store["forecast"].model_id.startswith("v1@")
+
+    assert old.model is None
@@ -0,0 +1,93 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import ai
+import ai.server
+from ai import remote
+from ai.server import InferenceServer
+from etc.local_error import ServiceUnavailableError
+
+
+def test_pack_arrays_roundtrip():
+    arrays = [
+        np.arange(12, dtype=np.uint8).reshape(2, 2, 3),
+        np.ones((3, 4), dtype=np.float32),
+    ]
+
+    shm, meta = remote.pack_arrays(arrays)
+    try:
+        views = remote.view_arrays(shm.buf, meta)
+        for view, array in zip(views, arrays):
+            assert view.dtype == array.dtype
+            assert np.array_equal(view, array)
+        del views, view
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+async def encode_text(socket_path: str, texts: list[str]):
+    server = asyncio.ensure_future(
+        InferenceServer(ai.load_all_stub_model()).serve(socket_path)
+    )
+    await asyncio.sleep(0.1)
+
+    client = remote.InferenceClient(socket_path)
+
+    def call():
+        try:
+            return remote.RemoteOpenCLIP(client).encode_text(texts)
+        finally:
+            client.close()
+
+    try:
+        # the client blocks, keep it off the loop the server runs on
+        return await asyncio.to_thread(call)
+    finally:
+        # let the server see the closed connection
+        await asyncio.sleep(0.1)
+        server.cancel()
+
+
+@pytest.mark.asyncio
+async def test_client_roundtrip(tmp_path):
+    embeds = await encode_text(str(tmp_path / "inference.sock"), ["a", "b"])
+
+    assert embeds.shape == (2, 768)
+    assert embeds.flags.writeable
+
+
+@pytest.mark.asyncio
+async def test_client_raises_server_503(tmp_path, monkeypatch):
+    async def full(model, text):
+        raise ServiceUnavailableError("Inference queue is full", 7)
+
+    monkeypatch.setattr(ai.server.batching, "encode_text", full)
+
+    with pytest.raises(ServiceUnavailableError) as e:
+        await encode_text(str(tmp_path / "inference.sock"), ["a"])
+    assert e.value.retry_after == 7
+
+
+@pytest.mark.asyncio
+async def test_client_times_out(tmp_path, monkeypatch):
+    async def stuck(model, text):
+        await asyncio.sleep(0.15)
+        return np.zeros(768, dtype=np.float32)
+
+    monkeypatch.setattr(ai.server.batching, "encode_text", stuck)
+    monkeypatch.setattr(remote.env, "INFERENCE_SERVER_TIMEOUT", 0.05)
+
+    with pytest.raises(ServiceUnavailableError):
+        await encode_text(str(tmp_path / "inference.sock"), ["a"])
+
+
+def test_server_loads_local_models(monkeypatch):
+    # the server shares the env file that points the workers at its socket
+    monkeypatch.setattr(ai.env, "INFERENCE_SERVER_SOCKET", "/tmp/inference.sock")
+
+    assert isinstance(ai.model_loaders()["clip"].load(), remote.RemoteOpenCLIP)
+    for spec in ai.local_model_loaders().values():
+        assert spec.files
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+import db.postgresql.models.product as prod
+from db.postgresql import embedding_version
+from test.unit_test.services.vectors import EMBED_DIMS, unit_vectors
+
+
+@pytest.fixture()
+def catalog_factory():
+    # products {type}_Item0 .. {type}_Item{size - 1} with random unit vectors,
+    # the types take turns
+    async def make(
+        session_maker,
+        size: int,
+        types: tuple[prod.ProductType, ...] = (prod.ProductType.VEGETABLE,),
+        seed: int = 7,
+    ) -> dict[str, np.ndarray]:
+        rng = np.random.default_rng(seed)
+        vectors = {c: unit_vectors(rng, size, dim) for c, dim in EMBED_DIMS.items()}
+        ids = [f"{types[i % len(types)].value}_Item{i}" for i in range(size)]
+
+        async with session_maker() as ss, ss.begin():
+            for i, prod_id in enumerate(ids):
+                ss.add(
+                    prod.Product(
+                        id=prod_id,
+                        product_name=f"Item {i}",
+                        available_quantity=0,
+                        product_types=types[i % len(types)],
+                        product_status=prod.ProductStatus.IN_STOCK,
+                        image_url="",
+                    )
+                )
+            await ss.flush()
+            for i, prod_id in enumerate(ids):
+                await embedding_version.write(
+                    ss,
+                    prod.ProductEmbedding,
+                    prod_id,
+                    {c: v[i] for c, v in vectors.items()},
+                )
+
+        return vectors
+
+    return make
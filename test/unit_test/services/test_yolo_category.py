@@ -0,0 +1,32 @@
+import pytest
+from pydantic import ValidationError
+
+import db.postgresql.models.product as prod
+import services.search_backend as search_backend
+from config import Environment
+from services.search_backend import yolo_category
+
+@pytest.mark.parametrize(
+    "name, confidence, expected",
+    [
+        ("beef", 0.95, prod.ProductType.MEAT),
+        ("beef", 0.5, None),
+        ("plate", 0.95, None),
+    ],
+)
+def test_yolo_category(monkeypatch, name, confidence, expected):
+    monkeypatch.setattr(
+        search_backend.env, "YOLO_CATEGORY_MAP", {"beef": prod.ProductType.MEAT}
+    )
+    monkeypatch.setattr(search_backend.env, "YOLO_CATEGORY_CONFIDENCE", 0.8)
+
+    assert yolo_category([{"name": name, "confidence": confidence}]) == expected
+    assert yolo_category([]) is None
+
+
+def test_yolo_category_map_validated_on_load():
+    env = Environment(YOLO_CATEGORY_MAP={"beef": "MEAT"})
+    assert env.YOLO_CATEGORY_MAP == {"beef": prod.ProductType.MEAT}
+
+    with pytest.raises(ValidationError):
+        Environment(YOLO_CATEGORY_MAP={"beef": "BEEF"})
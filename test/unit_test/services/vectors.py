@@ -0,0 +1,12 @@
+import numpy as np
+
+EMBED_DIMS = {
+    "images_embed_yolo": 512,
+    "images_embed_clip": 768,
+    "description_embed": 768,
+}
+
+
+def unit_vectors(rng, n: int, dim: int) -> np.ndarray:
+    vec = rng.standard_normal((n, dim)).astype(np.float32)
+    return vec / np.linalg.norm(vec, axis=1, keepdims=True)